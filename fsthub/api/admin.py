@@ -2,10 +2,13 @@ from django.contrib import admin
 
 from .models import (ProjectMetadata, 
                      FstType, FstTypeRelation,
-                     FstLanguage, FstLanguageRelation)
+                     FstLanguage, FstLanguageRelation,
+                     FstMetadata, Transducer)
 
+admin.site.register(Transducer)
 admin.site.register(FstLanguageRelation)
 admin.site.register(FstTypeRelation)
 admin.site.register(FstLanguage)
 admin.site.register(FstType)
 admin.site.register(ProjectMetadata)
+admin.site.register(FstMetadata)
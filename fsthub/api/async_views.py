@@ -0,0 +1,133 @@
+"""Async versions of the transducer call, metadata and example endpoints.
+
+These are plain Django async views, as DRF viewsets can't be async.
+Under ASGI they run on the event loop and await hfst processes instead of
+blocking a thread per call. Under WSGI Django wraps them with
+async_to_sync, so they work in both deployments.
+"""
+from typing import Optional
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+
+from hfst_adaptor.acall import acall_hfst
+from hfst_adaptor.exceptions import HfstException, HfstOverloaded
+from project_reader import file_exists
+from .serializers import FstRequest, FstCallRequestSerializer, FstExampleRequestSerializer
+from .examples import sample_examples
+from .metadata import get_metadata
+from .output import hfst_format, format_output
+from .conditional import conditional, fst_etag, fst_last_modified
+from .views import (
+    CsrfDisableAuthentication, FstBurstThrottle, FstSustainedThrottle, hfst_error_status
+)
+
+def json_response(data: dict, status: int = status.HTTP_200_OK) -> JsonResponse:
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+def _throttle_wait(request) -> Optional[float]:
+    """Run the same throttles as the sync API, seconds to wait if throttled"""
+    drf_request = Request(request, authenticators=[CsrfDisableAuthentication()])
+    waits = []
+    for throttle in (FstBurstThrottle(), FstSustainedThrottle()):
+        if not throttle.allow_request(drf_request, None):
+            waits.append(throttle.wait())
+    if not waits:
+        return None
+    return max((w for w in waits if w is not None), default=0)
+
+async def throttled_response(request) -> Optional[JsonResponse]:
+    # the throttle history is in the shared cache, no need to queue on the main thread
+    wait = await sync_to_async(_throttle_wait, thread_sensitive=False)(request)
+    if wait is None:
+        return None
+    exc = Throttled(wait)
+    response = json_response({'detail': str(exc.detail)}, status=exc.status_code)
+    response['Retry-After'] = str(int(wait))
+    return response
+
+def hfst_error_response(e: HfstException) -> JsonResponse:
+    response = json_response({
+        'details': str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
+    }, status=hfst_error_status(e))
+    if isinstance(e, HfstOverloaded):
+        response['Retry-After'] = str(math.ceil(e.retry_after))
+    return response
+
+@csrf_exempt
+@require_POST
+async def call(request):
+    throttled = await throttled_response(request)
+    if throttled is not None:
+        return throttled
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        return json_response({'detail': f'JSON parse error - {e}'},
+                             status=status.HTTP_400_BAD_REQUEST)
+    serializer = FstCallRequestSerializer(data=data)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        output = await acall_hfst(
+            settings.HFST_CONTENT_ROOT / serializer.data['hfst_file'],
+            serializer.data['fst_input'].split(),
+            oformat=hfst_format(serializer.data['output_format'])
+        )
+        return json_response({'output': format_output(output, serializer.data['output_format'])})
+    except HfstException as e:
+        return hfst_error_response(e)
+
+@require_GET
+@conditional(fst_etag, fst_last_modified)
+async def metadata(request):
+    throttled = await throttled_response(request)
+    if throttled is not None:
+        return throttled
+    serializer = FstRequest(data=request.GET)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    if not file_exists(serializer.data['hfst_file']):
+        return json_response({
+            'details': 'FST does not exist'
+        }, status=status.HTTP_404_NOT_FOUND)
+    try:
+        # the same stored rows as the sync API, refreshed when the file changed
+        metadata = await sync_to_async(get_metadata)(serializer.data['hfst_file'])
+        return json_response({'metadata': metadata})
+    except HfstException as e:
+        return hfst_error_response(e)
+
+@require_GET
+async def example(request):
+    throttled = await throttled_response(request)
+    if throttled is not None:
+        return throttled
+    serializer = FstExampleRequestSerializer(data=request.GET)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    if not file_exists(serializer.data['hfst_file']):
+        return json_response({
+            'details': 'FST does not exist'
+        }, status=status.HTTP_404_NOT_FOUND)
+    try:
+        # the pool lives in the DB and is built in the background, requests never run hfst
+        examples = await sync_to_async(sample_examples, thread_sensitive=False)(
+            serializer.data['hfst_file'],
+            count=serializer.data.get('count', 1),
+            seed=serializer.data.get('seed'),
+        )
+        response = {'example': examples[0]}
+        if 'count' in serializer.data:
+            response['examples'] = examples
+        return json_response(response)
+    except HfstException as e:
+        return hfst_error_response(e)
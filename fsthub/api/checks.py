@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+@register()
+def check_pipeline_stages(app_configs, **kwargs):
+    """A pipeline holds an admission slot per distinct transducer, it could never run with fewer slots"""
+    errors = []
+    if not settings.HFST_ADMISSION_ENABLED:
+        return errors
+    if settings.HFST_PIPELINE_MAX_STAGES > settings.HFST_ADMISSION_SLOTS:
+        errors.append(Error(
+            f'HFST_PIPELINE_MAX_STAGES ({settings.HFST_PIPELINE_MAX_STAGES}) is larger than '
+            f'HFST_ADMISSION_SLOTS ({settings.HFST_ADMISSION_SLOTS})',
+            hint='Lower HFST_PIPELINE_MAX_STAGES or raise HFST_ADMISSION_SLOTS.',
+            id='api.E001',
+        ))
+    if settings.HFST_ADMISSION_SLOTS_PER_FILE < 1:
+        errors.append(Error(
+            f'HFST_ADMISSION_SLOTS_PER_FILE ({settings.HFST_ADMISSION_SLOTS_PER_FILE}) '
+            f'admits no calls',
+            hint='Set HFST_ADMISSION_SLOTS_PER_FILE to 1 or more.',
+            id='api.E001',
+        ))
+    return errors
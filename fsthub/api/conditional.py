@@ -0,0 +1,191 @@
+"""Conditional GET of listings, metadata and examples.
+
+Responses carry a strong ETag derived from what they are built from:
+the content root (`Inventory.digest`), the size and mtime of a
+transducer, and `CatalogRevision` for data in the DB. A client or proxy
+sending the ETag back in `If-None-Match` gets `304 Not Modified` while
+nothing changed. `Cache-Control` lets them keep the body for as long, but
+revalidate it after `HFST_CONDITIONAL_MAX_AGE` seconds.
+
+Validators are equal in every worker process, so a 304 doesn't depend on
+which worker answers. Views given `tags` also keep their response data in
+the shared cache under the ETag, so other workers don't compute it again.
+The tags let `shared_cache.ContentWatcher` drop entries of changed files.
+"""
+from typing import Callable, Iterable, List, Optional
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import os
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from rest_framework.response import Response
+
+from project_reader import get_inventory, file_exists
+from shared_cache import fst_tags, get_response_cache, start_watcher
+from .models import (
+    CatalogRevision, ProjectMetadata, Transducer, FstMetadata,
+    FstType, FstLanguage, FstTypeRelation, FstLanguageRelation, FstExamplePool
+)
+
+# metadata rows are refreshed lazily when a file changes, search follows them too
+CATALOG_MODELS = [ProjectMetadata, Transducer, FstMetadata, FstType, FstLanguage,
+                  FstTypeRelation, FstLanguageRelation]
+
+def catalog_revision() -> int:
+    row = CatalogRevision.objects.filter(pk=1).only('revision').first()
+    return row.revision if row is not None else 0
+
+def bump_catalog_revision() -> None:
+    """Invalidate validators of DB data, called on every catalog change.
+    Bulk operations don't send signals and must call it themselves.
+    """
+    if not CatalogRevision.objects.filter(pk=1).update(revision=F('revision') + 1):
+        CatalogRevision.objects.get_or_create(pk=1, defaults={'revision': 1})
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate_tags(['catalog'])
+
+def _catalog_changed(sender, **kwargs) -> None:
+    bump_catalog_revision()
+
+def connect_signals() -> None:
+    for model in CATALOG_MODELS:
+        post_save.connect(_catalog_changed, sender=model, dispatch_uid=f'catalog-save-{model.__name__}')
+        post_delete.connect(_catalog_changed, sender=model, dispatch_uid=f'catalog-delete-{model.__name__}')
+
+def make_etag(request, *parts) -> str:
+    # the browsable API and JSON renderings of a view differ
+    media_type = getattr(request, 'accepted_media_type', '') or ''
+    h = hashlib.sha1(media_type.encode())
+    for part in parts:
+        h.update(b'\0' + str(part).encode())
+    return f'"{h.hexdigest()}"'
+
+def _query_fst(request) -> Optional[str]:
+    fst_file = request.GET.get('hfst_file')
+    if not fst_file or not file_exists(fst_file):
+        return None
+    return fst_file
+
+def _fst_stat(fst_file: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(settings.HFST_CONTENT_ROOT / fst_file)
+    except OSError:
+        return None
+
+# Validators, called with the arguments of the view
+def inventory_etag(request, *args, **kwargs) -> str:
+    return make_etag(request, request.get_full_path(), get_inventory().digest)
+
+def catalog_etag(request, *args, **kwargs) -> str:
+    return make_etag(request, request.get_full_path(),
+                     get_inventory().digest, catalog_revision())
+
+def fst_etag(request, *args, **kwargs) -> Optional[str]:
+    fst_file = _query_fst(request)
+    st = _fst_stat(fst_file) if fst_file else None
+    if st is None:
+        return None
+    return make_etag(request, request.get_full_path(), fst_file, st.st_size, st.st_mtime_ns)
+
+def fst_last_modified(request, *args, **kwargs) -> Optional[datetime]:
+    fst_file = _query_fst(request)
+    st = _fst_stat(fst_file) if fst_file else None
+    if st is None:
+        return None
+    return datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+
+def fsts_etag(request, *args, **kwargs) -> str:
+    """Validator of views of several transducers listed in `hfst_file`"""
+    stats = []
+    for fst_file in sorted(set(request.GET.getlist('hfst_file'))):
+        st = _fst_stat(fst_file) if file_exists(fst_file) else None
+        stats.append((fst_file, st.st_size, st.st_mtime_ns) if st is not None else (fst_file,))
+    return make_etag(request, request.get_full_path(), get_inventory().digest, *stats)
+
+def example_etag(request, *args, **kwargs) -> Optional[str]:
+    """Only seeded examples repeat, they depend on the stored pool"""
+    fst_file = _query_fst(request)
+    if fst_file is None or not request.GET.get('seed'):
+        return None
+    pool = FstExamplePool.objects.filter(fst_file=fst_file).only('size', 'mtime_ns').first()
+    if pool is None:
+        return None
+    return make_etag(request, request.get_full_path(), pool.size, pool.mtime_ns)
+
+def static_etag(value: Iterable) -> Callable[..., str]:
+    """Validator of a view whose output only changes with the code"""
+    return lambda request, *args, **kwargs: make_etag(request, request.get_full_path(), value)
+
+# Tags of cached responses, called with the arguments of the view
+def inventory_tags(request, *args, **kwargs) -> List[str]:
+    return ['inventory']
+
+def catalog_tags(request, *args, **kwargs) -> List[str]:
+    return ['inventory', 'catalog']
+
+def project_tags(request, *args, **kwargs) -> List[str]:
+    return [f'project:{request.GET.get("project", "").strip("/").split("/", 1)[0]}']
+
+def fsts_tags(request, *args, **kwargs) -> List[str]:
+    return [tag for fst_file in request.GET.getlist('hfst_file') for tag in fst_tags(fst_file)]
+
+def cached(func: Callable, tags_func: Callable) -> Callable:
+    """Keep data of successful DRF responses in the shared cache under their ETag"""
+    @wraps(func)
+    def inner(request, *args, **kwargs):
+        cache = get_response_cache()
+        etag = getattr(request, 'validator', None)
+        if cache is None or etag is None:
+            return func(request, *args, **kwargs)
+        start_watcher()
+        key = f'response:{etag}'
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = func(request, *args, **kwargs)
+        if isinstance(response, Response) and response.status_code == 200:
+            cache.set_tagged(key, response.data, tags_func(request, *args, **kwargs),
+                             timeout=settings.HFST_RESPONSE_CACHE_TIMEOUT)
+        return response
+    return inner
+
+def conditional(etag_func: Callable, last_modified_func: Optional[Callable] = None,
+                tags: Optional[Callable] = None):
+    """`condition` that also marks validated responses as cacheable,
+    and caches them in the shared cache if `tags` are given
+    """
+    def decorator(func):
+        def validator(request, *args, **kwargs):
+            # the cache below reuses it instead of computing it again
+            request.validator = etag_func(request, *args, **kwargs)
+            return request.validator
+
+        view = func if tags is None else cached(func, tags)
+        view = condition(etag_func=validator, last_modified_func=last_modified_func)(view)
+
+        def add_cache_control(response):
+            if response.has_header('ETag') and response.status_code in (200, 304):
+                if settings.HFST_CONDITIONAL_MAX_AGE:
+                    patch_cache_control(response, public=True,
+                                        max_age=settings.HFST_CONDITIONAL_MAX_AGE)
+                else:
+                    patch_cache_control(response, public=True, no_cache=True)
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(func)
+            async def inner(request, *args, **kwargs):
+                return add_cache_control(await view(request, *args, **kwargs))
+        else:
+            @wraps(func)
+            def inner(request, *args, **kwargs):
+                return add_cache_control(view(request, *args, **kwargs))
+        return inner
+    return decorator
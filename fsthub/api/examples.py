@@ -0,0 +1,122 @@
+"""Precomputed example pools for /api/fst/example.
+
+A few hundred random paths of a transducer are generated once with
+`hfst-fst2strings --random` and stored in the DB, requests only sample
+from the stored pool and never run hfst. Pools are built by
+`projectsautoinit`. A missing pool is built in the background while
+requests are answered with 503 and Retry-After, a pool of a changed file
+keeps being served while a new one is built. Every process keeps the
+pools it decoded, a request only reads their size and mtime from the DB.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+import random
+
+from django.conf import settings
+from django.db import connections
+
+from hfst_adaptor.call import call_example_pool
+from hfst_adaptor.parse import parse_example
+from hfst_adaptor.exceptions import HfstException, HfstOverloaded
+from .metadata import fst_stat
+from .models import FstExamplePool
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: Set[str] = set()
+_lock = threading.Lock()
+# fst_file -> (size, mtime_ns, examples) of decoded pools
+_decoded: Dict[str, Tuple[int, int, List[List[str]]]] = {}
+
+def generate_examples(fst_file: str, count: int) -> List[List[str]]:
+    """Up to `count` random `[input, output]` pairs straight from the transducer"""
+    lines = call_example_pool(settings.HFST_CONTENT_ROOT / fst_file, count)
+    examples = []
+    for line in lines:
+        try:
+            item = parse_example(line)
+        except ValueError:
+            # ':' inside of a symbol, can't tell input from output
+            continue
+        examples.append([item.inp, item.out])
+    return examples
+
+def read_example_pool(fst_file: str) -> Tuple[str, int, int, Optional[List[List[str]]], Optional[str]]:
+    """Generate a pool without touching the DB, so it can run in worker processes.
+    Returns `(fst_file, size, mtime_ns, examples, error)`, examples are None on error.
+    """
+    try:
+        size, mtime_ns = fst_stat(fst_file)
+        examples = generate_examples(fst_file, settings.HFST_EXAMPLE_POOL_SIZE)
+    except (HfstException, OSError) as e:
+        return fst_file, 0, 0, None, str(e)
+    return fst_file, size, mtime_ns, examples, None
+
+def build_example_pool(fst_file: str) -> List[List[str]]:
+    """Generate and store a new pool of `[input, output]` pairs"""
+    size, mtime_ns = fst_stat(fst_file)
+    examples = generate_examples(fst_file, settings.HFST_EXAMPLE_POOL_SIZE)
+    FstExamplePool.objects.update_or_create(
+        fst_file=fst_file,
+        defaults={'size': size, 'mtime_ns': mtime_ns, 'examples': examples}
+    )
+    return examples
+
+def _rebuild(fst_file: str) -> None:
+    try:
+        build_example_pool(fst_file)
+    except (HfstException, OSError) as e:
+        logger.warning(f'Failed to build example pool of {fst_file}: {e}')
+    finally:
+        with _lock:
+            _pending.discard(fst_file)
+        connections.close_all()
+
+def schedule_rebuild(fst_file: str) -> None:
+    """Build a pool in the background, at most once at a time per transducer"""
+    global _executor
+    with _lock:
+        if fst_file in _pending:
+            return
+        _pending.add(fst_file)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='example-pool')
+    _executor.submit(_rebuild, fst_file)
+
+def get_examples(fst_file: str) -> Optional[List[List[str]]]:
+    """Stored pool, `None` while it's being built"""
+    version = FstExamplePool.objects.filter(fst_file=fst_file).values_list('size', 'mtime_ns').first()
+    if version is None:
+        schedule_rebuild(fst_file)
+        return None
+    if version != fst_stat(fst_file):
+        schedule_rebuild(fst_file)
+    decoded = _decoded.get(fst_file)
+    if decoded is not None and decoded[:2] == version:
+        return decoded[2]
+    row = FstExamplePool.objects.filter(fst_file=fst_file).first()
+    if row is None:
+        return None
+    _decoded[fst_file] = (row.size, row.mtime_ns, row.examples)
+    return row.examples
+
+def sample_examples(fst_file: str, count: int = 1,
+                    seed: Optional[int] = None) -> List[Dict[str, str]]:
+    """`count` distinct examples, the same ones for the same `seed`.
+    Raises HfstOverloaded while the pool is being built, HfstException if there are no examples.
+    """
+    examples = get_examples(fst_file)
+    if examples is None:
+        raise HfstOverloaded(f'Examples of {fst_file} are being prepared',
+                             settings.HFST_EXAMPLE_RETRY_AFTER)
+    if not examples:
+        raise HfstException(f'hfst-fst2strings: no examples in {fst_file}')
+    rng = random.Random(seed) if seed is not None else random
+    if count == 1:
+        picked = [rng.choice(examples)]
+    else:
+        picked = rng.sample(examples, min(count, len(examples)))
+    return [{'input': inp, 'output': out} for inp, out in picked]
@@ -1,14 +1,22 @@
-from typing import List, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import multiprocessing
+import time
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.db.utils import IntegrityError
 from django.conf import settings
-from api.models import ProjectMetadata, FstType, FstTypeRelation, FstLanguage, FstLanguageRelation
+from api.models import (
+    ProjectMetadata, FstMetadata, FstExamplePool, Transducer, FstFilter, FstFilterRelation,
+    FstType, FstTypeRelation, FstLanguage, FstLanguageRelation
+)
+from api.metadata import fst_stat, get_metadata_many, read_metadata, read_header_metadata
+from api.examples import read_example_pool
+from api.conditional import bump_catalog_revision
+from hfst_adaptor.convert import prepare_transducer, prune_converted
 
 from project_reader import get_all_fsts, get_projects
-from hfst_adaptor.call import call_metadata_extractor
-from hfst_adaptor.parse import parse_metadata
-from hfst_adaptor.exceptions import HfstException
 
 class Command(BaseCommand):
     help = "Read projects from HFST_CONTENT_ROOT and init missing ones in the DB"
@@ -28,54 +36,164 @@ class Command(BaseCommand):
                     break
         return types
     
-    def detect_language(self, file_name: str) -> str:
-        try:
-            metadata = call_metadata_extractor(settings.HFST_CONTENT_ROOT / file_name)
-        except HfstException as e:
-            self.stdout.write(
-                self.style.WARNING(f"Failed to read metadata: `{file_name}`: {e}")
-            )
-            return
-        parsed = parse_metadata(metadata, lower_keys=True)
+    def detect_language(self, metadata: Dict[str, str]) -> Optional[str]:
+        parsed = {k.lower(): v for k, v in metadata.items()}
         language = None
         for lang_key in settings.HFST_METADATA_LANG_KEYS:
             if lang_key in parsed:
                 language = parsed[lang_key]
                 break
         return language
-    
-    def add_lang_relation(self, lang_name: str, file_name: str) -> None:
-        lang_name = lang_name.lower()
-        lang_obj, lang_created = FstLanguage.objects.get_or_create(name=lang_name)
-        if lang_created:
-            self.stdout.write(
-                self.style.SUCCESS(f"[CREATED] language `{lang_name}`")
-            )
-        _, relation_created = FstLanguageRelation.objects.get_or_create(fst_file=file_name, language=lang_obj)
-        if relation_created:
-            self.stdout.write(
-                self.style.SUCCESS(f"[CREATED] lang relation `{file_name}` -> `{lang_name}`")
-            )
+
+    def read_metadata(self, fst_files: List[str], workers: int) -> Dict[str, Dict[str, str]]:
+        """Metadata of all transducers, only new and changed files are read"""
+        rows = get_metadata_many(fst_files)
+        metadata, outdated = {}, []
+        for fst in fst_files:
+            row = rows.get(fst)
+            try:
+                fresh = row is not None and row.is_fresh(*fst_stat(fst))
+            except OSError:
+                fresh = False
+            if fresh:
+                metadata[fst] = row.metadata
+            else:
+                outdated.append(fst)
+        self.stdout.write(
+            f'Reading metadata of {len(outdated)} transducers ({len(metadata)} up to date)'
+        )
+        if not outdated:
+            return metadata
+
+        new_rows = []
+        step = max(1, len(outdated) // 10)
+        done = 0
+        def collect(results: Iterable[tuple]) -> None:
+            nonlocal done
+            for fst, size, mtime_ns, meta, error in results:
+                done += 1
+                if error is not None:
+                    self.stdout.write(
+                        self.style.WARNING(f"Failed to read metadata: `{fst}`: {error}")
+                    )
+                else:
+                    metadata[fst] = meta
+                    new_rows.append(FstMetadata(fst_file=fst, size=size,
+                                                mtime_ns=mtime_ns, metadata=meta))
+                if done % step == 0 or done == len(outdated):
+                    self.stdout.write(f'[{done}/{len(outdated)}] metadata read')
+
+        # HFST3 headers are read here, only older formats need hfst-edit-metadata
+        headerless = []
+        for fst in outdated:
+            result = read_header_metadata(fst)
+            if result is None:
+                headerless.append(fst)
+            else:
+                collect([result])
+
+        if workers > 1 and len(headerless) > 1:
+            # the workers only run hfst and never touch the DB
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                chunksize = max(1, len(headerless) // (workers * 4))
+                collect(pool.map(read_metadata, headerless, chunksize=chunksize))
         else:
-            self.stdout.write(
-                self.style.SUCCESS(f"[ALREADY EXISTS] lang relation `{file_name}` -> `{lang_name}`")
-            )
-    
-    def add_type_relation(self, type_name: str, file_name: str) -> None:
-        type_obj, type_created = FstType.objects.get_or_create(name=type_name)
-        if type_created:
-            self.stdout.write(
-                self.style.SUCCESS(f"[CREATED] type `{type_name}`")
-            )
-        _, relation_created = FstTypeRelation.objects.get_or_create(fst_file=file_name, type=type_obj)
-        if relation_created:
-            self.stdout.write(
-                self.style.SUCCESS(f"[CREATED] type relation `{file_name}` -> `{type_name}`")
-            )
+            collect(map(read_metadata, headerless))
+
+        FstMetadata.objects.bulk_create(
+            new_rows, batch_size=500,
+            update_conflicts=True, unique_fields=['fst_file'],
+            update_fields=['size', 'mtime_ns', 'metadata']
+        )
+        return metadata
+
+    def convert_transducers(self, fst_files: List[str], workers: int) -> None:
+        """Make optimized lookup copies of transducers hfst-proc can't read,
+        and delete copies of transducers that are gone or changed
+        """
+        if not settings.HFST_CONVERT_ENABLED:
+            return
+        paths = [settings.HFST_CONTENT_ROOT / fst for fst in fst_files]
+        if workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                chunksize = max(1, len(paths) // (workers * 4))
+                targets = list(pool.map(prepare_transducer, paths, chunksize=chunksize))
         else:
-            self.stdout.write(
-                self.style.SUCCESS(f"[ALREADY EXISTS] type relation `{file_name}` -> `{type_name}`")
-            )
+            targets = list(map(prepare_transducer, paths))
+        copies = {t for p, t in zip(paths, targets) if t is not None and t != p}
+        removed = prune_converted(copies)
+        self.stdout.write(
+            f'{len(copies)} transducers run from optimized lookup copies ({removed} stale removed)'
+        )
+
+    def build_example_pools(self, fst_files: List[str], workers: int) -> None:
+        """Example pools of new and changed transducers, requests only sample from them"""
+        pools = {x.fst_file: x for x in FstExamplePool.objects.filter(fst_file__in=fst_files)
+                                                              .only('fst_file', 'size', 'mtime_ns')}
+        outdated = []
+        for fst in fst_files:
+            pool = pools.get(fst)
+            try:
+                if pool is None or not pool.is_fresh(*fst_stat(fst)):
+                    outdated.append(fst)
+            except OSError:
+                continue
+        self.stdout.write(
+            f'Building example pools of {len(outdated)} transducers '
+            f'({len(fst_files) - len(outdated)} up to date)'
+        )
+        if not outdated:
+            return
+        if workers > 1 and len(outdated) > 1:
+            # the workers only run hfst and never touch the DB
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                chunksize = max(1, len(outdated) // (workers * 4))
+                results = list(pool.map(read_example_pool, outdated, chunksize=chunksize))
+        else:
+            results = list(map(read_example_pool, outdated))
+        new_rows = []
+        for fst, size, mtime_ns, examples, error in results:
+            if error is not None:
+                self.stdout.write(
+                    self.style.WARNING(f"Failed to build example pool: `{fst}`: {error}")
+                )
+            else:
+                new_rows.append(FstExamplePool(fst_file=fst, size=size,
+                                               mtime_ns=mtime_ns, examples=examples))
+        FstExamplePool.objects.bulk_create(
+            new_rows, batch_size=500,
+            update_conflicts=True, unique_fields=['fst_file'],
+            update_fields=['size', 'mtime_ns', 'examples']
+        )
+
+    def get_or_create_filters(self, model: Type[FstFilter], names: Set[str]) -> Dict[str, FstFilter]:
+        existing = {x.name: x for x in model.objects.filter(name__in=names)}
+        missing = names.difference(existing)
+        if missing:
+            model.objects.bulk_create([model(name=name) for name in sorted(missing)])
+            for name in sorted(missing):
+                self.stdout.write(
+                    self.style.SUCCESS(f"[CREATED] {model._meta.verbose_name} `{name}`")
+                )
+            existing = {x.name: x for x in model.objects.filter(name__in=names)}
+        return existing
+
+    def get_or_create_transducers(self, fst_files: List[str]) -> Dict[str, Transducer]:
+        Transducer.objects.bulk_create(
+            [Transducer(fst_file=fst) for fst in fst_files],
+            batch_size=500, ignore_conflicts=True
+        )
+        return {x.fst_file: x for x in Transducer.objects.filter(fst_file__in=fst_files)}
+
+    def add_relations(self, model: Type[FstFilterRelation], field: str,
+                      relations: Set[Tuple[Transducer, FstFilter]]) -> int:
+        """Bulk insert `(transducer, filter)` relations, returns how many were new"""
+        before = model.objects.count()
+        model.objects.bulk_create(
+            [model(transducer=fst, **{field: obj}) for fst, obj in relations],
+            batch_size=500, ignore_conflicts=True
+        )
+        return model.objects.count() - before
 
     def init_projects(self):
         filesystem_projects = set(get_projects())
@@ -86,26 +204,65 @@ class Command(BaseCommand):
                 self.style.SUCCESS(f'No new projects found')
             )
             return
-        for proj in db_missing:
-            ProjectMetadata.objects.create(directory=proj)
+        ProjectMetadata.objects.bulk_create(
+            [ProjectMetadata(directory=proj) for proj in sorted(db_missing)],
+            ignore_conflicts=True
+        )
+        for proj in sorted(db_missing):
             self.stdout.write(
                 self.style.SUCCESS(f"[CREATED] project '{proj}'")
             )
 
-    def init_transducers(self):
+    def init_transducers(self, workers: Optional[int] = None):
+        started = time.monotonic()
         filesystem_transducers = get_all_fsts()
         if len(filesystem_transducers) == 0:
             self.stdout.write(
                 self.style.NOTICE(f'No transducers found')
             )
             return
-        for fst in filesystem_transducers:
-            for t in self.detect_autotypes(fst):
-                self.add_type_relation(t, fst)
-            lang = self.detect_language(fst)
+        workers = settings.HFST_AUTOINIT_WORKERS if workers is None else workers
+        metadata = self.read_metadata(filesystem_transducers, workers)
+        self.convert_transducers(filesystem_transducers, workers)
+        # transducers whose metadata can't be read won't give examples either
+        self.build_example_pools(sorted(metadata), workers)
+
+        type_names = {fst: self.detect_autotypes(fst) for fst in filesystem_transducers}
+        lang_names = {}
+        for fst, meta in metadata.items():
+            lang = self.detect_language(meta)
             if lang:
-                self.add_lang_relation(lang, fst)
+                lang_names[fst] = lang.lower()
+
+        with transaction.atomic():
+            transducers = self.get_or_create_transducers(filesystem_transducers)
+            types = self.get_or_create_filters(
+                FstType, {t for names in type_names.values() for t in names}
+            )
+            langs = self.get_or_create_filters(FstLanguage, set(lang_names.values()))
+            types_created = self.add_relations(FstTypeRelation, 'type', {
+                (transducers[fst], types[t]) for fst, names in type_names.items() for t in names
+            })
+            langs_created = self.add_relations(FstLanguageRelation, 'language', {
+                (transducers[fst], langs[lang]) for fst, lang in lang_names.items()
+            })
+        self.stdout.write(
+            self.style.SUCCESS(f"[CREATED] {types_created} type relations, "
+                               f"{langs_created} lang relations")
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Initialized {len(filesystem_transducers)} transducers '
+                               f'in {time.monotonic() - started:.1f}s')
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.HFST_AUTOINIT_WORKERS,
+            help='Processes reading transducer metadata, 1 to read in this process'
+        )
 
     def handle(self, *args, **options):
         self.init_projects()
-        self.init_transducers()
+        self.init_transducers(options['workers'])
+        # bulk inserts send no signals, ETags of the catalog are renewed here
+        bump_catalog_revision()
@@ -0,0 +1,64 @@
+"""Transducer metadata stored in the DB.
+
+Rows are filled by `projectsautoinit` and refreshed lazily: a row is
+trusted while the file on disk keeps the size and mtime it was read
+with, otherwise the header is read again.
+"""
+from typing import Dict, Iterable, Optional, Tuple
+import os
+
+from django.conf import settings
+
+from hfst_adaptor.call import extract_metadata
+from hfst_adaptor.header import read_header
+from hfst_adaptor.optimized_lookup import UnsupportedTransducer
+from hfst_adaptor.exceptions import HfstException
+from .models import FstMetadata
+
+def fst_stat(fst_file: str) -> Tuple[int, int]:
+    st = os.stat(settings.HFST_CONTENT_ROOT / fst_file)
+    return st.st_size, st.st_mtime_ns
+
+def refresh_metadata(fst_file: str, row: Optional[FstMetadata] = None) -> Dict[str, str]:
+    """Read metadata from the transducer and store it.
+    Raises HfstException if it can't be read.
+    """
+    size, mtime_ns = fst_stat(fst_file)
+    if row is not None and row.is_fresh(size, mtime_ns):
+        return row.metadata
+    metadata = extract_metadata(settings.HFST_CONTENT_ROOT / fst_file)
+    FstMetadata.objects.update_or_create(
+        fst_file=fst_file,
+        defaults={'size': size, 'mtime_ns': mtime_ns, 'metadata': metadata}
+    )
+    return metadata
+
+def get_metadata(fst_file: str) -> Dict[str, str]:
+    row = FstMetadata.objects.filter(fst_file=fst_file).first()
+    return refresh_metadata(fst_file, row)
+
+def get_metadata_many(fst_files: Iterable[str]) -> Dict[str, FstMetadata]:
+    """Stored rows of many transducers in a single query, stale rows are not refreshed"""
+    return {row.fst_file: row for row in FstMetadata.objects.filter(fst_file__in=list(fst_files))}
+
+def read_metadata(fst_file: str) -> Tuple[str, int, int, Optional[Dict[str, str]], Optional[str]]:
+    """Read metadata without touching the DB, so it can run in worker processes.
+    Returns `(fst_file, size, mtime_ns, metadata, error)`, metadata is None on error.
+    """
+    try:
+        size, mtime_ns = fst_stat(fst_file)
+        metadata = extract_metadata(settings.HFST_CONTENT_ROOT / fst_file)
+    except (HfstException, OSError) as e:
+        return fst_file, 0, 0, None, str(e)
+    return fst_file, size, mtime_ns, metadata, None
+
+def read_header_metadata(fst_file: str) -> Optional[Tuple[str, int, int, Optional[Dict[str, str]], Optional[str]]]:
+    """`read_metadata` from the HFST3 header only, `None` for files without one"""
+    try:
+        size, mtime_ns = fst_stat(fst_file)
+        header = read_header(settings.HFST_CONTENT_ROOT / fst_file)
+    except UnsupportedTransducer:
+        return None
+    except OSError as e:
+        return fst_file, 0, 0, None, str(e)
+    return fst_file, size, mtime_ns, header.properties, None
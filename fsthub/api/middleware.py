@@ -0,0 +1,129 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from metrics import (
+    Counter, Histogram, current_endpoint,
+    start_timings, stop_timings, current_timings, server_timing_header
+)
+
+REQUESTS = Counter('fsthub_api_requests_total',
+                   'API responses by endpoint and status code', ['endpoint', 'status'])
+REQUEST_SECONDS = Histogram('fsthub_api_request_seconds',
+                            'Time to build an API response', ['endpoint'])
+THROTTLED = Counter('fsthub_api_throttled_total',
+                    'Requests rejected by throttling', ['endpoint'])
+
+class RequestMetricsMiddleware:
+    """Counts and times requests per endpoint (url name) and makes the
+    endpoint known to hfst_adaptor metrics through `current_endpoint`.
+    Streaming responses are timed until they start, their body is
+    produced after the request has left the middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        token = current_endpoint.set('')
+        try:
+            response = self.get_response(request)
+        finally:
+            current_endpoint.reset(token)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        token = current_endpoint.set('')
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_endpoint.reset(token)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match is not None:
+            current_endpoint.set(request.resolver_match.url_name or '')
+
+    @staticmethod
+    def record(request, response, seconds: float) -> None:
+        match = getattr(request, 'resolver_match', None)
+        # unresolved paths would make a label per scanned url
+        if match is None or not match.url_name:
+            return
+        endpoint = match.url_name
+        REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+        REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+        if response.status_code == 429:
+            THROTTLED.inc(endpoint=endpoint)
+
+class ServerTimingMiddleware:
+    """Adds `Server-Timing` with the time spent in each phase of the request:
+    parse, validate, throttle, file_check, spawn, exec, decode, render and
+    total. With `HFST_SERVER_TIMING_DEBUG` requests sent with
+    `X-Debug-Timing: 1` also get the phases, in milliseconds, under
+    `server_timing` of a JSON object body. Rendering happens after the
+    body is built, so it is only in the header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.HFST_SERVER_TIMING:
+            return self.get_response(request)
+        start = time.perf_counter()
+        token = start_timings()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = stop_timings(token)
+        return self.finish(response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not settings.HFST_SERVER_TIMING:
+            return await self.get_response(request)
+        start = time.perf_counter()
+        token = start_timings()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = stop_timings(token)
+        return self.finish(response, timings, time.perf_counter() - start)
+
+    def process_template_response(self, request, response):
+        timings = current_timings()
+        if timings is None:
+            return response
+        if settings.HFST_SERVER_TIMING_DEBUG and request.headers.get('X-Debug-Timing') == '1' \
+                and isinstance(getattr(response, 'data', None), dict):
+            response.data['server_timing'] = {
+                phase: round(seconds * 1000, 3) for phase, seconds in timings.items()
+            }
+        started = time.perf_counter()
+        def rendered(response):
+            timings['render'] = timings.get('render', 0.0) + time.perf_counter() - started
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def finish(response, timings, seconds: float):
+        timings['total'] = seconds
+        response['Server-Timing'] = server_timing_header(timings)
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_remove_fstlanguagerelation_unique_fst_file_for_lang_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FstMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fst_file', models.CharField(max_length=100, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('metadata', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
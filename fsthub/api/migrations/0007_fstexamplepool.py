@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_fstmetadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FstExamplePool',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fst_file', models.CharField(max_length=100, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('examples', models.JSONField(default=list)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,114 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_transducers(apps, schema_editor):
+    Transducer = apps.get_model('api', 'Transducer')
+    relation_models = [
+        apps.get_model('api', 'FstTypeRelation'),
+        apps.get_model('api', 'FstLanguageRelation'),
+    ]
+    fst_files = set()
+    for model in relation_models:
+        fst_files.update(model.objects.values_list('fst_file', flat=True))
+    Transducer.objects.bulk_create(
+        [Transducer(fst_file=f) for f in sorted(fst_files)], ignore_conflicts=True
+    )
+    transducers = {t.fst_file: t for t in Transducer.objects.all()}
+    for model in relation_models:
+        relations = list(model.objects.all())
+        for relation in relations:
+            relation.transducer = transducers[relation.fst_file]
+        model.objects.bulk_update(relations, ['transducer'], batch_size=500)
+
+
+def unlink_transducers(apps, schema_editor):
+    for name in ('FstTypeRelation', 'FstLanguageRelation'):
+        model = apps.get_model('api', name)
+        relations = list(model.objects.select_related('transducer'))
+        for relation in relations:
+            relation.fst_file = relation.transducer.fst_file
+        model.objects.bulk_update(relations, ['fst_file'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_fstexamplepool'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transducer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fst_file', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fstlanguagerelation',
+            name='transducer',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='api.transducer'),
+        ),
+        migrations.AddField(
+            model_name='fsttyperelation',
+            name='transducer',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='api.transducer'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='fstlanguagerelation',
+            name='unique_fst_file_for_lang',
+        ),
+        migrations.RemoveConstraint(
+            model_name='fsttyperelation',
+            name='unique_fst_file_for_type',
+        ),
+        # nullable while rows are relinked, so this can be reversed
+        migrations.AlterField(
+            model_name='fstlanguagerelation',
+            name='fst_file',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='fsttyperelation',
+            name='fst_file',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.RunPython(link_transducers, unlink_transducers),
+        migrations.RemoveField(
+            model_name='fstlanguagerelation',
+            name='fst_file',
+        ),
+        migrations.RemoveField(
+            model_name='fsttyperelation',
+            name='fst_file',
+        ),
+        migrations.AlterField(
+            model_name='fstlanguagerelation',
+            name='transducer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.transducer'),
+        ),
+        migrations.AlterField(
+            model_name='fsttyperelation',
+            name='transducer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.transducer'),
+        ),
+        migrations.AddField(
+            model_name='transducer',
+            name='languages',
+            field=models.ManyToManyField(related_name='transducers', through='api.FstLanguageRelation', to='api.fstlanguage'),
+        ),
+        migrations.AddField(
+            model_name='transducer',
+            name='types',
+            field=models.ManyToManyField(related_name='transducers', through='api.FstTypeRelation', to='api.fsttype'),
+        ),
+        migrations.AddConstraint(
+            model_name='fstlanguagerelation',
+            constraint=models.UniqueConstraint(fields=('transducer', 'language'), name='unique_transducer_for_lang'),
+        ),
+        migrations.AddConstraint(
+            model_name='fsttyperelation',
+            constraint=models.UniqueConstraint(fields=('transducer', 'type'), name='unique_transducer_for_type'),
+        ),
+    ]
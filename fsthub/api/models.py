@@ -44,11 +44,13 @@ class FstType(FstFilter):
 class FstLanguage(FstFilter):
     pass
     
-class FstFilterRelation(models.Model):
-    fst_file = models.CharField(max_length=100)
+class Transducer(models.Model):
+    """Transducer file, relative to `HFST_CONTENT_ROOT`"""
+    fst_file = models.CharField(max_length=100, unique=True)
+    types = models.ManyToManyField(FstType, through='FstTypeRelation', related_name='transducers')
+    languages = models.ManyToManyField(FstLanguage, through='FstLanguageRelation',
+                                       related_name='transducers')
 
-    class Meta:
-        abstract = True
     def validate_file_exists(self):
         path = settings.HFST_CONTENT_ROOT / self.fst_file
         if not (path.is_file() and path.exists()):
@@ -59,6 +61,17 @@ class FstFilterRelation(models.Model):
     def clean(self):
         super().clean()
         self.validate_file_exists()
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.fst_file}>'
+    def __str__(self):
+        return self.fst_file
+
+class FstFilterRelation(models.Model):
+    transducer = models.ForeignKey(Transducer, on_delete=models.CASCADE)
+
+    class Meta:
+        abstract = True
     def __repr__(self):
         return f'<{type(self).__name__} {str(self)}>'
 
@@ -68,12 +81,12 @@ class FstTypeRelation(FstFilterRelation):
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=['fst_file', 'type'],
-                name='unique_fst_file_for_type'
+                fields=['transducer', 'type'],
+                name='unique_transducer_for_type'
             ),
         ]
     def __str__(self):
-        return f'{self.type.name} : {self.fst_file}'
+        return f'{self.type.name} : {self.transducer.fst_file}'
     
 class FstLanguageRelation(FstFilterRelation):
     language = models.ForeignKey(FstLanguage, on_delete=models.CASCADE)
@@ -81,10 +94,40 @@ class FstLanguageRelation(FstFilterRelation):
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=['fst_file', 'language'],
-                name='unique_fst_file_for_lang'
+                fields=['transducer', 'language'],
+                name='unique_transducer_for_lang'
             ),
         ]
     def __str__(self):
-        return f'{self.language.name} : {self.fst_file}'
-    
\ No newline at end of file
+        return f'{self.language.name} : {self.transducer.fst_file}'
+    
+class FstFileSnapshot(models.Model):
+    """Something read from a transducer, valid while the file keeps its size and mtime"""
+    fst_file = models.CharField(max_length=100, unique=True)
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+
+    class Meta:
+        abstract = True
+    def is_fresh(self, size: int, mtime_ns: int) -> bool:
+        return self.size == size and self.mtime_ns == mtime_ns
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.fst_file}>'
+    def __str__(self):
+        return self.fst_file
+
+class FstMetadata(FstFileSnapshot):
+    """Header metadata of a transducer"""
+    metadata = models.JSONField(default=dict)
+
+class FstExamplePool(FstFileSnapshot):
+    """Random input/output pairs of a transducer, sampled by /api/fst/example"""
+    examples = models.JSONField(default=list)
+
+class CatalogRevision(models.Model):
+    """Single row counting changes of projects, filters and transducer relations"""
+    revision = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.revision)
@@ -0,0 +1,23 @@
+"""Output formats of the API on top of the hfst ones.
+
+`json` is parsed from xerox output: it has one analysis per line and is
+the format hfst-lookup prints weights in.
+"""
+from typing import List, Union
+
+from metrics import timed
+from hfst_adaptor.call import OUTPUT_FORMATS
+from hfst_adaptor.parse import parse_output
+
+JSON_FORMAT = 'json'
+API_OUTPUT_FORMATS = OUTPUT_FORMATS + [JSON_FORMAT]
+
+def hfst_format(output_format: str) -> str:
+    """Format to run hfst with for an API output format"""
+    return 'xerox' if output_format == JSON_FORMAT else output_format
+
+def format_output(output: str, output_format: str) -> Union[str, List[dict]]:
+    if output_format == JSON_FORMAT:
+        with timed('decode'):
+            return [token.asdict() for token in parse_output(output, 'xerox')]
+    return output.strip()
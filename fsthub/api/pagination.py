@@ -0,0 +1,129 @@
+"""Cursor pagination of listings sorted by name.
+
+A cursor holds the name at the edge of the last page and the direction,
+so a page is whatever comes right after (or before) that name: a bisect
+and a slice of the sorted inventory, or a `>` condition on an indexed
+column. Pages stay consistent while transducers are added or deleted,
+and nothing but the page itself is built.
+
+Listings are paginated when the client asks for it with `page_size` or
+`cursor`, otherwise they return everything as before.
+"""
+from typing import Callable, List, Optional, Sequence, Tuple
+from base64 import b64decode, b64encode
+import binascii
+import bisect
+
+from django.conf import settings
+from django.db.models import QuerySet
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+NEXT, PREVIOUS = 'n', 'p'
+
+def encode_cursor(direction: str, name: str) -> str:
+    return b64encode(f'{direction}{name}'.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        decoded = b64decode(cursor.encode(), validate=True).decode()
+    except (binascii.Error, UnicodeError):
+        raise NotFound('Invalid cursor')
+    if not decoded or decoded[0] not in (NEXT, PREVIOUS):
+        raise NotFound('Invalid cursor')
+    return decoded[0], decoded[1:]
+
+class NameCursorPagination(pagination.BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.request = None
+        self.next_name: Optional[str] = None
+        self.previous_name: Optional[str] = None
+
+    def is_requested(self, request) -> bool:
+        return self.cursor_query_param in request.query_params \
+            or self.page_size_query_param in request.query_params
+
+    def _parse(self, request) -> Tuple[str, Optional[str], int]:
+        self.request = request
+        size = settings.HFST_CURSOR_PAGE_SIZE
+        if self.page_size_query_param in request.query_params:
+            try:
+                size = pagination._positive_int(request.query_params[self.page_size_query_param],
+                                                strict=True, cutoff=settings.HFST_CURSOR_MAX_PAGE_SIZE)
+            except ValueError:
+                raise ValidationError({self.page_size_query_param: ['A positive integer is required.']})
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return NEXT, None, size
+        direction, name = decode_cursor(cursor)
+        return direction, name, size
+
+    def paginate_sorted(self, names: Sequence[str], request,
+                        lo: int = 0, hi: Optional[int] = None) -> List[str]:
+        """Page of `names[lo:hi]`, which must be sorted"""
+        hi = len(names) if hi is None else hi
+        direction, name, size = self._parse(request)
+        if direction == NEXT:
+            start = lo if name is None else bisect.bisect_right(names, name, lo, hi)
+            end = min(start + size, hi)
+        else:
+            end = bisect.bisect_left(names, name, lo, hi)
+            start = max(end - size, lo)
+        page = list(names[start:end])
+        if page:
+            self.previous_name = page[0] if start > lo else None
+            self.next_name = page[-1] if end < hi else None
+        elif direction == NEXT and name is not None:
+            self.previous_name = name
+        return page
+
+    def paginate_names(self, queryset: QuerySet, field: str, request,
+                       keep: Callable[[str], bool] = lambda name: True) -> List[str]:
+        """Page of distinct values of an indexed `field`, skipping those not `keep`-ed"""
+        direction, name, size = self._parse(request)
+        forward = direction == NEXT
+        ordered = queryset.order_by(field if forward else f'-{field}')
+        page, last = [], name
+        while len(page) <= size:
+            batch = ordered
+            if last is not None:
+                batch = batch.filter(**{f'{field}__{"gt" if forward else "lt"}': last})
+            batch = list(batch.values_list(field, flat=True)[:size + 1])
+            page += [x for x in batch if keep(x)]
+            if len(batch) <= size:
+                break
+            last = batch[-1]
+        more = len(page) > size
+        page = page[:size]
+        if not forward:
+            page.reverse()
+        if page:
+            # a cursor means there is a page on the side it came from
+            before, after = (name is not None, more) if forward else (more, name is not None)
+            self.previous_name = page[0] if before else None
+            self.next_name = page[-1] if after else None
+        return page
+
+    def _link(self, direction: str, name: Optional[str]) -> Optional[str]:
+        if name is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(direction, name))
+
+    def get_next_link(self) -> Optional[str]:
+        return self._link(NEXT, self.next_name)
+
+    def get_previous_link(self) -> Optional[str]:
+        return self._link(PREVIOUS, self.previous_name)
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
@@ -0,0 +1,9 @@
+from rest_framework.parsers import JSONParser
+
+from metrics import timed
+
+class TimedJSONParser(JSONParser):
+    """JSONParser that reports its time as the `parse` Server-Timing phase"""
+    def parse(self, stream, media_type=None, parser_context=None):
+        with timed('parse'):
+            return super().parse(stream, media_type, parser_context)
@@ -0,0 +1,254 @@
+"""Search over transducer names, projects, languages, types and metadata.
+
+Every transducer of the inventory is a document with weighted fields.
+They are split into lowercase tokens, which are kept in a sorted list:
+a query term matches tokens equal to it, tokens it is a prefix of
+(a bisect into the list) and, for terms of 3+ characters, tokens it is a
+substring of (candidates are found by trigrams of the vocabulary).
+Exact matches rank above prefixes, prefixes above substrings, and a
+match in the file name above one in metadata. Every term of the query
+must match.
+
+Only as many results are ranked as the requested page needs, and recent
+queries are remembered until the index changes, so paging through a
+broad query doesn't search again.
+
+The index lives in every worker process. It follows the inventory digest
+and `CatalogRevision`, which refreshed metadata rows bump as well: on a
+change the fields of all transducers are rebuilt from 3 queries, and only
+documents whose fields differ are reindexed.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from collections import OrderedDict
+import threading
+import bisect
+import heapq
+import re
+import os
+
+from project_reader import get_inventory
+from .conditional import catalog_revision
+from .models import FstLanguageRelation, FstMetadata, FstTypeRelation
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+# `type` is the implementation of the transducer, not what it does
+SKIPPED_METADATA = {'version', 'type'}
+FIELD_WEIGHTS = {'name': 8, 'project': 4, 'language': 4, 'type': 4, 'metadata': 1}
+EXACT, PREFIX, SUBSTRING = 3, 2, 1
+MAX_CACHED_QUERIES = 256
+
+Fields = Tuple[Tuple[str, str], ...]
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def document_fields(fst_file: str, types: Iterable[str] = (), languages: Iterable[str] = (),
+                    metadata: Optional[Dict[str, str]] = None) -> Fields:
+    project, _, name = fst_file.partition('/')
+    fields = [('name', name), ('project', project)]
+    fields += [('type', t) for t in sorted(types)]
+    fields += [('language', l) for l in sorted(languages)]
+    for key, value in sorted((metadata or {}).items()):
+        if key.lower() not in SKIPPED_METADATA and value:
+            fields.append(('metadata', value))
+    return tuple((field, value.lower()) for field, value in fields)
+
+def _rank(item: Tuple[str, int]) -> Tuple[int, str]:
+    return -item[1], item[0]
+
+class Results(Sequence):
+    """`(transducer, score)` best first, ranked only as far as they are read"""
+    def __init__(self, scores: Dict[str, int]):
+        self.scores = scores
+        self.ranked: List[Tuple[str, int]] = []
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            stop = None if (index.start or 0) < 0 else index.stop
+        else:
+            stop = None if index < 0 else index + 1
+        stop = len(self.scores) if stop is None or stop < 0 else min(stop, len(self.scores))
+        with self.lock:
+            if len(self.ranked) < stop:
+                if stop * 4 < len(self.scores):
+                    self.ranked = heapq.nsmallest(stop * 2, self.scores.items(), key=_rank)
+                else:
+                    self.ranked = sorted(self.scores.items(), key=_rank)
+            return self.ranked[index]
+
+class SearchIndex:
+    def __init__(self):
+        self.docs: Dict[str, Fields] = {}
+        # token -> {transducer: weight of the best field with the token}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.tokens: List[str] = []
+        # trigram -> tokens with it
+        self.trigrams: Dict[str, Set[str]] = {}
+        self.queries: 'OrderedDict[Tuple[str, ...], Results]' = OrderedDict()
+        self.state: Optional[Tuple[str, int]] = None
+        self.catalog: Dict[str, Tuple[List[str], List[str], Dict[str, str]]] = {}
+        self.lock = threading.Lock()
+
+    def _add(self, fst_file: str, fields: Fields) -> None:
+        self.docs[fst_file] = fields
+        for field, value in fields:
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(value):
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = {}
+                    bisect.insort(self.tokens, token)
+                    for gram in trigrams(token):
+                        self.trigrams.setdefault(gram, set()).add(token)
+                postings[fst_file] = max(weight, postings.get(fst_file, 0))
+
+    def _remove(self, fst_file: str) -> None:
+        fields = self.docs.pop(fst_file)
+        for _, value in fields:
+            for token in tokenize(value):
+                postings = self.postings.get(token)
+                if postings is None:
+                    continue
+                postings.pop(fst_file, None)
+                if postings:
+                    continue
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+                for gram in trigrams(token):
+                    tokens = self.trigrams[gram]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self.trigrams[gram]
+
+    def update(self, documents: Dict[str, Fields]) -> int:
+        """Make the index hold exactly `documents`, returns how many were reindexed"""
+        changed = 0
+        for fst_file in [f for f, fields in self.docs.items() if documents.get(f) != fields]:
+            self._remove(fst_file)
+            changed += 1
+        for fst_file, fields in documents.items():
+            if fst_file not in self.docs:
+                self._add(fst_file, fields)
+                changed += 1
+        if changed:
+            self.queries.clear()
+        return changed
+
+    def _load_catalog(self) -> None:
+        catalog: Dict[str, Tuple[List[str], List[str], Dict[str, str]]] = {}
+        def entry(fst_file: str):
+            if fst_file not in catalog:
+                catalog[fst_file] = ([], [], {})
+            return catalog[fst_file]
+        for fst_file, name in FstTypeRelation.objects.values_list('transducer__fst_file', 'type__name'):
+            entry(fst_file)[0].append(name)
+        for fst_file, name in FstLanguageRelation.objects.values_list('transducer__fst_file',
+                                                                      'language__name'):
+            entry(fst_file)[1].append(name)
+        for fst_file, metadata in FstMetadata.objects.values_list('fst_file', 'metadata'):
+            entry(fst_file)[2].update(metadata or {})
+        self.catalog = catalog
+
+    def refresh(self) -> None:
+        """Follow the inventory and the catalog"""
+        inventory = get_inventory()
+        revision = catalog_revision()
+        state = (inventory.digest, revision)
+        if state == self.state:
+            return
+        # new transducers may come with relations too
+        self._load_catalog()
+        self.update({fst: document_fields(fst, *self.catalog.get(fst, ((), (), None)))
+                     for fst in inventory.fsts})
+        self.state = state
+
+    def _matching_tokens(self, term: str) -> Dict[str, int]:
+        """Tokens the term matches, with the kind of the match"""
+        kinds: Dict[str, int] = {}
+        i = bisect.bisect_left(self.tokens, term)
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            kinds[self.tokens[i]] = EXACT if self.tokens[i] == term else PREFIX
+            i += 1
+        if len(term) >= 3:
+            grams = sorted((self.trigrams.get(g, set()) for g in trigrams(term)), key=len)
+            for token in grams[0].intersection(*grams[1:]):
+                if token not in kinds and term in token:
+                    kinds[token] = SUBSTRING
+        return kinds
+
+    def _scores(self, kinds: Dict[str, int]) -> Dict[str, int]:
+        found: Dict[str, int] = {}
+        for token, kind in kinds.items():
+            for fst_file, weight in self.postings[token].items():
+                score = kind * weight
+                if score > found.get(fst_file, 0):
+                    found[fst_file] = score
+        return found
+
+    def _narrow(self, scores: Dict[str, int], kinds: Dict[str, int]) -> Dict[str, int]:
+        """Add scores of another term to transducers that have it, drop the others"""
+        postings = [(self.postings[token], kind) for token, kind in kinds.items()]
+        narrowed = {}
+        for fst_file, score in scores.items():
+            best = 0
+            for docs, kind in postings:
+                weight = docs.get(fst_file)
+                if weight is not None and kind * weight > best:
+                    best = kind * weight
+            if best:
+                narrowed[fst_file] = score + best
+        return narrowed
+
+    def search(self, query: str) -> Results:
+        """Transducers matching every term of the query, see `Results`"""
+        terms = tuple(sorted(set(tokenize(query))))
+        if not terms:
+            return Results({})
+        with self.lock:
+            self.refresh()
+            results = self.queries.get(terms)
+            if results is not None:
+                self.queries.move_to_end(terms)
+                return results
+            # the rarest term first, the others are only looked up for its transducers
+            plans = sorted(((sum(len(self.postings[t]) for t in kinds), kinds)
+                            for kinds in map(self._matching_tokens, terms)), key=lambda p: p[0])
+            scores = self._scores(plans[0][1])
+            for _, kinds in plans[1:]:
+                if not scores:
+                    break
+                scores = self._narrow(scores, kinds)
+            results = self.queries[terms] = Results(scores)
+            while len(self.queries) > MAX_CACHED_QUERIES:
+                self.queries.popitem(last=False)
+            return results
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+_pid = os.getpid()
+
+def get_search_index() -> SearchIndex:
+    global _index
+    if os.getpid() != _pid:
+        _reset_after_fork()
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex()
+        return _index
+
+def _reset_after_fork() -> None:
+    global _index_lock, _pid
+    _pid = os.getpid()
+    _index_lock = threading.Lock()
+    if _index is not None:
+        _index.lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
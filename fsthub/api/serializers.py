@@ -3,8 +3,9 @@ from rest_framework.validators import ValidationError
 from pathlib import Path
 from django.conf import settings
 
-from hfst_adaptor.call import OUTPUT_FORMATS
+from metrics import timed
 from project_reader import dir_exists
+from .output import API_OUTPUT_FORMATS
 from .models import ProjectMetadata, FstType, FstLanguage, FstTypeRelation, FstLanguageRelation
 
 # Models
@@ -21,16 +22,25 @@ class LanguageSerializer(serializers.ModelSerializer):
         model = FstLanguage
         fields = ['name', 'description']
 class TypeRelationFileSerializer(serializers.ModelSerializer):
+    fst_file = serializers.CharField(source='transducer.fst_file')
+
     class Meta:
         model = FstTypeRelation
         fields = ['fst_file']
 class LangRelationFileSerializer(serializers.ModelSerializer):
+    fst_file = serializers.CharField(source='transducer.fst_file')
+
     class Meta:
         model = FstLanguageRelation
         fields = ['fst_file']
 
 # Requests
-class FstRequest(serializers.Serializer):
+class RequestSerializer(serializers.Serializer):
+    def is_valid(self, *, raise_exception=False):
+        with timed('validate'):
+            return super().is_valid(raise_exception=raise_exception)
+
+class FstRequest(RequestSerializer):
     hfst_file = serializers.CharField(required=True, allow_blank=False, max_length=500)
 
     def validate(self, data):
@@ -38,26 +48,63 @@ class FstRequest(serializers.Serializer):
             raise ValidationError(f'hfst_file \'{data["hfst_file"]}\' is invalid.')
         return data
 
+class FstExampleRequestSerializer(FstRequest):
+    count = serializers.IntegerField(required=False, min_value=1,
+                                     max_value=settings.HFST_EXAMPLE_MAX_COUNT)
+    seed = serializers.IntegerField(required=False)
+
+class FstBulkRequest(RequestSerializer):
+    hfst_file = serializers.ListField(
+        child=serializers.CharField(allow_blank=False, max_length=500),
+        allow_empty=False, max_length=settings.HFST_BULK_MAX_FILES
+    )
+
+    def validate(self, data):
+        for hfst_file in data['hfst_file']:
+            if '..' in hfst_file:
+                raise ValidationError(f'hfst_file \'{hfst_file}\' is invalid.')
+        return data
+
 class FstCallRequestSerializer(FstRequest):
     fst_input = serializers.CharField(required=True, allow_blank=False, max_length=10_000)
-    output_format = serializers.ChoiceField(OUTPUT_FORMATS, required=False, default=OUTPUT_FORMATS[0])
+    output_format = serializers.ChoiceField(API_OUTPUT_FORMATS, required=False, default=API_OUTPUT_FORMATS[0])
 
-class FstFilterRequestSerializer(serializers.Serializer):
+class FstPipelineRequestSerializer(RequestSerializer):
+    hfst_files = serializers.ListField(
+        child=serializers.CharField(allow_blank=False, max_length=500),
+        allow_empty=False, max_length=settings.HFST_PIPELINE_MAX_STAGES
+    )
+    fst_input = serializers.CharField(required=True, allow_blank=False, max_length=10_000)
+    output_format = serializers.ChoiceField(API_OUTPUT_FORMATS, required=False, default=API_OUTPUT_FORMATS[0])
+
+    def validate(self, data):
+        for hfst_file in data['hfst_files']:
+            if '..' in hfst_file:
+                raise ValidationError(f'hfst_file \'{hfst_file}\' is invalid.')
+        return data
+
+class FstStreamRequestSerializer(FstRequest):
+    # the input itself is the request body
+    output_format = serializers.ChoiceField(API_OUTPUT_FORMATS, required=False, default=API_OUTPUT_FORMATS[0])
+
+class FstBatchCallRequestSerializer(RequestSerializer):
+    # every job is validated separately with FstCallRequestSerializer
+    jobs = serializers.ListField(child=serializers.DictField(), allow_empty=False,
+                                 max_length=settings.HFST_BATCH_MAX_JOBS)
+
+class FstFilterRequestSerializer(RequestSerializer):
     type = serializers.CharField(required=False, allow_blank=True, max_length=500)
     lang = serializers.CharField(required=False, allow_blank=True, max_length=500)
 
     def validate(self, data):
-        if 'type' in data:
-            try:
-                _ = FstType.objects.get(name=data['type'])
-            except FstType.DoesNotExist:
-                raise ValidationError(f"type '{data['type']}' does not exist.")
-        if 'lang' in data:
-            try:
-                _ = FstLanguage.objects.get(name=data['lang'])
-            except FstLanguage.DoesNotExist:
-                raise ValidationError(f"lang '{data['lang']}' does not exist.")
+        if 'type' in data and not FstType.objects.filter(name=data['type']).exists():
+            raise ValidationError(f"type '{data['type']}' does not exist.")
+        if 'lang' in data and not FstLanguage.objects.filter(name=data['lang']).exists():
+            raise ValidationError(f"lang '{data['lang']}' does not exist.")
         return data
 
-class ProjectTransducersRequestSerializer(serializers.Serializer):
+class FstSearchRequestSerializer(RequestSerializer):
+    q = serializers.CharField(required=True, allow_blank=False, max_length=200)
+
+class ProjectTransducersRequestSerializer(RequestSerializer):
     project = serializers.CharField(required=True, allow_blank=False, max_length=100)
@@ -0,0 +1,98 @@
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from pathlib import Path
+import json
+
+from django.conf import settings
+
+from hfst_adaptor.call import call_hfst_many
+from hfst_adaptor.exceptions import HfstException
+from .output import hfst_format, format_output
+
+def iter_lines(stream: Optional[BinaryIO], chunk_size: int,
+               max_line: int) -> Iterator[Optional[str]]:
+    """Read stream chunk by chunk and yield decoded lines.
+    Lines longer than `max_line` bytes are dropped and yielded as `None`,
+    so no more than a chunk and a line are held in memory at once.
+    """
+    if stream is None:
+        return
+    tail = b''
+    too_long = False
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            if too_long:
+                too_long = False
+                yield None
+            elif len(line) > max_line:
+                yield None
+            else:
+                yield line.decode('utf8', errors='replace')
+        if len(tail) > max_line:
+            tail = b''
+            too_long = True
+    if too_long or len(tail) > max_line:
+        yield None
+    elif tail:
+        yield tail.decode('utf8', errors='replace')
+
+def parse_ndjson_line(line: str) -> str:
+    """NDJSON line is either a JSON string or an object with `fst_input`"""
+    value = json.loads(line) if line.strip() else ''
+    if isinstance(value, dict):
+        value = value.get('fst_input', '')
+    if not isinstance(value, str):
+        raise ValueError('Expected a string or an object with \'fst_input\'')
+    return value
+
+def _encode(record: dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False).encode() + b'\n'
+
+def _run_batch(hfst_file: Path, batch: List[Tuple[int, str]],
+               oformat: str) -> Iterator[bytes]:
+    if not batch:
+        return
+    try:
+        outputs = call_hfst_many(hfst_file, [inp.split() for _, inp in batch],
+                                 oformat=hfst_format(oformat))
+        for (n, _), output in zip(batch, outputs):
+            yield _encode({'line': n, 'output': format_output(output, oformat)})
+    except FileNotFoundError:
+        # deleted while streaming
+        for n, _ in batch:
+            yield _encode({'line': n, 'details': 'FST does not exist'})
+    except (HfstException, OSError, ValueError) as e:
+        details = str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
+        for n, _ in batch:
+            yield _encode({'line': n, 'details': details})
+
+def iter_records(hfst_file: Path, lines: Iterator[Optional[str]],
+                 oformat: str, ndjson: bool = False) -> Iterator[bytes]:
+    """Pipe lines through the transducer in small batches and yield NDJSON records,
+    one per input line, numbered from 1.
+    """
+    batch: List[Tuple[int, str]] = []
+    for n, line in enumerate(lines, start=1):
+        error = None
+        if line is None:
+            error = f'Line is longer than {settings.HFST_STREAM_MAX_LINE} bytes'
+        elif ndjson:
+            try:
+                line = parse_ndjson_line(line)
+            except ValueError as e:
+                error = f'Invalid NDJSON: {e}'
+        if error is not None or not line.strip():
+            yield from _run_batch(hfst_file, batch, oformat)
+            batch = []
+            yield _encode({'line': n, 'details': error} if error
+                          else {'line': n, 'output': format_output('', oformat)})
+            continue
+        batch.append((n, line))
+        if len(batch) >= settings.HFST_STREAM_BATCH_LINES:
+            yield from _run_batch(hfst_file, batch, oformat)
+            batch = []
+    yield from _run_batch(hfst_file, batch, oformat)
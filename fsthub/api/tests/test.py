@@ -5,9 +5,11 @@ from outside with the `reqests` module.
 """
 from django.test import LiveServerTestCase
 from django.conf import settings
+from django.core.cache import caches
 
-from typing import Tuple
+from typing import List, Tuple
 from pathlib import Path
+from unittest import mock
 import json
 import os
 import subprocess
@@ -15,9 +17,18 @@ import requests
 import shutil
 from time import sleep
 
-from project_reader import get_all_fsts, get_projects
+from project_reader import get_all_fsts, get_fsts, get_projects
 from api.management.commands.projectsautoinit import Command as ProjectsAutoInitCommand
-from api.models import ProjectMetadata, FstType, FstLanguage, FstTypeRelation, FstLanguageRelation
+from api.warmup import warm_up
+from api.checks import check_pipeline_stages
+from api import examples
+from hfst_adaptor.admission import get_admission
+from hfst_adaptor.call import call_hfst_many
+from hfst_adaptor.exceptions import HfstOverloaded
+from api.models import (
+    ProjectMetadata, FstType, FstLanguage, FstTypeRelation, FstLanguageRelation,
+    FstMetadata, FstExamplePool, Transducer
+)
 
 URL_PREFIX = os.getenv('FSTHUB_URL_PREFIX', '')
 URL_PREFIX = '' if URL_PREFIX is None else URL_PREFIX
@@ -43,7 +54,11 @@ class ApiTest(LiveServerTestCase):
     def setUpClass(cls):
         super().setUpClass()
         settings.HFST_CONTENT_ROOT = cls.test_root
+        # files are created and requested right away
+        settings.HFST_INVENTORY_TTL = 0
         cls.test_root.mkdir(exist_ok=True)
+        # throttle histories and responses of earlier runs live in the shared cache
+        caches['default'].clear()
 
     @classmethod
     def tearDownClass(cls):
@@ -99,7 +114,7 @@ class ApiTest(LiveServerTestCase):
             resp = requests.get(url, headers=default_headers)
         elif method.upper() == 'POST':
             resp = requests.post(url, headers=default_headers, json=body)
-        if 'text/html' in resp.headers['Content-Type']:
+        if resp.headers['Content-Type'].startswith(('text/html', 'text/plain')):
             return resp.status_code, url, resp.content.decode(encoding='utf-8')
         return resp.status_code, url, json.loads(resp.content.decode(encoding='utf-8'))
 
@@ -111,11 +126,20 @@ class PingAllTest(ApiTest):
         ping_endpoint('/api/fst/',          200)
         ping_endpoint('/api/fst/example/',  400)
         ping_endpoint('/api/fst/metadata/', 400)
+        ping_endpoint('/api/fst/bulk_metadata/', 400)
         ping_endpoint('/api/fst_type/',     200)
         ping_endpoint('/api/fst_language/', 200)
         ping_endpoint('/api/fst/call/',     405)
+        ping_endpoint('/api/fst/batch_call/', 405)
+        ping_endpoint('/api/fst/stream/',   405)
+        ping_endpoint('/api/fst/pipeline/', 405)
         ping_endpoint('/api/fst/filter/',   200)
+        ping_endpoint('/api/fst/search/',   400)
         ping_endpoint('/api/project/',      200)
+        ping_endpoint('/api/async/fst/call/',     405)
+        ping_endpoint('/api/async/fst/metadata/', 400)
+        ping_endpoint('/api/async/fst/example/',  400)
+        ping_endpoint('/api/metrics',             200)
 
 class GetProjectsTest(ApiTest):
     def test_api_get_projects(self):
@@ -158,6 +182,127 @@ class GetTypesTest(ApiTest):
             url
         )
 
+class FilterFstsTest(ApiTest):
+    def test_api_filter_fsts(self):
+        self.populate_test_root()
+        sleep(0.01)
+        code, url, resp = self.send_request('/api/fst/filter/?type=analyzer')
+        self.assertEqual(code, 200, resp)
+        expected = [fst for fst in get_all_fsts()
+                    if 'analyzer' in self.db_cmd.detect_autotypes(fst)]
+        self.assertEqual([x['name'] for x in resp['results']], sorted(expected))
+        code, url, resp = self.send_request('/api/fst/filter/?type=missing')
+        self.assertEqual(code, 400, resp)
+        # validation, catalog revision and the filter itself, however many transducers match
+        with self.assertNumQueries(3):
+            self.client.get('/api/fst/filter/?type=transliterator')
+
+        endpoint = f'{URL_PREFIX}/api/fst/filter/?type=analyzer'.replace('//', '/')
+        url = f'{URL_TO_TEST or self.live_server_url}/{endpoint}'
+        resp = requests.get(url, headers={'Accept': 'application/json'})
+        etag = resp.headers['ETag']
+        resp = requests.get(url, headers={'Accept': 'application/json', 'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        # any change of the catalog renews the ETag
+        FstType.objects.create(name='tagger')
+        resp = requests.get(url, headers={'Accept': 'application/json', 'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+class SearchFstsTest(ApiTest):
+    def test_api_search_fsts(self):
+        self.populate_test_root()
+        sleep(0.01)
+        def search(query: str) -> dict:
+            code, url, resp = self.send_request(f'/api/fst/search/?{query}')
+            self.assertEqual(code, 200, resp)
+            return resp
+
+        # project prefix
+        resp = search('q=russ&page_size=100')
+        self.assertEqual(resp['count'], 10)
+        self.assertTrue(all(x['name'].startswith('Russian/') for x in resp['results']))
+        # every term must match, names rank above the `analyzer` type
+        self.assertEqual([x['name'] for x in search('q=tatar analyze')['results']],
+                         ['Tatar/analyze_smth.hfst', 'Tatar/smth_analyze.hfst',
+                          'Tatar/ana_smth.hfst', 'Tatar/smth_ana.hfst'])
+        # substrings, exact tokens rank above prefixes
+        self.assertEqual(search('q=naly')['count'], 40)
+        names = [x['name'] for x in search('q=german gen')['results']]
+        self.assertEqual(names[:2], ['German/gen_smth.hfst', 'German/smth_gen.hfst'])
+        self.assertEqual(set(names[2:]), {'German/generate_smth.hfst', 'German/smth_generate.hfst'})
+        # pages
+        resp = search('q=smth&page_size=3&page=2')
+        self.assertEqual(resp['count'], 100)
+        self.assertEqual(len(resp['results']), 3)
+        self.assertIsNotNone(resp['next'])
+
+        # metadata and languages follow the catalog
+        self.assertEqual(search('q=jane')['count'], 0)
+        FstMetadata.objects.create(fst_file='Kazakh/gen_smth.hfst', size=0, mtime_ns=0,
+                                   metadata={'Author': 'Jane Doe', 'type': 'TROPICAL_OPENFST'})
+        lang = FstLanguage.objects.create(name='turkic')
+        FstLanguageRelation.objects.create(
+            transducer=Transducer.objects.get(fst_file='Tatar/ana_smth.hfst'), language=lang
+        )
+        self.assertEqual([x['name'] for x in search('q=jane doe')['results']],
+                         ['Kazakh/gen_smth.hfst'])
+        self.assertEqual([x['name'] for x in search('q=turk')['results']],
+                         ['Tatar/ana_smth.hfst'])
+        self.assertEqual(search('q=tropical')['count'], 0)
+        # a refreshed metadata row alone changes the results
+        FstMetadata.objects.update_or_create(fst_file='Kazakh/gen_smth.hfst',
+                                             defaults={'metadata': {'Author': 'John Roe'}})
+        self.assertEqual(search('q=jane')['count'], 0)
+        self.assertEqual([x['name'] for x in search('q=roe')['results']],
+                         ['Kazakh/gen_smth.hfst'])
+        # removed transducers leave the index
+        (self.test_root / 'Tatar' / 'ana_smth.hfst').unlink()
+        self.assertEqual(search('q=turkic')['count'], 0)
+
+        code, url, resp = self.send_request('/api/fst/search/?q=')
+        self.assertEqual(code, 400, resp)
+
+class PaginateListingsTest(ApiTest):
+    def test_api_paginate_listings(self):
+        self.populate_test_root()
+        sleep(0.01)
+        def walk(endpoint: str) -> List[str]:
+            """Names of all pages following `next`, checked against `previous` on the way back"""
+            pages = []
+            code, url, resp = self.send_request(endpoint)
+            self.assertEqual(code, 200, resp)
+            self.assertIsNone(resp['previous'], url)
+            pages.append([x['name'] for x in resp['results']])
+            while resp['next']:
+                resp = requests.get(resp['next'], headers={'Accept': 'application/json'}).json()
+                pages.append([x['name'] for x in resp['results']])
+            for page in reversed(pages[:-1]):
+                resp = requests.get(resp['previous'], headers={'Accept': 'application/json'}).json()
+                self.assertEqual([x['name'] for x in resp['results']], page)
+            self.assertIsNone(resp['previous'])
+            return [name for page in pages for name in page]
+
+        all_fsts = get_all_fsts()
+        self.assertEqual(walk('/api/fst/?page_size=7'), all_fsts)
+        self.assertEqual(walk('/api/fst/filter/?page_size=7'), all_fsts)
+        self.assertEqual(walk('/api/project/?page_size=3'), sorted(self.dummy_projects))
+        self.assertEqual(walk('/api/project/transducers/?project=Tatar&page_size=4'),
+                         get_fsts('Tatar'))
+        # relations of deleted files are skipped
+        (self.test_root / 'Tatar' / 'gen_smth.hfst').unlink()
+        generators = [fst for fst in get_all_fsts()
+                      if 'generator' in self.db_cmd.detect_autotypes(fst)]
+        self.assertEqual(walk('/api/fst/filter/?type=generator&page_size=5'), generators)
+        # unpaginated unless asked
+        code, url, resp = self.send_request('/api/fst/')
+        self.assertNotIn('next', resp, url)
+
+        code, url, resp = self.send_request('/api/fst/?cursor=garbage')
+        self.assertEqual(code, 404, resp)
+        code, url, resp = self.send_request('/api/fst/?page_size=0')
+        self.assertEqual(code, 400, resp)
+
 class FstOperationsTest(ApiTest):
     @classmethod
     def setUpClass(cls):
@@ -198,6 +343,15 @@ class FstOperationsTest(ApiTest):
                   'output_format': 'cg'},
             expected={'output': '"<ping>"\n\t"pong"'}
         )
+        _assert_hfst_call(
+            body={'hfst_file': 'pingpong/ping.hfstol',
+                  'fst_input': 'ping pang',
+                  'output_format': 'json'},
+            expected={'output': [
+                {'input': 'ping', 'analyses': [{'output': 'pong', 'weight': None}]},
+                {'input': 'pang', 'analyses': []},
+            ]}
+        )
         _assert_hfst_call(
             body={'hfst_file': 'pingpong/ping.hfstol',
                   'fst_input': 'ping',
@@ -206,7 +360,199 @@ class FstOperationsTest(ApiTest):
             exp_code=400
         )
 
+    def test_api_hfst_async_call(self):
+        for fmt, expected in [('xerox', 'ping\tpong'),
+                              ('cg', '"<ping>"\n\t"pong"'),
+                              ('apertium', '^ping/pong$')]:
+            code, url, resp = self.send_request(
+                '/api/async/fst/call/',
+                method='POST',
+                headers={'Content-Type': 'application/json'},
+                body={'hfst_file': 'pingpong/ping.hfstol',
+                      'fst_input': 'ping',
+                      'output_format': fmt}
+            )
+            self.assertEqual(code, 200, resp)
+            self.assertEqual(resp, {'output': expected})
+        code, url, resp = self.send_request(
+            '/api/async/fst/call/',
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body={'hfst_file': 'pingpong/ping.hfstol',
+                  'fst_input': 'ping',
+                  'output_format': 'bar'}
+        )
+        self.assertEqual(code, 400, resp)
+        self.assertEqual(resp, {'output_format': ['"bar" is not a valid choice.']})
+
+        self.db_projectsautoinit()
+        code, url, resp = self.send_request(
+            '/api/async/fst/example/?hfst_file=pingpong/ping.hfstol'
+        )
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp, {'example': {'input': 'ping', 'output': 'pong'}})
+        code, url, resp = self.send_request(
+            '/api/async/fst/metadata/?hfst_file=pingpong/ping.hfstol'
+        )
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp['metadata']['Author'], 'Jane Doe')
+        code, url, resp = self.send_request(
+            '/api/async/fst/metadata/?hfst_file=pingpong/missing.hfstol'
+        )
+        self.assertEqual(code, 404, resp)
+
+    def test_api_hfst_pipeline(self):
+        def _assert_pipeline(body: dict, expected: dict, exp_code: int = 200):
+            code, url, resp = self.send_request(
+                '/api/fst/pipeline/',
+                method='POST',
+                headers={'Content-Type': 'application/json'},
+                body=body
+            )
+            self.assertEqual(code, exp_code, resp)
+            self.assertEqual(resp, expected)
+
+        _assert_pipeline(
+            body={'hfst_files': ['pingpong/ping.hfstol'],
+                  'fst_input': 'ping pang',
+                  'output_format': 'apertium'},
+            expected={'output': '^ping/pong$\n^pang/*pang$'}
+        )
+        # pong is unknown to the second stage
+        _assert_pipeline(
+            body={'hfst_files': ['pingpong/ping.hfstol', 'pingpong/ping.hfstol'],
+                  'fst_input': 'ping'},
+            expected={'output': 'ping\tping+?\tinf'}
+        )
+        _assert_pipeline(
+            body={'hfst_files': ['pingpong/ping.hfstol'],
+                  'fst_input': 'ping',
+                  'output_format': 'json'},
+            expected={'output': [{'input': 'ping', 'analyses': [{'output': 'pong', 'weight': 0.0}]}]}
+        )
+        _assert_pipeline(
+            body={'hfst_files': ['pingpong/ping.hfstol', 'pingpong/missing.hfstol'],
+                  'fst_input': 'ping'},
+            expected={'details': 'FST does not exist', 'hfst_files': ['pingpong/missing.hfstol']},
+            exp_code=404
+        )
+        _assert_pipeline(
+            body={'hfst_files': ['../ping.hfstol'], 'fst_input': 'ping'},
+            expected={'non_field_errors': ["hfst_file '../ping.hfstol' is invalid."]},
+            exp_code=400
+        )
+        with self.settings(HFST_PIPELINE_MAX_STAGES=settings.HFST_ADMISSION_SLOTS + 1):
+            self.assertEqual([e.id for e in check_pipeline_stages(None)], ['api.E001'])
+        with self.settings(HFST_ADMISSION_SLOTS_PER_FILE=0):
+            self.assertEqual([e.id for e in check_pipeline_stages(None)], ['api.E001'])
+        self.assertEqual(check_pipeline_stages(None), [])
+
+    def test_api_hfst_batch_call(self):
+        code, url, resp = self.send_request(
+            '/api/fst/batch_call/',
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body={'jobs': [
+                {'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'ping'},
+                {'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'ping',
+                 'output_format': 'apertium'},
+                {'hfst_file': 'pingpong/missing.hfstol', 'fst_input': 'ping'},
+                {'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'ping',
+                 'output_format': 'bar'},
+                {'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'ping ping',
+                 'output_format': 'apertium'},
+            ]}
+        )
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp['results'], [
+            {'status': 200, 'output': 'ping\tpong'},
+            {'status': 200, 'output': '^ping/pong$'},
+            {'status': 404, 'details': 'FST does not exist'},
+            {'status': 400, 'errors': {'output_format': ['"bar" is not a valid choice.']}},
+            {'status': 200, 'output': '^ping/pong$ ^ping/pong$'},
+        ])
+
+        # bad jobs don't fail the rest of the batch
+        jobs = [
+            {'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'ping'},
+            {'hfst_file': 'pingpong/ping.fst', 'fst_input': 'ping'},
+        ]
+        code, url, resp = self.send_request(
+            '/api/fst/batch_call/',
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body={'jobs': jobs}
+        )
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp['results'][0], {'status': 200, 'output': 'ping\tpong'})
+        self.assertEqual(resp['results'][1]['status'], 400, resp)
+        self.assertIn('hfst_file', resp['results'][1]['errors'])
+        # the file is gone by the time it's called
+        with mock.patch('api.views.call_hfst_many', side_effect=FileNotFoundError):
+            code, url, resp = self.send_request(
+                '/api/fst/batch_call/',
+                method='POST',
+                headers={'Content-Type': 'application/json'},
+                body={'jobs': jobs}
+            )
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp['results'], [
+            {'status': 404, 'details': 'FST does not exist'},
+            {'status': 400, 'errors': resp['results'][1]['errors']},
+        ])
+
+        code, url, resp = self.send_request(
+            '/api/fst/batch_call/',
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body={'jobs': []}
+        )
+        self.assertEqual(code, 400, resp)
+
+    def test_api_hfst_stream(self):
+        def _stream(body: bytes, content_type: str, params: str = 'hfst_file=pingpong/ping.hfstol'):
+            url = f'{self.live_server_url}/{URL_PREFIX}api/fst/stream/?{params}'
+            resp = requests.post(url, data=body, headers={'Content-Type': content_type})
+            self.assertEqual(resp.status_code, 200, resp.content)
+            self.assertEqual(resp.headers['Content-Type'], 'application/x-ndjson')
+            return [json.loads(l) for l in resp.content.decode().splitlines()]
+
+        self.assertEqual(
+            _stream(b'ping\n\nping ping\n', 'text/plain'),
+            [{'line': 1, 'output': 'ping\tpong'},
+             {'line': 2, 'output': ''},
+             {'line': 3, 'output': 'ping\tpong\n\nping\tpong'}]
+        )
+        self.assertEqual(
+            _stream(b'"ping"\n{"fst_input": "ping"}\n[1]',
+                    'application/x-ndjson',
+                    'hfst_file=pingpong/ping.hfstol&output_format=apertium'),
+            [{'line': 1, 'output': '^ping/pong$'},
+             {'line': 2, 'output': '^ping/pong$'},
+             {'line': 3, 'details': "Invalid NDJSON: Expected a string or an object with 'fst_input'"}]
+        )
+        self.assertEqual(
+            _stream(b'ping ' * 5000 + b'\nping', 'text/plain'),
+            [{'line': 1, 'details': f'Line is longer than {settings.HFST_STREAM_MAX_LINE} bytes'},
+             {'line': 2, 'output': 'ping\tpong'}]
+        )
+        # the transducer disappears after the first batch
+        calls = []
+        def vanishing(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                raise FileNotFoundError(args[0])
+            return call_hfst_many(*args, **kwargs)
+        with mock.patch('api.streaming.call_hfst_many', side_effect=vanishing):
+            self.assertEqual(
+                _stream(b'ping\n\nping\n', 'text/plain'),
+                [{'line': 1, 'output': 'ping\tpong'},
+                 {'line': 2, 'output': ''},
+                 {'line': 3, 'details': 'FST does not exist'}]
+            )
+
     def test_api_hfst_example(self):
+        self.db_projectsautoinit()
         for _ in range(20):
             code, url, resp = self.send_request(
                 '/api/fst/example/?hfst_file=pingpong/ping.hfstol'
@@ -217,6 +563,36 @@ class FstOperationsTest(ApiTest):
                 {'example': {'input': 'ping', 'output': 'pong'}}
             )
 
+    def test_api_hfst_example_pool(self):
+        # built by projectsautoinit
+        self.db_projectsautoinit()
+        pool = FstExamplePool.objects.get(fst_file='pingpong/ping.hfstol')
+        self.assertEqual(pool.examples, [['ping', 'pong']])
+        code, url, resp = self.send_request(
+            '/api/fst/example/?hfst_file=pingpong/ping.hfstol&count=5&seed=1'
+        )
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp['examples'], [{'input': 'ping', 'output': 'pong'}])
+        # decoded once per process
+        self.assertEqual(examples._decoded['pingpong/ping.hfstol'][2], [['ping', 'pong']])
+        # without a pool the request runs nothing and the pool is built in the background
+        pool.delete()
+        response = requests.get(
+            f'{self.live_server_url}/{URL_PREFIX}api/fst/example/?hfst_file=pingpong/ping.hfstol&count=5'
+        )
+        self.assertEqual(response.status_code, 503, response.text)
+        self.assertEqual(response.headers['Retry-After'], str(settings.HFST_EXAMPLE_RETRY_AFTER))
+        for _ in range(100):
+            if FstExamplePool.objects.filter(fst_file='pingpong/ping.hfstol').exists():
+                break
+            sleep(0.05)
+        self.assertEqual(FstExamplePool.objects.get(fst_file='pingpong/ping.hfstol').examples,
+                         [['ping', 'pong']])
+        code, url, resp = self.send_request(
+            f'/api/fst/example/?hfst_file=pingpong/ping.hfstol&count={settings.HFST_EXAMPLE_MAX_COUNT + 1}'
+        )
+        self.assertEqual(code, 400, resp)
+
     def test_api_hfst_metadata(self):
         expected_meta = {
             'Author': 'Jane Doe',
@@ -228,3 +604,117 @@ class FstOperationsTest(ApiTest):
         )
         self.assertEqual(code, 200, resp)
         self.assertEqual(resp['metadata'], resp['metadata'] | expected_meta)
+        row = FstMetadata.objects.get(fst_file='pingpong/ping.hfstol')
+        self.assertEqual(row.metadata, resp['metadata'])
+        # the async API serves the stored row too while the file is unchanged
+        row.metadata = {'Author': 'Stored'}
+        row.save()
+        caches['default'].clear()
+        code, url, resp = self.send_request('/api/async/fst/metadata/?hfst_file=pingpong/ping.hfstol')
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp['metadata'], {'Author': 'Stored'})
+
+    def test_api_hfst_metadata_conditional(self):
+        for endpoint in ('/api/fst/metadata/', '/api/async/fst/metadata/'):
+            endpoint = f'{URL_PREFIX}{endpoint}?hfst_file=pingpong/ping.hfstol'.replace('//', '/')
+            url = f'{URL_TO_TEST or self.live_server_url}/{endpoint}'
+            resp = requests.get(url, headers={'Accept': 'application/json'})
+            self.assertEqual(resp.status_code, 200, resp.content)
+            self.assertIn('no-cache', resp.headers['Cache-Control'])
+            self.assertIn('Last-Modified', resp.headers)
+            etag = resp.headers['ETag']
+            resp = requests.get(url, headers={'Accept': 'application/json', 'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304, url)
+            self.assertEqual(resp.content, b'')
+        # a replaced transducer has new metadata
+        hfst_file = settings.HFST_CONTENT_ROOT / 'pingpong/ping.hfstol'
+        st = hfst_file.stat()
+        os.utime(hfst_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        resp = requests.get(url, headers={'Accept': 'application/json', 'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_api_response_cache(self):
+        url = '/api/fst/metadata/?hfst_file=pingpong/ping.hfstol'
+        self.client.get(url)
+        # other workers would find it in the shared cache too
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['metadata']['Author'], 'Jane Doe')
+
+    def test_api_hfst_bulk_metadata(self):
+        code, url, resp = self.send_request(
+            '/api/fst/bulk_metadata/?hfst_file=pingpong/ping.hfstol'
+            '&hfst_file=pingpong/missing.hfstol'
+        )
+        self.assertEqual(code, 200, resp)
+        self.assertEqual(resp['metadata']['pingpong/ping.hfstol']['Author'], 'Jane Doe')
+        self.assertEqual(resp['missing'], ['pingpong/missing.hfstol'])
+        self.assertEqual(resp['errors'], {})
+        code, url, resp = self.send_request('/api/fst/bulk_metadata/?hfst_file=../ping.hfstol')
+        self.assertEqual(code, 400, resp)
+
+    def test_api_metrics(self):
+        code, url, resp = self.send_request(
+            '/api/fst/call/', method='POST',
+            headers={'Content-Type': 'application/json'},
+            body={'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'ping metrics'}
+        )
+        self.assertEqual(code, 200, resp)
+        code, url, resp = self.send_request('/api/metrics')
+        self.assertEqual(code, 200, resp)
+        self.assertIn('fsthub_api_requests_total{endpoint="api-transducer-call",status="200"}', resp)
+        self.assertRegex(resp, r'fsthub_hfst_exec_seconds_count\{tool="[a-z-]+",'
+                               r'transducer="pingpong/ping.hfstol",endpoint="api-transducer-call"\} \d+')
+        self.assertRegex(resp, r'fsthub_token_cache_lookups_total\{transducer="pingpong/ping.hfstol",'
+                               r'endpoint="api-transducer-call",result="(hit|miss)"\} \d+')
+
+    def test_api_server_timing(self):
+        endpoint = f'{URL_PREFIX}/api/fst/call/'.replace('//', '/')
+        url = f'{URL_TO_TEST or self.live_server_url}/{endpoint}'
+        body = {'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'ping timing'}
+        with self.settings(HFST_SERVER_TIMING_DEBUG=True):
+            resp = requests.post(url, json=body, headers={'X-Debug-Timing': '1'})
+        self.assertEqual(resp.status_code, 200, resp.content)
+        phases = dict(p.split(';dur=') for p in resp.headers['Server-Timing'].split(', '))
+        for phase in ('throttle', 'parse', 'validate', 'file_check', 'exec', 'render', 'total'):
+            self.assertIn(phase, phases)
+        self.assertGreaterEqual(float(phases['total']), float(phases['exec']))
+        self.assertIn('exec', resp.json()['server_timing'])
+        resp = requests.post(url, json=body)
+        self.assertIn('total;dur=', resp.headers['Server-Timing'])
+        self.assertNotIn('server_timing', resp.json())
+
+    def test_api_warmup(self):
+        with self.settings(HFST_WARMUP_FILES=['pingpong/ping.hfstol', 'pingpong/missing.hfstol']), \
+                self.assertLogs('api.warmup', 'INFO') as logs:
+            report = warm_up()
+        self.assertTrue(any(line.startswith('INFO:api.warmup:Warm-up of pid') for line in logs.output))
+        self.assertEqual(report['mapped'] + report['prefetched'], 1)
+        self.assertGreater(report['transducers'], 0)
+        with self.settings(HFST_WARMUP=False):
+            self.assertEqual(warm_up(), {})
+
+    def test_api_admission_sheds_load(self):
+        admission = get_admission()
+        hfst_file = settings.HFST_CONTENT_ROOT / 'pingpong/ping.hfstol'
+        held = []
+        timeout, admission.timeout = admission.timeout, 0.05
+        try:
+            # take every slot the transducer can get
+            while True:
+                try:
+                    held.append(admission.acquire(hfst_file))
+                except HfstOverloaded:
+                    break
+            endpoint = f'{URL_PREFIX}/api/fst/call/'.replace('//', '/')
+            # unknown to the native reader, so it needs hfst-proc
+            resp = requests.post(f'{URL_TO_TEST or self.live_server_url}/{endpoint}',
+                                 json={'hfst_file': 'pingpong/ping.hfstol', 'fst_input': 'busy'})
+            self.assertEqual(resp.status_code, 503, resp.content)
+            self.assertEqual(resp.headers['Retry-After'], str(settings.HFST_ADMISSION_RETRY_AFTER))
+        finally:
+            admission.timeout = timeout
+            for fds in held:
+                admission.release(hfst_file, fds)
@@ -1,5 +1,7 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views, views
 from .views import (TypesViewset,
                     LanguageViewset, 
                     ProjectViewSet, 
@@ -15,4 +17,8 @@ router.register(r'fst_language', LanguageViewset, basename='api-transducer-lang'
 
 urlpatterns = [
     #path('call_transducer', CallFstView.as_view(), name='api-call-transducer'),
+    path('async/fst/call/', async_views.call, name='api-async-call'),
+    path('async/fst/metadata/', async_views.metadata, name='api-async-metadata'),
+    path('async/fst/example/', async_views.example, name='api-async-example'),
+    path('metrics', views.metrics, name='api-metrics'),
 ] + router.urls
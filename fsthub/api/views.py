@@ -1,27 +1,50 @@
+from typing import Dict, List, Tuple
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import math
+import threading
+
 from rest_framework import viewsets, pagination, authentication, throttling
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.views.decorators.cache import cache_page
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from django.utils.decorators import method_decorator
 from rest_framework import status
 from django.conf import settings
 
 from hfst_adaptor.call import (
-    call_hfst, call_metadata_extractor, call_example_generator, OUTPUT_FORMATS
+    call_hfst, call_hfst_many, check_suffix
+)
+from hfst_adaptor.pipeline import call_hfst_pipeline
+from hfst_adaptor.exceptions import HfstException, HfstOverloaded
+from metrics import timed, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from project_reader import (
+    get_inventory, get_projects, get_all_fsts, get_fsts, get_fsts_bounds, file_exists, dir_exists
 )
-from hfst_adaptor.parse import parse_metadata, parse_example
-from hfst_adaptor.exceptions import HfstException
-from project_reader import get_projects, get_all_fsts, get_fsts, file_exists, dir_exists
 from .models import (
-    ProjectMetadata,
-    FstType, FstTypeRelation,
-    FstLanguage, FstLanguageRelation
+    ProjectMetadata, Transducer,
+    FstType, FstLanguage
 )
 from .serializers import (
-    FstRequest, TypeSerializer, LanguageSerializer, ProjectSerializer,
-    FstCallRequestSerializer, FstFilterRequestSerializer, 
-    ProjectTransducersRequestSerializer,
-    TypeRelationFileSerializer, LangRelationFileSerializer
+    FstRequest, FstBulkRequest, FstExampleRequestSerializer,
+    TypeSerializer, LanguageSerializer, ProjectSerializer,
+    FstCallRequestSerializer, FstBatchCallRequestSerializer, FstStreamRequestSerializer,
+    FstPipelineRequestSerializer,
+    FstFilterRequestSerializer, FstSearchRequestSerializer,
+    ProjectTransducersRequestSerializer
+)
+from .streaming import iter_lines, iter_records
+from .output import API_OUTPUT_FORMATS, hfst_format, format_output
+from .metadata import get_metadata, get_metadata_many, refresh_metadata
+from .examples import sample_examples
+from .search import get_search_index
+from .pagination import NameCursorPagination
+from .conditional import (
+    conditional, inventory_etag, catalog_etag, fst_etag, fst_last_modified,
+    fsts_etag, example_etag, static_etag,
+    inventory_tags, catalog_tags, project_tags, fsts_tags
 )
 
 # Pagination
@@ -34,23 +57,56 @@ class CsrfDisableAuthentication(authentication.SessionAuthentication):
     def enforce_csrf(self, request):
         return
 # Throttling
-class FstBurstThrottle(throttling.UserRateThrottle):
+class TimedUserRateThrottle(throttling.UserRateThrottle):
+    def allow_request(self, request, view):
+        with timed('throttle'):
+            return super().allow_request(request, view)
+class FstBurstThrottle(TimedUserRateThrottle):
     scope='fst_burst'
-class FstSustainedThrottle(throttling.UserRateThrottle):
+class FstSustainedThrottle(TimedUserRateThrottle):
     scope='fst_sustained'
 
+# Transducer errors
+def hfst_error_status(e: HfstException) -> int:
+    if isinstance(e, HfstOverloaded):
+        return status.HTTP_503_SERVICE_UNAVAILABLE
+    return status.HTTP_422_UNPROCESSABLE_ENTITY
+
+def hfst_error_response(e: HfstException) -> Response:
+    """422 with the error, 503 with Retry-After if the transducer is overloaded"""
+    headers = None
+    if isinstance(e, HfstOverloaded):
+        headers = {'Retry-After': str(math.ceil(e.retry_after))}
+    return Response({
+        'details': str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
+    }, status=hfst_error_status(e), headers=headers)
+
+# Batch calls
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+def get_batch_executor() -> ThreadPoolExecutor:
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=settings.HFST_BATCH_WORKERS)
+        return _batch_executor
+
 
 # Projects
 class ProjectViewSet(viewsets.ViewSet):    
-    @method_decorator(cache_page(30))
+    @method_decorator(conditional(inventory_etag, tags=inventory_tags))
     def list(self, request):
+        paginator = NameCursorPagination()
+        if paginator.is_requested(request):
+            page = paginator.paginate_sorted(get_inventory().projects, request)
+            return paginator.get_paginated_response([{'name': p} for p in page])
         present_projects = get_projects()
         return Response({
             'results': [{'name': p} for p in present_projects]
         })
 
     @action(methods=['GET'], detail=False, url_path='transducers', url_name='transducers')
-    @method_decorator(cache_page(30))
+    @method_decorator(conditional(inventory_etag, tags=project_tags))
     def get_transducers(self, request):
         serializer = ProjectTransducersRequestSerializer(data=request.query_params)
         if not serializer.is_valid():
@@ -59,6 +115,11 @@ class ProjectViewSet(viewsets.ViewSet):
             return Response({
                 'details': 'Project does not exist'
             }, status=status.HTTP_404_NOT_FOUND)
+        paginator = NameCursorPagination()
+        if paginator.is_requested(request):
+            fsts, start, end = get_fsts_bounds(serializer.data['project'])
+            page = paginator.paginate_sorted(fsts, request, start, end)
+            return paginator.get_paginated_response([{'name': p} for p in page])
         transducers = get_fsts(serializer.data['project'])
         return Response({
             'results': [{'name': p} for p in transducers]
@@ -70,43 +131,66 @@ class ProjectMetadataViewSet(viewsets.ReadOnlyModelViewSet):
 
 # Transducers
 class TransducerViewSet(viewsets.ViewSet): 
-    @method_decorator(cache_page(30))
+    @method_decorator(conditional(inventory_etag, tags=inventory_tags))
     def list(self, request):
+        paginator = NameCursorPagination()
+        if paginator.is_requested(request):
+            page = paginator.paginate_sorted(get_inventory().fsts, request)
+            return paginator.get_paginated_response([{'name': p} for p in page])
         present_fst = get_all_fsts()
         return Response({
             'results': [{'name': p} for p in present_fst]
         })
 
     @action(methods=['GET'], detail=False)
-    @method_decorator(cache_page(60))
+    @method_decorator(conditional(catalog_etag, tags=catalog_tags))
     def filter(self, request, format=None):
         serializer = FstFilterRequestSerializer(data=request.query_params)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        paginator = NameCursorPagination()
+        paginate = paginator.is_requested(request)
         # If no filters then return everything
-        all_fst_files = get_all_fsts()
         if not ('type' in serializer.data or 'lang' in serializer.data):
+            if paginate:
+                page = paginator.paginate_sorted(get_inventory().fsts, request)
+                return paginator.get_paginated_response([{'name': fst} for fst in page])
             return Response({
-                'results': [{'name': fst} for fst in all_fst_files]
+                'results': [{'name': fst} for fst in get_all_fsts()]
             })
-        # If filters then filter and return
-        candidates = set(all_fst_files)
-        if 'type' in serializer.data:       
-            type_filtered = FstTypeRelation.objects\
-                .prefetch_related('type')\
-                .filter(type=FstType.objects.get(name=serializer.data['type']))
-            serialized = TypeRelationFileSerializer(type_filtered, many=True).data
-            candidates.intersection_update(d['fst_file'] for d in serialized)
+        # If filters then filter in a single query
+        transducers = Transducer.objects.all()
+        if 'type' in serializer.data:
+            transducers = transducers.filter(types__name=serializer.data['type'])
         if 'lang' in serializer.data:
-            lang_filtered = FstLanguageRelation.objects\
-                .prefetch_related('language')\
-                .filter(language=FstLanguage.objects.get(name=serializer.data['lang']))
-            serialized = LangRelationFileSerializer(lang_filtered, many=True).data
-            candidates.intersection_update(d['fst_file'] for d in serialized)
+            transducers = transducers.filter(languages__name=serializer.data['lang'])
+        # relations of deleted files stay in the DB
+        present = get_inventory().files
+        if paginate:
+            page = paginator.paginate_names(transducers.distinct(), 'fst_file', request,
+                                            keep=present.__contains__)
+            return paginator.get_paginated_response([{'name': n} for n in page])
+        fst_files = transducers.order_by('fst_file').distinct()\
+            .values_list('fst_file', flat=True)
         return Response({
-            'results': [{'name': n} for n in sorted(candidates)]
+            'results': [{'name': n} for n in fst_files if n in present]
         })
         
+    @action(methods=['GET'], detail=False)
+    @method_decorator(conditional(catalog_etag, tags=catalog_tags))
+    def search(self, request, format=None):
+        """Transducers matching every term of `q`, best first, see api.search"""
+        serializer = FstSearchRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        with timed('search'):
+            found = get_search_index().search(serializer.data['q'])
+        paginator = DefaultPagination()
+        page = paginator.paginate_queryset(found, request, view=self)
+        return paginator.get_paginated_response([
+            {'name': fst, 'score': score} for fst, score in page
+        ])
+
     @action(methods=['POST'], detail=False,
             authentication_classes=[CsrfDisableAuthentication],
             throttle_classes=[FstBurstThrottle, FstSustainedThrottle])
@@ -118,17 +202,123 @@ class TransducerViewSet(viewsets.ViewSet):
             output = call_hfst(
                 settings.HFST_CONTENT_ROOT / serializer.data['hfst_file'],
                 serializer.data['fst_input'].split(),
-                oformat=serializer.data['output_format']
+                oformat=hfst_format(serializer.data['output_format'])
             )
-            return Response({'output': output.strip()})
+            return Response({'output': format_output(output, serializer.data['output_format'])})
         except HfstException as e:
-            return Response({
-                'details': str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
-            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return hfst_error_response(e)
         
+    @action(methods=['POST'], detail=False,
+            authentication_classes=[CsrfDisableAuthentication],
+            throttle_classes=[FstBurstThrottle, FstSustainedThrottle])
+    def batch_call(self, request, format=None):
+        serializer = FstBatchCallRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        jobs = serializer.validated_data['jobs']
+        results: List[dict] = [None] * len(jobs)
+        # jobs on the same transducer and format share a single invocation
+        groups: Dict[Tuple[str, str], List[Tuple[int, List[str]]]] = {}
+        for i, job in enumerate(jobs):
+            job_serializer = FstCallRequestSerializer(data=job)
+            if not job_serializer.is_valid():
+                results[i] = {'status': status.HTTP_400_BAD_REQUEST,
+                              'errors': job_serializer.errors}
+                continue
+            data = job_serializer.data
+            try:
+                check_suffix(Path(data['hfst_file']))
+            except ValueError as e:
+                results[i] = {'status': status.HTTP_400_BAD_REQUEST,
+                              'errors': {'hfst_file': [str(e)]}}
+                continue
+            if not file_exists(data['hfst_file']):
+                results[i] = {'status': status.HTTP_404_NOT_FOUND,
+                              'details': 'FST does not exist'}
+                continue
+            groups.setdefault((data['hfst_file'], data['output_format']), [])\
+                .append((i, data['fst_input'].split()))
+
+        executor = get_batch_executor()
+        futures = {
+            # a context per job keeps the endpoint label of hfst metrics
+            key: executor.submit(contextvars.copy_context().run,
+                                 call_hfst_many,
+                                 settings.HFST_CONTENT_ROOT / key[0],
+                                 [inp for _, inp in group],
+                                 oformat=hfst_format(key[1]))
+            for key, group in groups.items()
+        }
+        for key, future in futures.items():
+            try:
+                outputs = future.result()
+                for (i, _), output in zip(groups[key], outputs):
+                    results[i] = {'status': status.HTTP_200_OK,
+                                  'output': format_output(output, key[1])}
+            except HfstException as e:
+                for i, _ in groups[key]:
+                    results[i] = {
+                        'status': hfst_error_status(e),
+                        'details': str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
+                    }
+            except FileNotFoundError:
+                # deleted after the check above
+                for i, _ in groups[key]:
+                    results[i] = {'status': status.HTTP_404_NOT_FOUND,
+                                  'details': 'FST does not exist'}
+        return Response({'results': results})
+
+    @action(methods=['POST'], detail=False,
+            authentication_classes=[CsrfDisableAuthentication],
+            throttle_classes=[FstBurstThrottle, FstSustainedThrottle])
+    def pipeline(self, request, format=None):
+        """Run the input through `hfst_files` in order, see hfst_adaptor.pipeline"""
+        serializer = FstPipelineRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        missing = [f for f in serializer.data['hfst_files'] if not file_exists(f)]
+        if missing:
+            return Response({
+                'details': 'FST does not exist',
+                'hfst_files': missing
+            }, status=status.HTTP_404_NOT_FOUND)
+        try:
+            output = call_hfst_pipeline(
+                [settings.HFST_CONTENT_ROOT / f for f in serializer.data['hfst_files']],
+                serializer.data['fst_input'].split(),
+                oformat=hfst_format(serializer.data['output_format'])
+            )
+            return Response({'output': format_output(output, serializer.data['output_format'])})
+        except HfstException as e:
+            return hfst_error_response(e)
+
+    @action(methods=['POST'], detail=False,
+            authentication_classes=[CsrfDisableAuthentication],
+            throttle_classes=[FstBurstThrottle, FstSustainedThrottle])
+    def stream(self, request, format=None):
+        """Pipe a text/plain or application/x-ndjson body through a transducer
+        line by line and stream NDJSON records back."""
+        serializer = FstStreamRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not file_exists(serializer.data['hfst_file']):
+            return Response({
+                'details': 'FST does not exist'
+            }, status=status.HTTP_404_NOT_FOUND)
+        lines = iter_lines(request.stream,
+                           settings.HFST_STREAM_CHUNK_SIZE,
+                           settings.HFST_STREAM_MAX_LINE)
+        records = iter_records(
+            settings.HFST_CONTENT_ROOT / serializer.data['hfst_file'],
+            lines,
+            serializer.data['output_format'],
+            ndjson=request.content_type.startswith('application/x-ndjson')
+        )
+        return StreamingHttpResponse(records, content_type='application/x-ndjson')
+
     @action(methods=['GET'], detail=False,
             throttle_classes=[FstBurstThrottle, FstSustainedThrottle])
-    @method_decorator(cache_page(60))
+    @method_decorator(conditional(fst_etag, fst_last_modified, tags=fsts_tags))
     def metadata(self, request, format=None):
         serializer = FstRequest(data=request.query_params)
         if not serializer.is_valid():
@@ -138,21 +328,35 @@ class TransducerViewSet(viewsets.ViewSet):
                 'details': 'FST does not exist'
             }, status=status.HTTP_404_NOT_FOUND)
         try:
-            output = call_metadata_extractor(
-                settings.HFST_CONTENT_ROOT / serializer.data['hfst_file'],
-            )
-            parsed = parse_metadata(output)
-            return Response({'metadata': parsed})
+            return Response({'metadata': get_metadata(serializer.data['hfst_file'])})
         except HfstException as e:
-            return Response({
-                'details': str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
-            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return hfst_error_response(e)
 
     @action(methods=['GET'], detail=False,
             throttle_classes=[FstBurstThrottle, FstSustainedThrottle])
-    @method_decorator(cache_page(5))
+    @method_decorator(conditional(fsts_etag, tags=fsts_tags))
+    def bulk_metadata(self, request, format=None):
+        serializer = FstBulkRequest(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        fst_files = list(dict.fromkeys(serializer.validated_data['hfst_file']))
+        rows = get_metadata_many(fst_files)
+        metadata, errors, missing = {}, {}, []
+        for fst_file in fst_files:
+            if not file_exists(fst_file):
+                missing.append(fst_file)
+                continue
+            try:
+                metadata[fst_file] = refresh_metadata(fst_file, rows.get(fst_file))
+            except HfstException as e:
+                errors[fst_file] = str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
+        return Response({'metadata': metadata, 'errors': errors, 'missing': missing})
+
+    @action(methods=['GET'], detail=False,
+            throttle_classes=[FstBurstThrottle, FstSustainedThrottle])
+    @method_decorator(conditional(example_etag, tags=fsts_tags))
     def example(self, request, format=None):
-        serializer = FstRequest(data=request.query_params)
+        serializer = FstExampleRequestSerializer(data=request.query_params)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         if not file_exists(serializer.data['hfst_file']):
@@ -160,20 +364,22 @@ class TransducerViewSet(viewsets.ViewSet):
                 'details': 'FST does not exist'
             }, status=status.HTTP_404_NOT_FOUND)
         try:
-            output = call_example_generator(
-                settings.HFST_CONTENT_ROOT / serializer.data['hfst_file'],
+            examples = sample_examples(
+                serializer.data['hfst_file'],
+                count=serializer.data.get('count', 1),
+                seed=serializer.data.get('seed'),
             )
-            parsed = parse_example(output)
-            return Response({'example': parsed.asdict()})
+            response = {'example': examples[0]}
+            if 'count' in serializer.data:
+                response['examples'] = examples
+            return Response(response)
         except HfstException as e:
-            return Response({
-                'details': str(e).replace(str(settings.HFST_CONTENT_ROOT), '.')
-            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return hfst_error_response(e)
 
     @action(methods=['GET'], detail=False)
-    @method_decorator(cache_page(300))
+    @method_decorator(conditional(static_etag(API_OUTPUT_FORMATS)))
     def output_formats(self, request, format=None):
-        return Response({'formats': OUTPUT_FORMATS})
+        return Response({'formats': API_OUTPUT_FORMATS})
 
 # Transducer filters
 class TypesViewset(viewsets.ReadOnlyModelViewSet):
@@ -182,3 +388,9 @@ class TypesViewset(viewsets.ReadOnlyModelViewSet):
 class LanguageViewset(viewsets.ReadOnlyModelViewSet):
     queryset = FstLanguage.objects.all()
     serializer_class = LanguageSerializer
+
+# Monitoring
+@require_GET
+def metrics(request):
+    """Prometheus metrics summed over all processes of the app"""
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
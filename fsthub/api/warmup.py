@@ -0,0 +1,110 @@
+"""Warm-up of a server process before it serves requests.
+
+uwsgi (without `--lazy-apps`) imports `wsgi.py` in its master and forks
+the workers from it. Whatever the master has loaded by then is shared
+copy-on-write by all of them: the project inventory and the memory
+mapped .hfstol transducers of `hfst_adaptor.optimized_lookup`, whose
+pages are touched here so they are resident before the fork, and the
+search index of `api.search`. Workers then answer the first request on
+those transducers without loading anything.
+
+Servers that start workers without forking (uvicorn --workers) warm every
+worker up separately, which still moves the loading out of the first
+request.
+
+Transducers are `HFST_WARMUP_FILES` or, if it's empty, the
+`HFST_WARMUP_TOP` most used ones according to /api/metrics.
+"""
+from typing import Dict, List
+import logging
+import time
+import os
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from metrics import collect
+from project_reader import get_inventory
+from hfst_adaptor.optimized_lookup import get_transducer
+from hfst_adaptor.convert import fast_path
+from hfst_adaptor.pool import PAGE_SIZE
+from .search import get_search_index
+
+logger = logging.getLogger(__name__)
+
+def resident_memory() -> int:
+    """Resident memory of this process in bytes, 0 where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def popular_transducers(limit: int) -> List[str]:
+    """Transducers with the most calls and token cache hits"""
+    uses: Dict[str, float] = {}
+    collected = collect()
+    calls = collected.get('fsthub_hfst_exec_seconds', {}).get('samples', {})
+    for (_tool, transducer, _endpoint), sample in calls.items():
+        uses[transducer] = uses.get(transducer, 0) + sum(sample[:-1])
+    lookups = collected.get('fsthub_token_cache_lookups_total', {}).get('samples', {})
+    for (transducer, _endpoint, result), count in lookups.items():
+        if result == 'hit':
+            uses[transducer] = uses.get(transducer, 0) + count
+    return sorted(uses, key=lambda t: (-uses[t], t))[:limit]
+
+def _prefetch(path) -> None:
+    """Ask the OS to read a file into the page cache, for hfst-proc to load it faster"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    with open(path, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+def warm_up() -> Dict[str, float]:
+    """Load the inventory and map transducers, returns what was done"""
+    if not settings.HFST_WARMUP:
+        return {}
+    started = time.perf_counter()
+    rss_before = resident_memory()
+    inventory = get_inventory()
+    fst_files = list(settings.HFST_WARMUP_FILES) or popular_transducers(settings.HFST_WARMUP_TOP)
+    mapped = prefetched = mapped_bytes = 0
+    for fst_file in fst_files:
+        if fst_file not in inventory.files:
+            continue
+        path = settings.HFST_CONTENT_ROOT / fst_file
+        # also remembers the format of the transducer in forked workers, conversions
+        # would hold up the master and are left to the first call in a worker
+        optimized = fast_path(path, convert=False)
+        fst = get_transducer(optimized) if optimized is not None else None
+        if fst is not None:
+            mapped_bytes += fst.touch()
+            mapped += 1
+        else:
+            _prefetch(path)
+            prefetched += 1
+    search_index = get_search_index()
+    try:
+        with search_index.lock:
+            search_index.refresh()
+    except DatabaseError as e:
+        # not migrated yet, the first search builds it
+        logger.warning(f'Search index not built: {e}')
+    # forked workers must not share DB connections of the master
+    connections.close_all()
+    report = {
+        'transducers': len(inventory.fsts),
+        'mapped': mapped,
+        'mapped_bytes': mapped_bytes,
+        'prefetched': prefetched,
+        'indexed': len(search_index.docs),
+        'rss_before': rss_before,
+        'rss_after': resident_memory(),
+        'seconds': time.perf_counter() - started,
+    }
+    logger.info(f'Warm-up of pid {os.getpid()} took {report["seconds"]:.2f}s: '
+                f'{report["transducers"]} transducers in the inventory, '
+                f'{mapped} mapped ({mapped_bytes / 1024 ** 2:.1f} MiB), {prefetched} prefetched, '
+                f'{report["indexed"]} indexed for search, '
+                f'RSS {rss_before / 1024 ** 2:.1f} -> {report["rss_after"] / 1024 ** 2:.1f} MiB')
+    return report
@@ -17,7 +17,7 @@ from django.utils.translation import gettext_lazy as _
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR.parent / 'data'
+DATA_DIR = Path(os.getenv('FSTHUB_DATA_DIR', '') or BASE_DIR.parent / 'data')
 DATA_DIR.mkdir(exist_ok=True)
 
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
+    'api.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -84,6 +86,15 @@ DATABASES = {
     }
 }
 
+# Shared by all worker processes, see shared_cache
+CACHES = {
+    'default': {
+        'BACKEND': 'shared_cache.SQLiteCache',
+        'LOCATION': str(DATA_DIR / 'cache.sqlite3'),
+        'OPTIONS': {'MAX_ENTRIES': 10_000},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -136,14 +147,29 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+# the warm-up report goes to stderr of the server at startup
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.warmup': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 # Django REST framework
 REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'api.parsers.TimedJSONParser',
     ],
     'DEFAULT_THROTTLE_RATES': {
-        'fst_burst': '60/min',
-        'fst_sustained': '1000/day',
+        'fst_burst': os.getenv('FSTHUB_THROTTLE_BURST', '') or '60/min',
+        'fst_sustained': os.getenv('FSTHUB_THROTTLE_SUSTAINED', '') or '1000/day',
     }
 }
 
@@ -152,3 +178,80 @@ HFST_CONTENT_ROOT = DATA_DIR / "hfst_projects"
 HFST_CONTENT_ROOT.mkdir(exist_ok=True)
 HFST_FORMATS = {'.hfst', '.hfstol'}
 HFST_METADATA_LANG_KEYS = ['language', 'lang', 'lng', 'l']
+# Long-lived hfst-proc workers
+HFST_POOL_ENABLED = True
+HFST_POOL_WORKERS_PER_FILE = 2
+HFST_POOL_MAX_TRANSDUCERS = 32
+HFST_POOL_MEMORY_BUDGET = 1024 ** 3 # bytes
+HFST_POOL_IDLE_TIMEOUT = 600 # seconds
+HFST_POOL_CALL_TIMEOUT = 30 # seconds
+HFST_POOL_REAP_INTERVAL = 10 # seconds between memory checks and unloading of idle workers
+# Answer .hfstol lookups in-process when possible, see hfst_adaptor.optimized_lookup
+HFST_NATIVE_LOOKUP = True
+# /api/fst/batch_call
+HFST_BATCH_WORKERS = 4
+HFST_BATCH_MAX_JOBS = 1000
+# /api/fst/stream
+HFST_STREAM_CHUNK_SIZE = 64 * 1024 # bytes read from the request body at once
+HFST_STREAM_MAX_LINE = 10_000 # bytes
+HFST_STREAM_BATCH_LINES = 64
+# Per-token memo of hfst-proc outputs, 0 disables it
+HFST_TOKEN_CACHE_BYTES = 64 * 1024 ** 2
+# Seconds the project_reader inventory is trusted before directory mtimes are checked again,
+# a request looks it up several times. 0 checks on every lookup
+HFST_INVENTORY_TTL = 1
+# Max transducers per /api/fst/bulk_metadata request
+HFST_BULK_MAX_FILES = 500
+# Random examples kept per transducer for /api/fst/example
+HFST_EXAMPLE_POOL_SIZE = 500
+# Max examples per /api/fst/example request
+HFST_EXAMPLE_MAX_COUNT = 50
+HFST_EXAMPLE_RETRY_AFTER = 2 # seconds, while the pool of a transducer is being built
+# Processes reading transducer metadata in `projectsautoinit`
+HFST_AUTOINIT_WORKERS = min(8, os.cpu_count() or 1)
+# Per-process metric files summed by /api/metrics, None keeps metrics per process
+HFST_METRICS_DIR = Path(os.getenv('FSTHUB_METRICS_DIR', '') or DATA_DIR / 'metrics')
+HFST_METRICS_FLUSH_INTERVAL = 1 # seconds
+# Server-Timing header with the phases of every request
+HFST_SERVER_TIMING = True
+# Let requests with `X-Debug-Timing: 1` get the phases in the JSON body as well
+HFST_SERVER_TIMING_DEBUG = DEBUG
+# Map transducers in wsgi.py/asgi.py before workers fork, see api.warmup
+HFST_WARMUP = os.getenv('FSTHUB_WARMUP', 'TRUE') == 'TRUE'
+HFST_WARMUP_FILES = [] # paths relative to HFST_CONTENT_ROOT, empty ranks transducers by use
+HFST_WARMUP_TOP = 32
+# Host-wide limits on running transducer calls, see hfst_adaptor.admission
+HFST_ADMISSION_ENABLED = True
+HFST_ADMISSION_DIR = DATA_DIR / 'admission'
+HFST_ADMISSION_SLOTS = max(4, 2 * (os.cpu_count() or 1))
+HFST_ADMISSION_SLOTS_PER_FILE = 4
+HFST_ADMISSION_QUEUE = 64
+HFST_ADMISSION_QUEUE_PER_FILE = 16
+HFST_ADMISSION_TIMEOUT = 10 # seconds a call may wait for a slot
+HFST_ADMISSION_RETRY_AFTER = 1 # seconds
+
+HFST_SHARD_ENABLED = True
+HFST_SHARD_MAX = min(4, os.cpu_count() or 1) # processes a single call may use at once
+HFST_SHARD_MIN_TOKENS = 256
+HFST_SHARD_TARGET_SECONDS = 0.05 # expected time of a single piece
+HFST_SHARD_EWMA_ALPHA = 0.2
+
+HFST_CONDITIONAL_MAX_AGE = 0 # seconds clients may skip revalidation of ETag'd responses, 0 revalidates every time
+
+HFST_RESPONSE_CACHE = 'default' # cache alias of responses, '' disables
+HFST_RESPONSE_CACHE_TIMEOUT = 3600 # seconds
+HFST_CACHE_WATCH_INTERVAL = 2 # seconds between checks of the content root, 0 disables
+
+# Chains of transducers run by /api/fst/pipeline, see hfst_adaptor.pipeline
+HFST_PIPELINE_MAX_STAGES = min(8, HFST_ADMISSION_SLOTS) # stages hold admission slots together
+HFST_PIPELINE_TIMEOUT = 30 # seconds
+HFST_PIPELINE_COMPOSE_AFTER = 3 # uses of a chain of .hfst files before it's composed, 0 disables
+HFST_PIPELINE_COMPOSE_DIR = DATA_DIR / 'composed'
+
+# Optimized lookup copies of transducers hfst-proc can't read, see hfst_adaptor.convert
+HFST_CONVERT_ENABLED = True
+HFST_CONVERT_DIR = DATA_DIR / 'optimized'
+
+# Cursor pagination of project and transducer listings, see api.pagination
+HFST_CURSOR_PAGE_SIZE = 100 # when only `cursor` is given
+HFST_CURSOR_MAX_PAGE_SIZE = 1000
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fsthub.settings')
 
 application = get_wsgi_application()
+
+# after the app is set up, before a server forks its workers
+from api.warmup import warm_up
+warm_up()
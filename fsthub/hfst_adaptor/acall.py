@@ -0,0 +1,131 @@
+"""asyncio counterparts of `call.py`.
+
+Subprocesses are started with `asyncio.create_subprocess_exec`, so a
+single event loop can wait on many slow transducers at once without
+holding a thread per call.
+"""
+from typing import Dict, List, Tuple, Union
+from pathlib import Path
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from metrics import add_timing, timed
+from .exceptions import HFSTInvalidFormat
+from .optimized_lookup import UnsupportedTransducer, native_lookup
+from .header import read_header
+from .parse import parse_metadata
+from .instruments import record_call
+from .admission import aadmitted
+from .convert import fast_path, get_format_registry
+from .call import (
+    OUTPUT_FORMATS, validate_file_existance, check_suffix,
+    _example_generator_args, _example_generator_result,
+    _metadata_extractor_args, _metadata_extractor_result,
+    _hfst_proc_args, _hfst_proc_result,
+    _hfst_lookup_args, _hfst_lookup_result,
+)
+
+logger = logging.getLogger(__name__)
+
+async def async_call_command(args: List[str],
+                             input: str = "") -> Tuple[str, str, int]:
+    """Same as `call_command`, but awaits the process instead of blocking"""
+    logger.info(f'Called {args}')
+    input = bytes(input, encoding='utf8')
+    async with aadmitted(args[-1]):
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        spawned = time.perf_counter()
+        stdout, stderr = await proc.communicate(input=input)
+        done = time.perf_counter()
+    record_call(args[0], args[-1], done - start,
+                len(input), len(stdout or b''), spawned=True)
+    add_timing('spawn', spawned - start)
+    add_timing('exec', done - spawned)
+    with timed('decode'):
+        stdout = stdout.decode() if stdout else ''
+        stderr = stderr.decode() if stderr else ''
+    return stdout, stderr, proc.returncode
+
+@validate_file_existance
+async def acall_example_generator(hfst_file: Union[Path, str]) -> str:
+    hfst_file = str(hfst_file)
+    stdout, stderr, code = await async_call_command(_example_generator_args(hfst_file))
+    return _example_generator_result(hfst_file, stdout, stderr, code)
+
+@validate_file_existance
+async def acall_metadata_extractor(hfst_file: Union[Path, str]) -> str:
+    hfst_file = str(hfst_file)
+    stdout, stderr, code = await async_call_command(_metadata_extractor_args(hfst_file))
+    return _metadata_extractor_result(hfst_file, stdout, stderr, code)
+
+@validate_file_existance
+async def aextract_metadata(hfst_file: Union[Path, str]) -> Dict[str, str]:
+    """Async `extract_metadata`, the header is small enough to read in the loop"""
+    try:
+        with timed('exec'):
+            return read_header(hfst_file).properties
+    except UnsupportedTransducer:
+        return parse_metadata(await acall_metadata_extractor(hfst_file))
+
+@validate_file_existance
+async def acall_hfst_proc(hfst_file: Union[Path, str],
+                          input_strings: List[str],
+                          oformat: str = 'cg') -> str:
+    if not oformat in OUTPUT_FORMATS:
+        raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
+    if settings.HFST_NATIVE_LOOKUP:
+        start = time.perf_counter()
+        # pure Python over the mapped tables, long inputs would hold up the event loop
+        output = await sync_to_async(native_lookup, thread_sensitive=False)(
+            hfst_file, input_strings, oformat
+        )
+        if output is not None:
+            add_timing('exec', time.perf_counter() - start)
+            record_call('native', hfst_file, time.perf_counter() - start,
+                        sum(len(s.encode()) + 1 for s in input_strings), len(output.encode()))
+            return output
+    hfst_file = str(hfst_file)
+
+    inp_str = ' '.join(input_strings) + ' '
+    stdout, stderr, code = await async_call_command(_hfst_proc_args(hfst_file, oformat), inp_str)
+    return _hfst_proc_result(hfst_file, stdout, stderr, code)
+
+@validate_file_existance
+async def acall_hfst_lookup(hfst_file: Union[Path, str],
+                            input_strings: List[str],
+                            oformat: str = 'cg') -> str:
+    if not oformat in OUTPUT_FORMATS:
+        raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
+    hfst_file = str(hfst_file)
+
+    inp_str = '\n'.join(input_strings)
+    stdout, stderr, code = await async_call_command(_hfst_lookup_args(hfst_file, oformat), inp_str)
+    return _hfst_lookup_result(hfst_file, stdout, stderr, code)
+
+@validate_file_existance
+async def acall_hfst(hfst_file: Union[Path, str],
+                     input_strings: List[str],
+                     oformat: str = 'cg') -> str:
+    """Async `call_hfst`: hfst-proc on the optimized transducer, hfst-lookup otherwise"""
+    if not oformat in OUTPUT_FORMATS:
+        raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
+    check_suffix(hfst_file)
+
+    # a conversion blocks, but only the first call of a transducer
+    optimized = await sync_to_async(fast_path, thread_sensitive=False)(hfst_file)
+    if optimized is not None:
+        try:
+            return await acall_hfst_proc(optimized, input_strings, oformat)
+        except HFSTInvalidFormat:
+            get_format_registry().mark_slow(hfst_file)
+    return await acall_hfst_lookup(hfst_file, input_strings, oformat)
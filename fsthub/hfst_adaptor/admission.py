@@ -0,0 +1,266 @@
+"""Host-wide admission control of transducer calls.
+
+A call that runs an hfst process holds two slots while it runs: one of
+`HFST_ADMISSION_SLOTS_PER_FILE` of its transducer and one of
+`HFST_ADMISSION_SLOTS` shared by all transducers. A slot is an `flock`
+on a file in `HFST_ADMISSION_DIR`, so the limits hold across all worker
+processes of the host and the kernel frees the slots of a crashed holder.
+
+A call without a free slot waits in a queue, which is a set of lock
+files too: `HFST_ADMISSION_QUEUE_PER_FILE` places per transducer and
+`HFST_ADMISSION_QUEUE` in total. When there is no place in the queue, or
+the wait takes longer than `HFST_ADMISSION_TIMEOUT`, the call is shed with
+`HfstOverloaded`, which the API answers with 503 and Retry-After.
+
+A pipeline holds a slot of every distinct transducer of its stages at
+once, and waits in the queue of its first stage like a single call. One
+waiting pipeline at a time reserves the slots it gets until it has all of
+them, the others take them all together or not at all.
+"""
+from typing import Dict, List, Optional, Tuple, Union
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+import hashlib
+import asyncio
+import random
+import fcntl
+import time
+import os
+
+from django.conf import settings
+
+from metrics import add_timing
+from .exceptions import HfstOverloaded
+from .instruments import record_admission, ADMISSION_QUEUED, ADMISSION_RUNNING, transducer_label
+
+class SlotSet:
+    """`size` interchangeable slots, lock files named `<prefix>-<n>.lock`"""
+    def __init__(self, directory: Path, prefix: str, size: int):
+        self.paths = [str(directory / f'{prefix}-{n}.lock') for n in range(size)]
+
+    def try_acquire(self) -> Optional[int]:
+        """Descriptor holding a free slot, `None` if all are taken"""
+        if not self.paths:
+            return None
+        # starting at a random slot spreads waiters over the files
+        start = random.randrange(len(self.paths))
+        for path in self.paths[start:] + self.paths[:start]:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+def _release(fds: List[int]) -> None:
+    for fd in fds:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+def _distinct(hfst_files: List[Union[Path, str]]) -> List[Union[Path, str]]:
+    """Files in order without repeats, a stage repeating a file takes no other slot"""
+    seen: Dict[str, Union[Path, str]] = {}
+    for hfst_file in hfst_files:
+        seen.setdefault(str(Path(hfst_file).resolve()), hfst_file)
+    return list(seen.values())
+
+class Admission:
+    def __init__(self, directory: Path, slots: int, slots_per_file: int,
+                 queue: int, queue_per_file: int, timeout: float, retry_after: float):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.slots = SlotSet(directory, 'run', slots)
+        self.queue = SlotSet(directory, 'queue', queue)
+        # held by the pipeline that reserves slots one by one
+        self.gate = SlotSet(directory, 'pipeline', 1)
+        self.slots_per_file = slots_per_file
+        self.queue_per_file = queue_per_file
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+    def _file_sets(self, hfst_file: Union[Path, str]) -> Tuple[SlotSet, SlotSet]:
+        key = hashlib.sha1(str(Path(hfst_file).resolve()).encode()).hexdigest()[:16]
+        return (SlotSet(self.directory, f'{key}-run', self.slots_per_file),
+                SlotSet(self.directory, f'{key}-queue', self.queue_per_file))
+
+    def _try_run(self, file_slots: SlotSet) -> Optional[List[int]]:
+        file_fd = file_slots.try_acquire()
+        if file_fd is None:
+            return None
+        global_fd = self.slots.try_acquire()
+        if global_fd is None:
+            _release([file_fd])
+            return None
+        return [file_fd, global_fd]
+
+    def _enqueue(self, hfst_file: Union[Path, str], file_queue: SlotSet) -> List[int]:
+        fd = file_queue.try_acquire()
+        if fd is not None:
+            global_fd = self.queue.try_acquire()
+            if global_fd is not None:
+                return [fd, global_fd]
+            _release([fd])
+        record_admission(hfst_file, 0, rejected='queue_full')
+        raise HfstOverloaded(f'Too many calls waiting for {transducer_label(hfst_file)}',
+                             self.retry_after)
+
+    def _timed_out(self, hfst_file: Union[Path, str], waited: float) -> HfstOverloaded:
+        record_admission(hfst_file, waited, rejected='timeout')
+        return HfstOverloaded(f'Waited {waited:.1f}s for a slot for {transducer_label(hfst_file)}',
+                              self.retry_after)
+
+    def _try_run_all(self, file_slots: List[SlotSet]) -> Optional[List[int]]:
+        """Slots of every file at once, or none of them"""
+        fds: List[int] = []
+        for slots in file_slots:
+            run = self._try_run(slots)
+            if run is None:
+                _release(fds)
+                return None
+            fds += run
+        return fds
+
+    def acquire(self, hfst_file: Union[Path, str]) -> List[int]:
+        """Descriptors holding the slots, waits for them up to `timeout`"""
+        return self.acquire_all([hfst_file])
+
+    def acquire_all(self, hfst_files: List[Union[Path, str]]) -> List[int]:
+        """Slots of every distinct one of `hfst_files`, held together like a single call.
+        A pipeline without all of them at once waits in the queue of its first file.
+        The waiter holding the `pipeline` gate keeps the slots it gets until it has
+        all of them, so single calls can't take every freed slot first. Other waiters
+        hold none, so pipelines can't hold half of each other's slots and wait forever.
+        """
+        start = time.monotonic()
+        hfst_files = _distinct(hfst_files)
+        hfst_file = hfst_files[0]
+        sets = [self._file_sets(f) for f in hfst_files]
+        run_slots = [run for run, _ in sets]
+        fds = self._try_run_all(run_slots)
+        if fds is None:
+            tickets = self._enqueue(hfst_file, sets[0][1])
+            label = transducer_label(hfst_file)
+            ADMISSION_QUEUED.inc(transducer=label)
+            gate: Optional[int] = None
+            held: List[Optional[List[int]]] = [None] * len(run_slots)
+            try:
+                delay = 0.001
+                while fds is None:
+                    if time.monotonic() - start >= self.timeout:
+                        raise self._timed_out(hfst_file, time.monotonic() - start)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+                    if gate is None and len(run_slots) > 1:
+                        gate = self.gate.try_acquire()
+                    if gate is None:
+                        fds = self._try_run_all(run_slots)
+                        continue
+                    for i, slots in enumerate(run_slots):
+                        if held[i] is None:
+                            held[i] = self._try_run(slots)
+                    if all(h is not None for h in held):
+                        fds = [fd for h in held for fd in h]
+            finally:
+                if fds is None:
+                    _release([fd for h in held if h is not None for fd in h])
+                if gate is not None:
+                    _release([gate])
+                ADMISSION_QUEUED.dec(transducer=label)
+                _release(tickets)
+        for f in hfst_files:
+            self._admitted(f, time.monotonic() - start)
+        return fds
+
+    async def aacquire(self, hfst_file: Union[Path, str]) -> List[int]:
+        """Same as `acquire`, but sleeps without blocking the event loop"""
+        start = time.monotonic()
+        run_slots, queue_slots = self._file_sets(hfst_file)
+        fds = self._try_run(run_slots)
+        if fds is None:
+            tickets = self._enqueue(hfst_file, queue_slots)
+            label = transducer_label(hfst_file)
+            ADMISSION_QUEUED.inc(transducer=label)
+            try:
+                delay = 0.001
+                while fds is None:
+                    if time.monotonic() - start >= self.timeout:
+                        raise self._timed_out(hfst_file, time.monotonic() - start)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+                    fds = self._try_run(run_slots)
+            finally:
+                ADMISSION_QUEUED.dec(transducer=label)
+                _release(tickets)
+        self._admitted(hfst_file, time.monotonic() - start)
+        return fds
+
+    def _admitted(self, hfst_file: Union[Path, str], waited: float) -> None:
+        record_admission(hfst_file, waited)
+        add_timing('queue', waited)
+        ADMISSION_RUNNING.inc(transducer=transducer_label(hfst_file))
+
+    def release(self, hfst_file: Union[Path, str], fds: List[int]) -> None:
+        self.release_all([hfst_file], fds)
+
+    def release_all(self, hfst_files: List[Union[Path, str]], fds: List[int]) -> None:
+        for hfst_file in _distinct(hfst_files):
+            ADMISSION_RUNNING.dec(transducer=transducer_label(hfst_file))
+        _release(fds)
+
+_admission: Optional[Admission] = None
+
+def get_admission() -> Optional[Admission]:
+    """Admission control of this host, `None` if disabled in settings"""
+    global _admission
+    if not settings.HFST_ADMISSION_ENABLED:
+        return None
+    if _admission is None:
+        _admission = Admission(
+            Path(settings.HFST_ADMISSION_DIR),
+            slots=settings.HFST_ADMISSION_SLOTS,
+            slots_per_file=settings.HFST_ADMISSION_SLOTS_PER_FILE,
+            queue=settings.HFST_ADMISSION_QUEUE,
+            queue_per_file=settings.HFST_ADMISSION_QUEUE_PER_FILE,
+            timeout=settings.HFST_ADMISSION_TIMEOUT,
+            retry_after=settings.HFST_ADMISSION_RETRY_AFTER,
+        )
+    return _admission
+
+@contextmanager
+def admitted(hfst_file: Union[Path, str]):
+    """Hold slots of `hfst_file` for the duration of the block"""
+    admission = get_admission()
+    if admission is None:
+        yield
+        return
+    fds = admission.acquire(hfst_file)
+    try:
+        yield
+    finally:
+        admission.release(hfst_file, fds)
+
+@contextmanager
+def admitted_all(hfst_files: List[Union[Path, str]]):
+    """Hold slots of all `hfst_files` for the duration of the block, see `Admission.acquire_all`"""
+    admission = get_admission()
+    if admission is None or not hfst_files:
+        yield
+        return
+    fds = admission.acquire_all(hfst_files)
+    try:
+        yield
+    finally:
+        admission.release_all(hfst_files, fds)
+
+@asynccontextmanager
+async def aadmitted(hfst_file: Union[Path, str]):
+    admission = get_admission()
+    if admission is None:
+        yield
+        return
+    fds = await admission.aacquire(hfst_file)
+    try:
+        yield
+    finally:
+        admission.release(hfst_file, fds)
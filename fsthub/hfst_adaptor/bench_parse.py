@@ -0,0 +1,69 @@
+"""Parsing cost of hfst output per megabyte.
+
+    python -m hfst_adaptor.bench_parse [megabytes]
+
+Output is synthetic but shaped like a morphological analyzer's: a few
+analyses per token with tags, some unknown tokens.
+"""
+from typing import Callable
+import random
+import time
+import sys
+
+from .parse import parse_output, parse_apertium_format
+
+def _analyses(rng: random.Random, token: str):
+    if rng.random() < 0.1:
+        return []
+    tags = ['n', 'v', 'adj', 'sg', 'pl', 'nom', 'gen', 'acc', 'px3sg']
+    return [
+        (token + ''.join(f'<{t}>' for t in rng.sample(tags, 3)), round(rng.random() * 10, 2))
+        for _ in range(rng.randint(1, 4))
+    ]
+
+def synthetic_output(oformat: str, size: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    chunks, total = [], 0
+    while total < size:
+        token = ''.join(rng.choice('abcdefghijklmnoprstuvyz') for _ in range(rng.randint(2, 12)))
+        analyses = _analyses(rng, token)
+        if oformat == 'xerox':
+            if analyses:
+                chunk = ''.join(f'{token}\t{a}\t{w:f}\n' for a, w in analyses) + '\n'
+            else:
+                chunk = f'{token}\t{token}+?\tinf\n\n'
+        elif oformat == 'cg':
+            lines = [f'"<{token}>"\n']
+            for a, w in analyses or [('*' + token, 0.0)]:
+                lemma, _, tags = a.partition('<')
+                tags = ('<' + tags).replace('><', ' ').strip('<>') if tags else ''
+                lines.append(f'\t"{lemma}" {tags}\n')
+            chunk = ''.join(lines)
+        else:
+            outputs = [a for a, _ in analyses] or ['*' + token]
+            chunk = '^' + '/'.join([token] + outputs) + '$ '
+        chunks.append(chunk)
+        total += len(chunk)
+    return ''.join(chunks)
+
+def _measure(parse: Callable[[str], object], text: str, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main(megabytes: float = 4) -> None:
+    size = int(megabytes * 1024 ** 2)
+    for oformat in ('xerox', 'cg', 'apertium'):
+        text = synthetic_output(oformat, size)
+        mb = len(text.encode()) / 1024 ** 2
+        seconds = _measure(lambda t: parse_output(t, oformat), text)
+        print(f'{oformat:9} parse_output          {seconds / mb * 1000:7.1f} ms/MB')
+        if oformat == 'apertium':
+            seconds = _measure(parse_apertium_format, text)
+            print(f'{oformat:9} parse_apertium_format {seconds / mb * 1000:7.1f} ms/MB')
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:2]))
@@ -0,0 +1,151 @@
+"""Memo of per-token transducer outputs.
+
+Natural language input repeats the same tokens over and over, so outputs
+are remembered per (transducer, output format, token). Entries of a
+transducer are dropped as soon as its file changes on disk.
+
+Eviction is GreedyDual-Size: every entry has a priority of
+`clock + cost / size`, the entry with the lowest priority goes first and
+the clock is raised to its priority. Cheap, large and long unused
+entries leave first, tokens that were expensive to compute stay longer.
+"""
+from typing import Dict, Iterable, Optional, Set, Tuple, Union
+from pathlib import Path
+import threading
+import heapq
+import sys
+
+from django.conf import settings
+
+# rough per-entry overhead of the dict, heap and key tuples
+ENTRY_OVERHEAD = 200
+
+CacheKey = Tuple[str, str, str]
+
+class TokenCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: Dict[CacheKey, Tuple[float, str, int, float]] = {}
+        self.heap = []
+        self.versions: Dict[str, Tuple[int, int, int]] = {}
+        self.keys: Dict[str, Set[CacheKey]] = {}
+        self.clock = 0.0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _file_version(hfst_file: Path) -> Tuple[int, int, int]:
+        st = hfst_file.stat()
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _check_version(self, hfst_file: Path) -> str:
+        path = str(hfst_file)
+        version = self._file_version(hfst_file)
+        if self.versions.get(path) != version:
+            for key in self.keys.pop(path, ()):
+                _, _, size, _ = self.entries.pop(key)
+                self.size -= size
+                self.invalidations += 1
+            self.versions[path] = version
+        return path
+
+    def _push(self, key: CacheKey, priority: float) -> None:
+        self.counter += 1
+        heapq.heappush(self.heap, (priority, self.counter, key))
+        if len(self.heap) > 2 * len(self.entries) + 1024:
+            # drop outdated heap items left by hits and invalidations
+            self.heap = [item for item in self.heap
+                         if item[2] in self.entries and self.entries[item[2]][0] == item[0]]
+            heapq.heapify(self.heap)
+
+    def get_many(self, hfst_file: Union[Path, str], oformat: str,
+                 tokens: Iterable[str]) -> Dict[str, str]:
+        """Cached outputs of those tokens that are known"""
+        found = {}
+        with self.lock:
+            path = self._check_version(Path(hfst_file))
+            for token in tokens:
+                key = (path, oformat, token)
+                entry = self.entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                _, output, size, cost = entry
+                priority = self.clock + cost / size
+                self.entries[key] = (priority, output, size, cost)
+                self._push(key, priority)
+                found[token] = output
+        return found
+
+    def put_many(self, hfst_file: Union[Path, str], oformat: str,
+                 outputs: Dict[str, Tuple[str, float]]) -> None:
+        """Remember `{token: (output, seconds it took)}`"""
+        with self.lock:
+            path = self._check_version(Path(hfst_file))
+            for token, (output, cost) in outputs.items():
+                key = (path, oformat, token)
+                size = sys.getsizeof(token) + sys.getsizeof(output) + ENTRY_OVERHEAD
+                if size > self.max_bytes:
+                    continue
+                old = self.entries.get(key)
+                if old is not None:
+                    self.size -= old[2]
+                priority = self.clock + cost / size
+                self.entries[key] = (priority, output, size, cost)
+                self.keys.setdefault(path, set()).add(key)
+                self.size += size
+                self._push(key, priority)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes and self.heap:
+            priority, _, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != priority:
+                continue
+            del self.entries[key]
+            self.keys[key[0]].discard(key)
+            self.size -= entry[2]
+            self.clock = priority
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.heap.clear()
+            self.versions.clear()
+            self.keys.clear()
+            self.size = 0
+
+_cache: Optional[TokenCache] = None
+_cache_lock = threading.Lock()
+
+def get_token_cache() -> Optional[TokenCache]:
+    """Process-wide token cache, `None` if disabled in settings"""
+    global _cache
+    if not settings.HFST_TOKEN_CACHE_BYTES:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TokenCache(settings.HFST_TOKEN_CACHE_BYTES)
+        return _cache
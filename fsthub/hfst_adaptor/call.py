@@ -1,13 +1,26 @@
-from typing import List, Tuple, Union, Literal, Dict
+from typing import List, Tuple, Union, Literal, Dict, Optional
 from pathlib import Path
 from dataclasses import dataclass
-from functools import wraps
+from functools import partial, wraps
 from random import choice
 import subprocess
 import logging
+import time
 import re
 
+from django.conf import settings
+
+from metrics import add_timing, timed
 from .exceptions import HFSTInvalidFormat, HfstException
+from .pool import get_pool
+from .optimized_lookup import UnsupportedTransducer, native_lookup
+from .header import read_header
+from .parse import parse_metadata, split_output
+from .cache import get_token_cache
+from .instruments import counts_failures, record_call, record_cache_lookups
+from .admission import admitted
+from .shard import get_throughput, plan, run_parallel
+from .convert import fast_path, get_format_registry
 
 logger = logging.getLogger(__name__)
 OUTPUT_FORMATS = ['xerox', 'cg', 'apertium']
@@ -15,16 +28,17 @@ OUTPUT_FORMATS = ['xerox', 'cg', 'apertium']
 def validate_file_existance(func):
     @wraps(func)
     def wrapper(hfst_file: Union[Path, str], *args, **kwargs):
-        if isinstance(hfst_file, str):
-            hfst_file = Path(hfst_file)
-        if not isinstance(hfst_file, Path):
-            raise TypeError(f"Expected Path or str, got {type(hfst_file).__name__}")
-        if not hfst_file.is_file():
-            raise FileNotFoundError(hfst_file)
-        if str(hfst_file).startswith('-'):
-            raise ValueError(
-                f"For security reasons, files cannot start with '-', got: {hfst_file}"
-            )
+        with timed('file_check'):
+            if isinstance(hfst_file, str):
+                hfst_file = Path(hfst_file)
+            if not isinstance(hfst_file, Path):
+                raise TypeError(f"Expected Path or str, got {type(hfst_file).__name__}")
+            if not hfst_file.is_file():
+                raise FileNotFoundError(hfst_file)
+            if str(hfst_file).startswith('-'):
+                raise ValueError(
+                    f"For security reasons, files cannot start with '-', got: {hfst_file}"
+                )
         return func(hfst_file, *args, **kwargs)
     return wrapper
 
@@ -59,55 +73,70 @@ def call_command(args: List[str],
         stdout, stderr and return code
     """
     logger.info(f'Called {args}')
-    proc = subprocess.Popen(
-        args,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        shell=False
-    )
-    stdout, stderr = proc.communicate(input=bytes(input, encoding='utf8'))
-    stdout = stdout.decode() if stdout else ''
-    stderr = stderr.decode() if stderr else ''
+    input = bytes(input, encoding='utf8')
+    # the transducer is the last argument of every hfst command here
+    with admitted(args[-1]):
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            shell=False
+        )
+        spawned = time.perf_counter()
+        stdout, stderr = proc.communicate(input=input)
+        done = time.perf_counter()
+    record_call(args[0], args[-1], done - start,
+                len(input), len(stdout or b''), spawned=True)
+    add_timing('spawn', spawned - start)
+    add_timing('exec', done - spawned)
+    with timed('decode'):
+        stdout = stdout.decode() if stdout else ''
+        stderr = stderr.decode() if stderr else ''
     return stdout, stderr, proc.returncode
 
-@validate_file_existance
-def call_example_generator(hfst_file: Union[Path, str]) -> str:
-    hfst_file = str(hfst_file)
-    stdout, stderr, code = call_command(
-        ['hfst-fst2strings',
-         '--max-strings', '10',
-         injection_filter(hfst_file)]
-    )
+# Command lines and checks of their results,
+# shared with the asyncio callers in `acall.py`
+def _example_generator_args(hfst_file: str) -> List[str]:
+    return ['hfst-fst2strings',
+            '--max-strings', '10',
+            injection_filter(hfst_file)]
+
+@counts_failures('hfst-fst2strings')
+def _example_generator_result(hfst_file: str, stdout: str, stderr: str, code: int) -> str:
     if code != 0:
         raise HfstException(f'hfst-fst2strings: {stdout.strip()} {hfst_file} code: {code}')
     examples = [x for x in stdout.split('\n') if x]
     return choice(examples)
 
-@validate_file_existance
-def call_metadata_extractor(hfst_file: Union[Path, str]) -> str:
-    hfst_file = str(hfst_file)
-    stdout, stderr, code = call_command(
-        ['hfst-edit-metadata', '-p',injection_filter(hfst_file)]
-    )
+def _example_pool_args(hfst_file: str, size: int) -> List[str]:
+    return ['hfst-fst2strings',
+            '--random', str(int(size)),
+            injection_filter(hfst_file)]
+
+@counts_failures('hfst-fst2strings')
+def _example_pool_result(hfst_file: str, stdout: str, stderr: str, code: int) -> List[str]:
+    if code != 0:
+        raise HfstException(f'hfst-fst2strings: {stdout.strip()} {hfst_file} code: {code}')
+    # random paths repeat on small transducers
+    return list(dict.fromkeys(x for x in stdout.split('\n') if x))
+
+def _metadata_extractor_args(hfst_file: str) -> List[str]:
+    return ['hfst-edit-metadata', '-p',injection_filter(hfst_file)]
+
+@counts_failures('hfst-edit-metadata')
+def _metadata_extractor_result(hfst_file: str, stdout: str, stderr: str, code: int) -> str:
     if code != 0:
         raise HfstException(f'hfst-edit-metadata: {stdout.strip()} {hfst_file} code: {code}')
     return stdout
 
-@validate_file_existance
-def call_hfst_proc(hfst_file: Union[Path, str],
-                   input_strings: List[str],
-                   oformat: str = 'cg') -> str:
-    if not oformat in OUTPUT_FORMATS:
-        raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
-    hfst_file = str(hfst_file)
+def _hfst_proc_args(hfst_file: str, oformat: str) -> List[str]:
+    return ['hfst-proc', f'--{injection_filter(oformat)}',
+            injection_filter(hfst_file)]
 
-    inp_str = ' '.join(input_strings) + ' '
-    stdout, stderr, code = call_command(
-        ['hfst-proc', f'--{injection_filter(oformat)}',
-         injection_filter(hfst_file)], 
-        inp_str
-    )
+@counts_failures('hfst-proc')
+def _hfst_proc_result(hfst_file: str, stdout: str, stderr: str, code: int) -> str:
     if code != 0:
         if stdout.lower().strip() == 'transducer must be in hfst optimized lookup format.':
             raise HFSTInvalidFormat(f'hfst-proc: {stdout.strip()} {hfst_file}')
@@ -115,6 +144,146 @@ def call_hfst_proc(hfst_file: Union[Path, str],
             raise HfstException(f'hfst-proc: stdout={stdout}; stderr={stderr} code: {code}')
     return stdout
 
+def _hfst_lookup_args(hfst_file: str, oformat: str) -> List[str]:
+    return ['hfst-lookup', '-q', 
+            '--output-format', injection_filter(oformat), 
+            injection_filter(hfst_file)]
+
+@counts_failures('hfst-lookup')
+def _hfst_lookup_result(hfst_file: str, stdout: str, stderr: str, code: int) -> str:
+    if code != 0:
+        raise HfstException(f'hfst-lookup: stdout={stdout}; stderr={stderr} code: {code}')
+    return stdout
+
+@validate_file_existance
+def call_example_generator(hfst_file: Union[Path, str]) -> str:
+    hfst_file = str(hfst_file)
+    stdout, stderr, code = call_command(_example_generator_args(hfst_file))
+    return _example_generator_result(hfst_file, stdout, stderr, code)
+
+@validate_file_existance
+def call_example_pool(hfst_file: Union[Path, str], size: int) -> List[str]:
+    """Up to `size` distinct random 'input:output' strings of the transducer"""
+    hfst_file = str(hfst_file)
+    stdout, stderr, code = call_command(_example_pool_args(hfst_file, size))
+    return _example_pool_result(hfst_file, stdout, stderr, code)
+
+@validate_file_existance
+def call_metadata_extractor(hfst_file: Union[Path, str]) -> str:
+    hfst_file = str(hfst_file)
+    stdout, stderr, code = call_command(_metadata_extractor_args(hfst_file))
+    return _metadata_extractor_result(hfst_file, stdout, stderr, code)
+
+@validate_file_existance
+def extract_metadata(hfst_file: Union[Path, str]) -> Dict[str, str]:
+    """Header properties, the same `hfst-edit-metadata -p` prints.
+    Read in Python, hfst-edit-metadata runs only for files without an HFST3 header.
+    """
+    try:
+        with timed('exec'):
+            return read_header(hfst_file).properties
+    except UnsupportedTransducer:
+        return parse_metadata(call_metadata_extractor(hfst_file))
+
+def _hfst_proc_once(hfst_file: str, inp_str: str, oformat: str) -> str:
+    stdout, stderr, code = call_command(_hfst_proc_args(hfst_file, oformat), inp_str)
+    return _hfst_proc_result(hfst_file, stdout, stderr, code)
+
+def _hfst_proc_frames(hfst_file: str, inp_strs: List[str], oformat: str) -> List[str]:
+    pool = get_pool()
+    if pool is not None:
+        return pool.run_many(injection_filter(hfst_file), injection_filter(oformat), inp_strs)
+    return [_hfst_proc_once(hfst_file, inp_str, oformat) for inp_str in inp_strs]
+
+def _hfst_proc_outputs(hfst_file: Path, inputs: List[List[str]],
+                       oformat: str) -> List[Tuple[str, float]]:
+    """hfst-proc output of every input and seconds it took to get it"""
+    outputs: List[Optional[Tuple[str, float]]] = [None] * len(inputs)
+    if settings.HFST_NATIVE_LOOKUP:
+        for i, strings in enumerate(inputs):
+            start = time.perf_counter()
+            output = native_lookup(hfst_file, strings, oformat)
+            if output is not None:
+                outputs[i] = (output, time.perf_counter() - start)
+                add_timing('exec', outputs[i][1])
+                record_call('native', hfst_file, outputs[i][1],
+                            sum(len(s.encode()) + 1 for s in strings), len(output.encode()))
+    missing = [i for i, out in enumerate(outputs) if out is None]
+    if missing:
+        for i, output in zip(missing, _hfst_proc_sharded(str(hfst_file),
+                                                         [inputs[i] for i in missing],
+                                                         oformat)):
+            outputs[i] = output
+    return outputs
+
+def _hfst_proc_sharded(hfst_file: str, inputs: List[List[str]],
+                       oformat: str) -> List[Tuple[str, float]]:
+    """`_hfst_proc_frames` of `inputs`, split at token boundaries
+    over several processes when they are large enough
+    """
+    throughput = get_throughput()
+    shards = settings.HFST_SHARD_MAX if settings.HFST_SHARD_ENABLED else 1
+    pool = get_pool()
+    if pool is not None:
+        shards = min(shards, pool.workers_per_file)
+    groups = plan([len(strings) for strings in inputs], throughput.chunk_size(hfst_file), shards)
+
+    def run(group: List[Tuple[int, int, int]]) -> Tuple[List[str], float]:
+        start = time.perf_counter()
+        results = _hfst_proc_frames(hfst_file,
+                                    [' '.join(inputs[i][a:b]) + ' ' for i, a, b in group],
+                                    oformat)
+        seconds = time.perf_counter() - start
+        throughput.observe(hfst_file, sum(b - a for _, a, b in group), seconds)
+        return results, seconds
+
+    pieces: List[List[str]] = [[] for _ in inputs]
+    costs = [0.0] * len(inputs)
+    for group, (results, seconds) in zip(groups, run_parallel([partial(run, g) for g in groups])):
+        for (i, _, _), output in zip(group, results):
+            pieces[i].append(output)
+            costs[i] += seconds / len(group)
+    return [(''.join(p), cost) for p, cost in zip(pieces, costs)]
+
+@validate_file_existance
+def call_hfst_proc_many(hfst_file: Union[Path, str],
+                        inputs: List[List[str]],
+                        oformat: str = 'cg') -> List[str]:
+    """Same as `call_hfst_proc` for every item of `inputs`,
+    but all of them are passed to a single hfst-proc worker one after another.
+    With the token cache enabled, only unknown tokens reach the transducer,
+    all of them as one input, whose output is split back by token.
+    Outputs are put back together in input order.
+    """
+    if not oformat in OUTPUT_FORMATS:
+        raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
+    cache = get_token_cache()
+    if cache is None:
+        return [out for out, _ in _hfst_proc_outputs(hfst_file, inputs, oformat)]
+
+    tokens = list(dict.fromkeys(tok for strings in inputs for tok in strings))
+    known = cache.get_many(hfst_file, oformat, tokens)
+    misses = [tok for tok in tokens if tok not in known]
+    record_cache_lookups(hfst_file, len(known), len(misses))
+    if misses:
+        [(output, seconds)] = _hfst_proc_outputs(hfst_file, [misses], oformat)
+        pieces = split_output(output, misses, oformat)
+        if pieces is None:
+            # the output doesn't split back by token, nothing to cache
+            logger.info(f'Uncached call, output of {hfst_file} can\'t be split by token')
+            return [out for out, _ in _hfst_proc_outputs(hfst_file, inputs, oformat)]
+        cost = seconds / len(misses)
+        computed = {tok: (piece, cost) for tok, piece in zip(misses, pieces)}
+        cache.put_many(hfst_file, oformat, computed)
+        known.update((tok, out) for tok, (out, _) in computed.items())
+    return [''.join(known[tok] for tok in strings) for strings in inputs]
+
+@validate_file_existance
+def call_hfst_proc(hfst_file: Union[Path, str],
+                   input_strings: List[str],
+                   oformat: str = 'cg') -> str:
+    return call_hfst_proc_many(hfst_file, [input_strings], oformat)[0]
+
 @validate_file_existance
 def call_hfst_lookup(hfst_file: Union[Path, str],
                      input_strings: List[str],
@@ -124,31 +293,48 @@ def call_hfst_lookup(hfst_file: Union[Path, str],
     hfst_file = str(hfst_file)
 
     inp_str = '\n'.join(input_strings)
-    stdout, stderr, code = call_command(
-        ['hfst-lookup', '-q', 
-         '--output-format', injection_filter(oformat), 
-         injection_filter(hfst_file)], 
-        inp_str
-    )
-    if code != 0:
-        raise HfstException(f'hfst-lookup: stdout={stdout}; stderr={stderr} code: {code}')
-    return stdout
+    stdout, stderr, code = call_command(_hfst_lookup_args(hfst_file, oformat), inp_str)
+    return _hfst_lookup_result(hfst_file, stdout, stderr, code)
+
+def check_suffix(hfst_file: Path) -> None:
+    if hfst_file.suffix not in ('.hfst', '.hfstol'):
+        raise ValueError(f'Invalid FST format. Expected .hfst/.hfstol, got \'{hfst_file.suffix}\'')
 
 @validate_file_existance
 def call_hfst(hfst_file: Union[Path, str], 
               input_strings: List[str],
               oformat: str = 'cg') -> str:
     """Inputs all strings to a HFST transducer and returns it's output.
-    First, it tries to call hfst-proc but fallbacks to hfst-lookup if FST is not optimized.
+    hfst-proc reads the transducer, or its optimized copy, see `convert.py`.
+    Transducers that can't be converted go to hfst-lookup.
     """
     if not oformat in OUTPUT_FORMATS:
         raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
-    
-    if hfst_file.suffix == '.hfst':
-        return call_hfst_lookup(hfst_file, input_strings, oformat)
-    if hfst_file.suffix == '.hfstol':
+    check_suffix(hfst_file)
+
+    optimized = fast_path(hfst_file)
+    if optimized is not None:
+        try:
+            return call_hfst_proc(optimized, input_strings, oformat)
+        except HFSTInvalidFormat:
+            get_format_registry().mark_slow(hfst_file)
+    return call_hfst_lookup(hfst_file, input_strings, oformat)
+
+@validate_file_existance
+def call_hfst_many(hfst_file: Union[Path, str],
+                   inputs: List[List[str]],
+                   oformat: str = 'cg') -> List[str]:
+    """Same as `call_hfst` for every item of `inputs`, with one transducer invocation
+    for all of them where the transducer is optimized.
+    """
+    if not oformat in OUTPUT_FORMATS:
+        raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
+    check_suffix(hfst_file)
+
+    optimized = fast_path(hfst_file)
+    if optimized is not None:
         try:
-            return call_hfst_proc(hfst_file, input_strings, oformat)
+            return call_hfst_proc_many(optimized, inputs, oformat)
         except HFSTInvalidFormat:
-            return call_hfst_lookup(hfst_file, input_strings, oformat)
-    raise ValueError(f'Invalid FST format. Expected .hfst/.hfstol, got \'{hfst_file.suffix}\'')
+            get_format_registry().mark_slow(hfst_file)
+    return [call_hfst_lookup(hfst_file, strings, oformat) for strings in inputs]
@@ -0,0 +1,195 @@
+"""Optimized lookup copies of transducers that aren't in that format.
+
+hfst-proc only reads optimized lookup transducers, everything else goes
+to hfst-lookup, which is a lot slower. Such transducers are converted
+once with `hfst-fst2fst --optimized-lookup-weighted` into
+`HFST_CONVERT_DIR/<sha1 of content>.hfstol`: on ingest by
+`projectsautoinit` and on the first call otherwise. Equal files share a
+copy and a replaced file gets a new one.
+
+The format of every file is read from its HFST3 header and remembered
+with its size and mtime, so calls go straight to hfst-proc (or the native
+reader) without an hfst-proc failure first.
+"""
+from typing import Dict, Iterable, Optional, Set, Tuple, Union
+from pathlib import Path
+import threading
+import tempfile
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+
+from .exceptions import HfstException
+from .optimized_lookup import UnsupportedTransducer
+from .header import read_header
+from .instruments import alias_transducer
+
+logger = logging.getLogger(__name__)
+
+FORMAT_OPTIMIZED = 'optimized'
+FORMAT_OTHER = 'other'
+FORMAT_UNKNOWN = 'unknown'
+
+def detect_format(hfst_file: Union[Path, str]) -> str:
+    """`FORMAT_OPTIMIZED` or `FORMAT_OTHER` from the HFST3 header,
+    `FORMAT_UNKNOWN` for files without one
+    """
+    try:
+        header = read_header(hfst_file)
+    except UnsupportedTransducer:
+        return FORMAT_UNKNOWN
+    return FORMAT_OPTIMIZED if header.optimized else FORMAT_OTHER
+
+def content_digest(hfst_file: Union[Path, str]) -> str:
+    h = hashlib.sha1()
+    with open(hfst_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def converted_path(digest: str) -> Path:
+    return Path(settings.HFST_CONVERT_DIR) / f'{digest}.hfstol'
+
+def convert_transducer(hfst_file: Union[Path, str], target: Path) -> Path:
+    """Write an optimized lookup copy of `hfst_file` to `target`"""
+    # imported here, call.py picks the transducer to run with this module
+    from .call import call_command, injection_filter
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=target.parent, suffix='.tmp')
+    os.close(fd)
+    try:
+        stdout, stderr, code = call_command(['hfst-fst2fst', '--optimized-lookup-weighted',
+                                             '-o', tmp, '-i', injection_filter(str(hfst_file))])
+        if code != 0:
+            raise HfstException(f'hfst-fst2fst: {stdout.strip()} {hfst_file} code: {code}')
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return target
+
+Version = Tuple[int, int]
+
+class FormatRegistry:
+    """Remembers which file hfst-proc should read for every transducer,
+    `None` for transducers only hfst-lookup can read
+    """
+    def __init__(self):
+        self.entries: Dict[str, Tuple[Version, Optional[Path]]] = {}
+        self.lock = threading.Lock()
+        # content digest -> [lock, callers], conversions of different transducers
+        # run at once, an entry lives only while somebody converts or waits
+        self.converting: Dict[str, list] = {}
+
+    def fast_path(self, hfst_file: Path, convert: bool = True) -> Optional[Path]:
+        key = str(hfst_file)
+        st = os.stat(hfst_file)
+        version = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[0] == version \
+                and (entry[1] is None or entry[1] == hfst_file or entry[1].is_file()):
+            return entry[1]
+        if not convert and detect_format(hfst_file) == FORMAT_OTHER:
+            # hashing and converting is left to the first call
+            return None
+        target = self._resolve(hfst_file)
+        with self.lock:
+            self.entries[key] = (version, target)
+        return target
+
+    def _resolve(self, hfst_file: Path) -> Optional[Path]:
+        fmt = detect_format(hfst_file)
+        if fmt == FORMAT_OPTIMIZED:
+            return hfst_file
+        if fmt == FORMAT_UNKNOWN:
+            # no header to tell, hfst-proc is tried on .hfstol only
+            return hfst_file if hfst_file.suffix == '.hfstol' else None
+        if not settings.HFST_CONVERT_ENABLED:
+            return None
+        digest = content_digest(hfst_file)
+        target = converted_path(digest)
+        with self.lock:
+            converting = self.converting.setdefault(digest, [threading.Lock(), 0])
+            converting[1] += 1
+        # one conversion of a content at a time, a second caller finds the file done
+        try:
+            with converting[0]:
+                if not target.is_file():
+                    try:
+                        convert_transducer(hfst_file, target)
+                        logger.info(f'Converted {hfst_file} to optimized lookup format')
+                    except (HfstException, OSError) as e:
+                        logger.warning(f'Failed to convert {hfst_file}: {e}')
+                        return None
+        finally:
+            with self.lock:
+                converting[1] -= 1
+                if converting[1] == 0:
+                    del self.converting[digest]
+        alias_transducer(target, hfst_file)
+        return target
+
+    def mark_slow(self, hfst_file: Path) -> None:
+        """hfst-proc refused the transducer, send it to hfst-lookup from now on"""
+        try:
+            st = os.stat(hfst_file)
+        except OSError:
+            return
+        with self.lock:
+            self.entries[str(hfst_file)] = ((st.st_size, st.st_mtime_ns), None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+_registry: Optional[FormatRegistry] = None
+_registry_lock = threading.Lock()
+_pid = os.getpid()
+
+def get_format_registry() -> FormatRegistry:
+    global _registry
+    if os.getpid() != _pid:
+        _reset_after_fork()
+    with _registry_lock:
+        if _registry is None:
+            _registry = FormatRegistry()
+        return _registry
+
+def fast_path(hfst_file: Union[Path, str], convert: bool = True) -> Optional[Path]:
+    """Transducer to run hfst-proc on instead of `hfst_file`, `None` if only hfst-lookup can.
+    Without `convert` transducers that aren't optimized are neither hashed nor converted
+    and give `None`, nothing is remembered about them.
+    """
+    return get_format_registry().fast_path(Path(hfst_file), convert)
+
+def prepare_transducer(hfst_file: Union[Path, str]) -> Optional[Path]:
+    """`fast_path` for ingest, files that can't be read are left to the first call"""
+    try:
+        return fast_path(hfst_file)
+    except OSError as e:
+        logger.warning(f'Failed to read {hfst_file}: {e}')
+        return None
+
+def prune_converted(keep: Iterable[Path]) -> int:
+    """Delete converted copies not in `keep`, returns how many"""
+    keep: Set[Path] = set(keep)
+    removed = 0
+    for copy in Path(settings.HFST_CONVERT_DIR).glob('*.hfstol'):
+        if copy not in keep:
+            copy.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+def _reset_after_fork() -> None:
+    global _registry_lock, _pid
+    _pid = os.getpid()
+    _registry_lock = threading.Lock()
+    if _registry is not None:
+        _registry.lock = threading.Lock()
+        _registry.converting = {}
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
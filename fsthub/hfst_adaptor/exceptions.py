@@ -2,4 +2,9 @@ class HfstException(Exception):
     pass
 
 class HFSTInvalidFormat(HfstException):
-    pass
\ No newline at end of file
+    pass
+class HfstOverloaded(HfstException):
+    """No slot to run the transducer in, try again in `retry_after` seconds"""
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,49 @@
+"""HFST3 headers read in Python.
+
+Every transducer written by HFST 3 or later starts with a header of
+`key\\0value\\0` properties: `version`, `type` (the implementation),
+`name` and whatever `hfst-edit-metadata --add` put there. Reading it
+takes a few kilobytes of the file, instead of an `hfst-edit-metadata -p`
+process that loads the whole transducer.
+"""
+from typing import Dict, Union
+from dataclasses import dataclass
+from pathlib import Path
+import struct
+
+from .optimized_lookup import OL_TYPES, UnsupportedTransducer, read_hfst3_header
+
+HEADER_BYTES = 4096
+
+@dataclass
+class HfstHeader:
+    properties: Dict[str, str]
+    # offset of the transducer data
+    size: int
+
+    @property
+    def implementation(self) -> str:
+        """`TROPICAL_OPENFST`, `FOMA`, `HFST_OL`, ..."""
+        return self.properties.get('type', '')
+
+    @property
+    def optimized(self) -> bool:
+        """Whether hfst-proc can read the transducer"""
+        return self.implementation in OL_TYPES
+
+def read_header(hfst_file: Union[Path, str]) -> HfstHeader:
+    """Header of the transducer, raises `UnsupportedTransducer` for files without one"""
+    with open(hfst_file, 'rb') as f:
+        head = f.read(HEADER_BYTES)
+        if len(head) < 8 or head[:5] != b'HFST\0':
+            raise UnsupportedTransducer('No HFST3 header')
+        size = struct.unpack_from('<H', head, 5)[0]
+        if 8 + size > len(head):
+            head += f.read(8 + size - len(head))
+    if 8 + size > len(head):
+        raise UnsupportedTransducer('Truncated HFST3 header')
+    try:
+        properties, offset = read_hfst3_header(head)
+    except struct.error as e:
+        raise UnsupportedTransducer(f'Malformed HFST3 header: {e}')
+    return HfstHeader(properties, offset)
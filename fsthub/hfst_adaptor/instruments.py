@@ -0,0 +1,108 @@
+"""Metrics of transducer calls, exposed at /api/metrics.
+
+Every sample is labelled with the transducer (path relative to
+`HFST_CONTENT_ROOT`) and the API endpoint that made the call, empty
+outside of requests. The cache hit ratio is
+`hits / (hits + misses)` of `fsthub_token_cache_lookups_total`.
+"""
+from typing import Dict, Optional, Union
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+
+from metrics import Counter, Gauge, Histogram, add_collector, current_endpoint
+from .cache import get_token_cache
+
+LABELS = ['tool', 'transducer', 'endpoint']
+
+SPAWNS = Counter('fsthub_hfst_spawns_total',
+                 'hfst processes started', LABELS)
+EXEC_SECONDS = Histogram('fsthub_hfst_exec_seconds',
+                         'Wall time of a single transducer call', LABELS)
+BYTES_IN = Counter('fsthub_hfst_input_bytes_total',
+                   'Bytes passed to transducers', LABELS)
+BYTES_OUT = Counter('fsthub_hfst_output_bytes_total',
+                    'Bytes read from transducers', LABELS)
+FAILURES = Counter('fsthub_hfst_failures_total',
+                   'Failed transducer calls by exception type', LABELS + ['exception'])
+CACHE_LOOKUPS = Counter('fsthub_token_cache_lookups_total',
+                        'Token cache lookups, result is hit or miss',
+                        ['transducer', 'endpoint', 'result'])
+ADMISSION_WAIT = Histogram('fsthub_admission_wait_seconds',
+                           'Time calls waited for a slot to run in', ['transducer', 'endpoint'])
+ADMISSION_REJECTED = Counter('fsthub_admission_rejected_total',
+                             'Calls shed by admission control, reason is queue_full or timeout',
+                             ['transducer', 'endpoint', 'reason'])
+ADMISSION_QUEUED = Gauge('fsthub_admission_queued', 'Calls waiting for a slot', ['transducer'])
+ADMISSION_RUNNING = Gauge('fsthub_admission_running', 'Calls holding a slot', ['transducer'])
+CACHE_BYTES = Gauge('fsthub_token_cache_bytes', 'Size of token cache entries')
+CACHE_ENTRIES = Gauge('fsthub_token_cache_entries', 'Tokens in the token cache')
+
+# converted copies are labelled with the transducer they were made of
+_aliases: Dict[str, str] = {}
+
+def alias_transducer(copy: Union[Path, str], hfst_file: Union[Path, str]) -> None:
+    _aliases[str(copy)] = str(hfst_file)
+
+def transducer_label(hfst_file: Union[Path, str]) -> str:
+    hfst_file = Path(_aliases.get(str(hfst_file), hfst_file))
+    try:
+        return str(hfst_file.relative_to(settings.HFST_CONTENT_ROOT))
+    except ValueError:
+        return hfst_file.name
+
+def record_call(tool: str, hfst_file: Union[Path, str], seconds: float,
+                bytes_in: int, bytes_out: int, spawned: bool = False) -> None:
+    labels = {'tool': tool, 'transducer': transducer_label(hfst_file),
+              'endpoint': current_endpoint.get()}
+    if spawned:
+        SPAWNS.inc(**labels)
+    EXEC_SECONDS.observe(seconds, **labels)
+    BYTES_IN.inc(bytes_in, **labels)
+    BYTES_OUT.inc(bytes_out, **labels)
+
+def record_spawn(tool: str, hfst_file: Union[Path, str]) -> None:
+    SPAWNS.inc(tool=tool, transducer=transducer_label(hfst_file),
+               endpoint=current_endpoint.get())
+
+def record_failure(tool: str, hfst_file: Union[Path, str], exc: BaseException) -> None:
+    FAILURES.inc(tool=tool, transducer=transducer_label(hfst_file),
+                 endpoint=current_endpoint.get(), exception=type(exc).__name__)
+
+def record_cache_lookups(hfst_file: Union[Path, str], hits: int, misses: int) -> None:
+    labels = {'transducer': transducer_label(hfst_file), 'endpoint': current_endpoint.get()}
+    if hits:
+        CACHE_LOOKUPS.inc(hits, result='hit', **labels)
+    if misses:
+        CACHE_LOOKUPS.inc(misses, result='miss', **labels)
+
+def record_admission(hfst_file: Union[Path, str], waited: float,
+                     rejected: Optional[str] = None) -> None:
+    labels = {'transducer': transducer_label(hfst_file), 'endpoint': current_endpoint.get()}
+    if rejected is not None:
+        ADMISSION_REJECTED.inc(reason=rejected, **labels)
+    else:
+        ADMISSION_WAIT.observe(waited, **labels)
+
+def counts_failures(tool: str):
+    """Count exceptions raised by a `_<command>_result(hfst_file, ...)` check"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(hfst_file, *args, **kwargs):
+            try:
+                return func(hfst_file, *args, **kwargs)
+            except Exception as e:
+                record_failure(tool, hfst_file, e)
+                raise
+        return wrapper
+    return decorator
+
+def _collect_cache() -> None:
+    cache = get_token_cache()
+    if cache is not None:
+        stats = cache.stats()
+        CACHE_BYTES.set(stats['bytes'])
+        CACHE_ENTRIES.set(stats['entries'])
+
+add_collector(_collect_cache)
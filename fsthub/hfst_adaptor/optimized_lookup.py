@@ -0,0 +1,341 @@
+"""In-process reader for HFST optimized-lookup (.hfstol) transducers.
+
+The file is memory-mapped read-only and its transition tables are walked
+in place, nothing is copied into the python heap. Mapped pages live in
+the OS page cache, so every worker process that maps the same transducer
+shares one copy of it.
+
+Only plain lookups are handled: whenever the input needs something this
+reader does not do (unknown symbols, identity transitions, escaping) it
+gives up with `None` and the caller falls back to `hfst-proc`.
+"""
+from typing import Dict, List, Optional, Tuple, Union
+from collections import OrderedDict
+from pathlib import Path
+import threading
+import struct
+import mmap
+import re
+
+NO_SYMBOL = 0xFFFF
+NO_TABLE_INDEX = 0xFFFFFFFF
+TARGET_TABLE = 2 ** 31
+MAX_ANALYSES = 1000
+MAX_DEPTH = 500
+OL_TYPES = {'HFST_OL', 'HFST_OLW'}
+OL_HEADER = struct.Struct('<HHIIII9I')
+INDEX = struct.Struct('<HI')
+INDEX_WEIGHT = struct.Struct('<Hf')
+TRANSITION = struct.Struct('<HHI')
+TRANSITION_W = struct.Struct('<HHIf')
+FLAG_RE = re.compile(r'^@([PNRDCU])\.([^.@]+)(?:\.([^@]+))?@$')
+# characters hfst-proc would escape or treat specially in its output
+UNSAFE_CHARS = set('^$/\\@{}[]"\t\n\0')
+
+class UnsupportedTransducer(Exception):
+    pass
+
+class AbortLookup(Exception):
+    pass
+
+def read_hfst3_header(buf: Union[bytes, mmap.mmap]) -> Tuple[Dict[str, str], int]:
+    """Parse `HFST\\0<uint16 size>\\0key\\0value\\0...` header.
+
+    Returns
+    -------
+    Tuple[Dict[str, str], int]
+        header properties and offset of the transducer data
+    """
+    if buf[:5] != b'HFST\0':
+        raise UnsupportedTransducer('No HFST3 header')
+    size = struct.unpack_from('<H', buf, 5)[0]
+    if buf[7:8] != b'\0':
+        raise UnsupportedTransducer('Malformed HFST3 header')
+    fields = bytes(buf[8:8 + size]).split(b'\0')
+    props = {}
+    for k, v in zip(fields[0::2], fields[1::2]):
+        props[k.decode('utf8', errors='replace')] = v.decode('utf8', errors='replace')
+    return props, 8 + size
+
+class FlagDiacritic:
+    __slots__ = ('op', 'feature', 'value')
+
+    def __init__(self, op: str, feature: str, value: Optional[str]):
+        self.op = op
+        self.feature = feature
+        self.value = value
+
+    def apply(self, state: Dict[str, Tuple[str, bool]]) -> Optional[Dict[str, Tuple[str, bool]]]:
+        """New flag state after this diacritic, `None` if the path is blocked"""
+        current = state.get(self.feature)
+        op, value = self.op, self.value
+        if op == 'P':
+            return {**state, self.feature: (value, True)}
+        if op == 'N':
+            return {**state, self.feature: (value, False)}
+        if op == 'C':
+            return {k: v for k, v in state.items() if k != self.feature}
+        if op == 'R':
+            if value is None:
+                return state if current is not None else None
+            return state if current == (value, True) else None
+        if op == 'D':
+            if value is None:
+                return state if current is None else None
+            return None if current == (value, True) else state
+        if op == 'U':
+            if current is None or (not current[1] and current[0] != value):
+                return {**state, self.feature: (value, True)}
+            return state if current == (value, True) else None
+        return None
+
+class OptimizedLookupTransducer:
+    def __init__(self, hfst_file: Union[Path, str]):
+        self.hfst_file = Path(hfst_file)
+        with open(self.hfst_file, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except (struct.error, UnicodeDecodeError) as e:
+            self.close()
+            raise UnsupportedTransducer(f'Malformed transducer: {e}')
+
+    def _parse(self) -> None:
+        props, offset = read_hfst3_header(self.mm)
+        if props.get('type') not in OL_TYPES:
+            self.close()
+            raise UnsupportedTransducer(f'Not an optimized lookup transducer: {props.get("type")}')
+        self.properties = props
+        (self.n_input_symbols, n_symbols, index_size, target_size,
+         _states, _transitions, weighted, *_, has_input_epsilon_cycles,
+         _unweighted_cycles) = OL_HEADER.unpack_from(self.mm, offset)
+        self.weighted = bool(weighted)
+        self.has_input_epsilon_cycles = bool(has_input_epsilon_cycles)
+        offset += OL_HEADER.size
+
+        self.symbols: List[str] = []
+        self.flags: Dict[int, FlagDiacritic] = {}
+        for n in range(n_symbols):
+            end = self.mm.find(b'\0', offset)
+            symbol = self.mm[offset:end].decode('utf8')
+            offset = end + 1
+            flag = FLAG_RE.match(symbol)
+            if flag:
+                self.flags[n] = FlagDiacritic(*flag.groups())
+                symbol = ''
+            elif n == 0 or (symbol.startswith('@_') and symbol.endswith('_@')):
+                symbol = ''
+            self.symbols.append(symbol)
+        self.input_symbols: Dict[str, int] = {
+            s: n for n, s in enumerate(self.symbols[:self.n_input_symbols])
+            if s and n not in self.flags
+        }
+        self.max_symbol_len = max((len(s) for s in self.input_symbols), default=1)
+
+        self.index_offset = offset
+        self.target_offset = offset + index_size * INDEX.size
+        self.transition = TRANSITION_W if self.weighted else TRANSITION
+        end = self.target_offset + target_size * self.transition.size
+        if end > len(self.mm):
+            raise UnsupportedTransducer('Transducer tables are truncated')
+
+    def close(self) -> None:
+        if not self.mm.closed:
+            self.mm.close()
+
+    def touch(self) -> int:
+        """Read every page of the mapping so it is resident. Returns mapped bytes."""
+        for pos in range(0, len(self.mm), mmap.PAGESIZE):
+            self.mm[pos]
+        return len(self.mm)
+
+    def tokenize(self, string: str) -> Optional[List[int]]:
+        """Split string into input symbols, longest symbol first"""
+        symbols, pos = [], 0
+        while pos < len(string):
+            for size in range(min(self.max_symbol_len, len(string) - pos), 0, -1):
+                n = self.input_symbols.get(string[pos:pos + size])
+                if n is not None:
+                    symbols.append(n)
+                    pos += size
+                    break
+            else:
+                return None
+        return symbols
+
+    # Table access
+    def _index(self, i: int) -> Tuple[int, int]:
+        return INDEX.unpack_from(self.mm, self.index_offset + i * INDEX.size)
+
+    def _transition(self, i: int) -> Tuple:
+        return self.transition.unpack_from(self.mm, self.target_offset + i * self.transition.size)
+
+    def _final_index(self, i: int) -> Optional[float]:
+        symbol, target = self._index(i)
+        if symbol != NO_SYMBOL or target == NO_TABLE_INDEX:
+            return None
+        if self.weighted:
+            return INDEX_WEIGHT.unpack_from(self.mm, self.index_offset + i * INDEX.size)[1]
+        return 0.0 if target == 1 else None
+
+    def _final_transition(self, i: int) -> Optional[float]:
+        tr = self._transition(i)
+        if tr[0] != NO_SYMBOL or tr[1] != NO_SYMBOL or tr[2] != 1:
+            return None
+        return tr[3] if self.weighted else 0.0
+
+    def lookup(self, string: str) -> Optional[List[Tuple[str, float]]]:
+        """All outputs for the string sorted by weight, `None` if it can't be looked up here"""
+        symbols = self.tokenize(string)
+        if symbols is None:
+            return None
+        symbols.append(NO_SYMBOL)
+        walk = _Walk(symbols)
+        try:
+            self._analyses(walk, 0, 0, 0.0, {}, 0)
+        except (AbortLookup, RecursionError):
+            return None
+        ranked = sorted(walk.results.items(), key=lambda kv: kv[1])
+        return [(out, weight) for out, (weight, _) in ranked]
+
+    def _note(self, walk: '_Walk', weight: float) -> None:
+        string = ''.join(self.symbols[s] for s in walk.output)
+        if string not in walk.results or weight < walk.results[string][0]:
+            walk.results[string] = (weight, tuple(walk.output))
+        if len(walk.results) > MAX_ANALYSES:
+            raise AbortLookup()
+
+    def _analyses(self, walk: '_Walk', i: int, pos: int,
+                  weight: float, flags: Dict, depth: int) -> None:
+        if depth > MAX_DEPTH:
+            raise AbortLookup()
+        symbol = walk.symbols[pos]
+        if i >= TARGET_TABLE:
+            i -= TARGET_TABLE
+            self._epsilons(walk, i + 1, pos, weight, flags, depth)
+            if symbol == NO_SYMBOL:
+                final = self._final_transition(i)
+                if final is not None:
+                    self._note(walk, weight + final)
+                return
+            self._transitions(walk, i + 1, pos, weight, flags, depth)
+        else:
+            eps, target = self._index(i + 1)
+            if eps == 0:
+                self._epsilons(walk, target - TARGET_TABLE, pos, weight, flags, depth)
+            if symbol == NO_SYMBOL:
+                final = self._final_index(i)
+                if final is not None:
+                    self._note(walk, weight + final)
+                return
+            found, target = self._index(i + 1 + symbol)
+            if found == symbol:
+                self._transitions(walk, target - TARGET_TABLE, pos, weight, flags, depth)
+
+    def _follow(self, walk: '_Walk', tr: Tuple, pos: int,
+                weight: float, flags: Dict, depth: int) -> None:
+        if tr[1] != 0 and tr[1] not in self.flags and self.symbols[tr[1]] == '':
+            # identity/unknown output needs the original input, leave it to hfst-proc
+            raise AbortLookup()
+        walk.output.append(tr[1])
+        if self.weighted:
+            weight += tr[3]
+        self._analyses(walk, tr[2], pos, weight, flags, depth + 1)
+        walk.output.pop()
+
+    def _epsilons(self, walk: '_Walk', i: int, pos: int,
+                  weight: float, flags: Dict, depth: int) -> None:
+        while True:
+            tr = self._transition(i)
+            if tr[0] == 0:
+                self._follow(walk, tr, pos, weight, flags, depth)
+            elif tr[0] in self.flags:
+                new_flags = self.flags[tr[0]].apply(flags)
+                if new_flags is not None:
+                    self._follow(walk, tr, pos, weight, new_flags, depth)
+            else:
+                return
+            i += 1
+
+    def _transitions(self, walk: '_Walk', i: int, pos: int,
+                     weight: float, flags: Dict, depth: int) -> None:
+        symbol = walk.symbols[pos]
+        while True:
+            tr = self._transition(i)
+            if tr[0] != symbol:
+                return
+            self._follow(walk, tr, pos + 1, weight, flags, depth)
+            i += 1
+
+class _Walk:
+    """State of a single lookup"""
+    __slots__ = ('symbols', 'output', 'results')
+
+    def __init__(self, symbols: List[int]):
+        self.symbols = symbols
+        self.output: List[int] = []
+        self.results: Dict[str, Tuple[float, Tuple[int, ...]]] = {}
+
+_cache: 'OrderedDict[str, Tuple[int, OptimizedLookupTransducer]]' = OrderedDict()
+_unsupported: Dict[str, int] = {}
+_cache_lock = threading.Lock()
+MAX_LOADED = 256
+
+def get_transducer(hfst_file: Union[Path, str]) -> Optional[OptimizedLookupTransducer]:
+    """Mapped transducer, reloaded if the file changed, `None` if it can't be read here"""
+    key = str(hfst_file)
+    mtime = Path(hfst_file).stat().st_mtime_ns
+    with _cache_lock:
+        if _unsupported.get(key) == mtime:
+            return None
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            _cache.move_to_end(key)
+            return cached[1]
+        try:
+            fst = OptimizedLookupTransducer(hfst_file)
+        except UnsupportedTransducer:
+            _unsupported[key] = mtime
+            return None
+        _cache[key] = (mtime, fst)
+        while len(_cache) > MAX_LOADED:
+            _cache.popitem(last=False)
+        return fst
+
+def format_analyses(token: str, analyses: List[Tuple[str, float]],
+                    oformat: str) -> Optional[str]:
+    """Format analyses the way `hfst-proc --<oformat>` prints them"""
+    if not analyses or UNSAFE_CHARS.intersection(token):
+        return None
+    for out, _ in analyses:
+        if UNSAFE_CHARS.intersection(out):
+            return None
+    if oformat == 'apertium':
+        return '^' + '/'.join([token] + [out for out, _ in analyses]) + '$ '
+    if oformat == 'xerox':
+        return ''.join(f'{token}\t{out}\n' for out, _ in analyses) + '\n'
+    if oformat == 'cg':
+        lines = [f'"<{token}>"\n']
+        for out, _ in analyses:
+            lemma, _, tags = out.partition('<')
+            tags = ('<' + tags).replace('><', ' ').strip('<>') if tags else ''
+            lines.append(f'\t"{lemma}"' + (f' {tags}' if tags else '') + '\n')
+        return ''.join(lines)
+    return None
+
+def native_lookup(hfst_file: Union[Path, str], input_strings: List[str],
+                  oformat: str) -> Optional[str]:
+    """hfst-proc compatible output of input strings, `None` if the reader can't handle them"""
+    fst = get_transducer(hfst_file)
+    if fst is None:
+        return None
+    output = []
+    for token in input_strings:
+        analyses = fst.lookup(token)
+        if analyses is None:
+            return None
+        formatted = format_analyses(token, analyses, oformat)
+        if formatted is None:
+            return None
+        output.append(formatted)
+    return ''.join(output)
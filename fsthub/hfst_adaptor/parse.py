@@ -1,5 +1,6 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
+import math
 import re
 
 @dataclass
@@ -49,3 +50,265 @@ def parse_metadata(hfst_output: str, lower_keys: bool = False) -> Dict[str, str]
 def parse_example(hfst_output: str) -> ExampleItem:
     inp, out = hfst_output.split(':')    
     return ExampleItem(inp, out)
+
+# Structured output
+class Analysis:
+    __slots__ = ('output', 'weight')
+
+    def __init__(self, output: str, weight: Optional[float] = None):
+        self.output = output
+        self.weight = weight
+
+    def __repr__(self):
+        return f'Analysis({self.output!r}, {self.weight!r})'
+    def __eq__(self, other):
+        return isinstance(other, Analysis) \
+            and (self.output, self.weight) == (other.output, other.weight)
+
+    def asdict(self):
+        return {'output': self.output, 'weight': self.weight}
+
+class TokenAnalyses:
+    """Analyses of one input token, empty if the token is unknown"""
+    __slots__ = ('input', 'analyses')
+
+    def __init__(self, input: str, analyses: Optional[List[Analysis]] = None):
+        self.input = input
+        self.analyses = [] if analyses is None else analyses
+
+    def __repr__(self):
+        return f'TokenAnalyses({self.input!r}, {self.analyses!r})'
+    def __eq__(self, other):
+        return isinstance(other, TokenAnalyses) \
+            and (self.input, self.analyses) == (other.input, other.analyses)
+
+    def asdict(self):
+        return {
+            'input': self.input,
+            'analyses': [a.asdict() for a in self.analyses]
+        }
+
+def _weight(text: str) -> Optional[float]:
+    try:
+        weight = float(text)
+    except ValueError:
+        return None
+    return weight if math.isfinite(weight) else None
+
+def _add(token: TokenAnalyses, output: str, weight: Optional[float]) -> None:
+    # unknown tokens: `*tok` from hfst-proc, `tok+?` from hfst-lookup xerox
+    if not output or output[0] == '*' or output.endswith('+?'):
+        return
+    token.analyses.append(Analysis(output, weight))
+
+def _scan_xerox(text: str) -> List[TokenAnalyses]:
+    tokens: List[TokenAnalyses] = []
+    token = None
+    pos, end = 0, len(text)
+    while pos < end:
+        eol = text.find('\n', pos)
+        if eol == -1:
+            eol = end
+        if eol == pos:
+            # blank line ends analyses of a token
+            token = None
+            pos += 1
+            continue
+        tab = text.find('\t', pos, eol)
+        if tab == -1:
+            inp, output, weight = text[pos:eol], '', None
+        else:
+            inp = text[pos:tab]
+            tab2 = text.find('\t', tab + 1, eol)
+            if tab2 == -1:
+                output, weight = text[tab + 1:eol], None
+            elif text.startswith('+?', tab2 + 1):
+                # `tok\ttok\t+?` from hfst-proc
+                output, weight = '', None
+            else:
+                output, weight = text[tab + 1:tab2], _weight(text[tab2 + 1:eol])
+        if token is None or token.input != inp:
+            token = TokenAnalyses(inp)
+            tokens.append(token)
+        _add(token, output, weight)
+        pos = eol + 1
+    return tokens
+
+def _scan_cg(text: str) -> List[TokenAnalyses]:
+    tokens: List[TokenAnalyses] = []
+    token = None
+    pos, end = 0, len(text)
+    while pos < end:
+        eol = text.find('\n', pos)
+        if eol == -1:
+            eol = end
+        first = text[pos]
+        if first == '"' and eol - pos >= 4 and text[pos + 1] == '<' \
+                and text[eol - 2] == '>' and text[eol - 1] == '"':
+            token = TokenAnalyses(text[pos + 2:eol - 2])
+            tokens.append(token)
+        elif first == '\t' and token is not None and text[pos + 1:pos + 2] == '"':
+            # \t"lemma" tag tag[\tweight]
+            line_end = eol
+            weight = None
+            tab = text.rfind('\t', pos + 1, eol)
+            if tab != -1:
+                weight, line_end = _weight(text[tab + 1:eol]), tab
+            quote = text.find('"', pos + 2, line_end)
+            if quote == -1:
+                quote = line_end
+            lemma = text[pos + 2:quote]
+            rest = text[quote + 1:line_end]
+            if rest and not rest.startswith(' '):
+                # `""lemma` printed by some hfst-lookup versions
+                lemma, rest = lemma + rest, ''
+            rest = rest.strip()
+            _add(token, lemma + '<' + rest.replace(' ', '><') + '>' if rest else lemma, weight)
+        pos = eol + 1
+    return tokens
+
+def _unescape(text: str) -> str:
+    return re.sub(r'\\(.)', r'\1', text) if '\\' in text else text
+
+def _split_unescaped(text: str, sep: str) -> List[str]:
+    if '\\' not in text:
+        return text.split(sep)
+    parts, start, i = [], 0, 0
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+            continue
+        if text[i] == sep:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+def _scan_apertium(text: str) -> List[TokenAnalyses]:
+    tokens: List[TokenAnalyses] = []
+    pos = 0
+    while True:
+        start = text.find('^', pos)
+        if start == -1:
+            break
+        if start > 0 and text[start - 1] == '\\':
+            pos = start + 1
+            continue
+        stop = text.find('$', start + 1)
+        while stop != -1 and text[stop - 1] == '\\':
+            stop = text.find('$', stop + 1)
+        if stop == -1:
+            break
+        inp, *outputs = _split_unescaped(text[start + 1:stop], '/')
+        token = TokenAnalyses(_unescape(inp))
+        for output in outputs:
+            weight = None
+            # ^tok/analysis<W:0.5>$ with hfst-proc --weighted
+            w = output.rfind('<W:')
+            if w != -1 and output.endswith('>'):
+                output, weight = output[:w], _weight(output[w + 3:-1])
+            _add(token, _unescape(output), weight)
+        tokens.append(token)
+        pos = stop + 1
+    return tokens
+
+_SCANNERS = {
+    'xerox': _scan_xerox,
+    'cg': _scan_cg,
+    'apertium': _scan_apertium,
+}
+
+def parse_output(hfst_output: str, oformat: str) -> List[TokenAnalyses]:
+    """Parse hfst-proc/hfst-lookup output of any format in one pass.
+    Analyses keep the transducer's output symbols as is (`lemma<tag><tag>`),
+    weights are None if the tool didn't print them.
+    """
+    try:
+        scanner = _SCANNERS[oformat]
+    except KeyError:
+        raise ValueError(f'oformat must be one of {list(_SCANNERS)}, got {oformat}')
+    return scanner(hfst_output)
+
+# Splitting output by input tokens
+def _units_xerox(text: str) -> List[Tuple[int, str]]:
+    units = []
+    pos, end, blank = 0, len(text), True
+    while pos < end:
+        eol = text.find('\n', pos)
+        if eol == -1:
+            eol = end
+        if eol == pos:
+            blank = True
+        elif blank:
+            tab = text.find('\t', pos, eol)
+            units.append((pos, text[pos:eol if tab == -1 else tab]))
+            blank = False
+        pos = eol + 1
+    return units
+
+def _units_cg(text: str) -> List[Tuple[int, str]]:
+    units = []
+    pos, end = 0, len(text)
+    while pos < end:
+        eol = text.find('\n', pos)
+        if eol == -1:
+            eol = end
+        if text.startswith('"<', pos) and eol - pos >= 4 and text[eol - 2:eol] == '>"':
+            units.append((pos, text[pos + 2:eol - 2]))
+        pos = eol + 1
+    return units
+
+def _units_apertium(text: str) -> List[Tuple[int, str]]:
+    units = []
+    pos = 0
+    while True:
+        start = text.find('^', pos)
+        if start == -1:
+            break
+        if start > 0 and text[start - 1] == '\\':
+            pos = start + 1
+            continue
+        stop = text.find('$', start + 1)
+        while stop != -1 and text[stop - 1] == '\\':
+            stop = text.find('$', stop + 1)
+        if stop == -1:
+            break
+        units.append((start, _unescape(_split_unescaped(text[start + 1:stop], '/')[0])))
+        pos = stop + 1
+    return units
+
+_UNITS = {
+    'xerox': _units_xerox,
+    'cg': _units_cg,
+    'apertium': _units_apertium,
+}
+
+def split_output(hfst_output: str, tokens: List[str], oformat: str) -> Optional[List[str]]:
+    """Split hfst-proc output of `' '.join(tokens)` into the output of every token,
+    as if each was looked up alone. `None` if the surface forms in the output
+    don't add up to the tokens, e.g. the transducer tokenized the input differently.
+    """
+    try:
+        units = _UNITS[oformat](hfst_output)
+    except KeyError:
+        raise ValueError(f'oformat must be one of {list(_UNITS)}, got {oformat}')
+    starts: List[int] = []
+    u = 0
+    for token in tokens:
+        if u == len(units):
+            return None
+        starts.append(units[u][0])
+        # a token may come out as several units, `dog.` as `dog` and `.`
+        surface = ''
+        while len(surface) < len(token) and u < len(units):
+            surface += units[u][1]
+            u += 1
+        if surface != token:
+            return None
+    if u != len(units):
+        return None
+    if not starts:
+        return []
+    starts[0] = 0
+    return [hfst_output[a:b] for a, b in zip(starts, starts[1:] + [len(hfst_output)])]
@@ -0,0 +1,336 @@
+"""Chains of transducers run inside the server.
+
+Every stage is an `hfst-lookup` process. A relay thread per stage reads
+its analyses as they come, and writes each output as an input line of
+the next stage, so all stages run at once and nothing is split again by
+the client. Relays remember which input token and which weight every
+line descends from, the result lists the outputs of the last stage per
+input token, with weights summed over the stages like in a composed
+transducer. Tokens without an analysis at some stage are not passed on.
+
+Chains of `.hfst` files used `HFST_PIPELINE_COMPOSE_AFTER` times are
+composed with `hfst-compose` in the background. Later calls run a single
+lookup on the composed transducer, which gives the same result.
+"""
+from typing import IO, Deque, Dict, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import ExitStack
+from pathlib import Path
+import subprocess
+import threading
+import tempfile
+import hashlib
+import logging
+import math
+import re
+import time
+import os
+
+from django.conf import settings
+
+from metrics import add_timing, timed
+from .exceptions import HfstException
+from .call import OUTPUT_FORMATS, call_command, injection_filter, _hfst_lookup_args
+from .instruments import record_call, record_failure
+from .admission import admitted_all
+
+logger = logging.getLogger(__name__)
+
+# (output, weight) of every input token
+Analyses = List[List[Tuple[str, float]]]
+# `<tag><tag>` at the end of an output
+TAGS_RE = re.compile(r'((?:<[^<>]+>)+)$')
+
+def _parse_line(line: str) -> Optional[Tuple[str, float]]:
+    """Output and weight of an hfst-lookup xerox line, `None` if unknown"""
+    columns = line.split('\t')
+    if len(columns) < 2:
+        return None
+    weight = float(columns[2]) if len(columns) > 2 and columns[2] else 0.0
+    if math.isinf(weight) or columns[1].endswith('+?'):
+        return None
+    return columns[1], weight
+
+def _relay(src: IO[bytes], dst: Optional[IO[bytes]],
+           origins: Deque[Tuple[int, float]], next_origins: Optional[Deque[Tuple[int, float]]],
+           analyses: Analyses, counts: List[int], failures: List[Exception]) -> None:
+    """Pass outputs of a stage on to the next one, or to `analyses` after the last one.
+    hfst-lookup answers every input line with a group of lines and an empty one.
+    `counts` are bytes read from `src` and written to `dst`.
+    """
+    origin = None
+    try:
+        for raw in src:
+            counts[0] += len(raw)
+            line = raw.decode().rstrip('\n')
+            if not line:
+                origin = None
+                continue
+            if origin is None:
+                origin = origins.popleft()
+            parsed = _parse_line(line)
+            # an empty output would be skipped by the next stage and break the order
+            if parsed is None or not parsed[0]:
+                continue
+            output, weight = parsed
+            if dst is None:
+                analyses[origin[0]].append((output, origin[1] + weight))
+            else:
+                next_origins.append((origin[0], origin[1] + weight))
+                data = (output + '\n').encode()
+                counts[1] += len(data)
+                dst.write(data)
+                dst.flush()
+    except BrokenPipeError:
+        pass
+    except Exception as e:
+        failures.append(e)
+    finally:
+        if dst is not None:
+            try:
+                dst.close()
+            except BrokenPipeError:
+                pass
+
+def _feed(dst: IO[bytes], tokens: List[str], origins: Deque[Tuple[int, float]],
+          counts: List[int]) -> None:
+    try:
+        for i, token in enumerate(tokens):
+            origins.append((i, 0.0))
+            data = (token + '\n').encode()
+            counts[1] += len(data)
+            dst.write(data)
+        dst.flush()
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            dst.close()
+        except BrokenPipeError:
+            pass
+
+def _run_stages(hfst_files: List[str], tokens: List[str]) -> Analyses:
+    analyses: Analyses = [[] for _ in tokens]
+    if not tokens:
+        return analyses
+    with ExitStack() as stack:
+        stack.enter_context(admitted_all(hfst_files))
+        start = time.perf_counter()
+        procs, errors = [], []
+        try:
+            for hfst_file in hfst_files:
+                stderr = stack.enter_context(tempfile.TemporaryFile())
+                errors.append(stderr)
+                procs.append(subprocess.Popen(_hfst_lookup_args(hfst_file, 'xerox'),
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                              stderr=stderr, shell=False))
+        except OSError:
+            for proc in procs:
+                proc.kill()
+            raise
+        spawned = time.perf_counter()
+        # bytes read from a stage and written to the next one, the first is the feeder
+        counts = [[0, 0] for _ in range(len(procs) + 1)]
+        origins = [deque() for _ in procs]
+        failures: List[Exception] = []
+        threads = [threading.Thread(target=_feed, args=(procs[0].stdin, tokens, origins[0], counts[0]),
+                                    daemon=True)]
+        for i, proc in enumerate(procs):
+            last = i == len(procs) - 1
+            threads.append(threading.Thread(target=_relay, daemon=True, args=(
+                proc.stdout,
+                None if last else procs[i + 1].stdin,
+                origins[i],
+                None if last else origins[i + 1],
+                analyses,
+                counts[i + 1],
+                failures,
+            )))
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + settings.HFST_PIPELINE_TIMEOUT
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        if any(thread.is_alive() for thread in threads):
+            for proc in procs:
+                proc.kill()
+            for proc in procs:
+                proc.wait()
+                proc.stdout.close()
+            raise HfstException(f'hfst-lookup: pipeline timed out after {settings.HFST_PIPELINE_TIMEOUT}s')
+        for proc in procs:
+            proc.wait()
+            proc.stdout.close()
+        done = time.perf_counter()
+        add_timing('spawn', spawned - start)
+        add_timing('exec', done - spawned)
+        for i, (hfst_file, proc, stderr) in enumerate(zip(hfst_files, procs, errors)):
+            if proc.returncode != 0:
+                stderr.seek(0)
+                e = HfstException(f'hfst-lookup: stderr={stderr.read().decode(errors="replace")}; '
+                                  f'{hfst_file} code: {proc.returncode}')
+                record_failure('hfst-lookup', hfst_file, e)
+                raise e
+            record_call('hfst-lookup', hfst_file, done - start,
+                        counts[i][1], counts[i + 1][0], spawned=True)
+    if failures:
+        raise HfstException(f'hfst-lookup: unexpected output of the pipeline: {failures[0]}')
+    return analyses
+
+def _lookup_composed(composed: Path, tokens: List[str]) -> Analyses:
+    stdout, stderr, code = call_command(_hfst_lookup_args(str(composed), 'xerox'), '\n'.join(tokens))
+    if code != 0:
+        raise HfstException(f'hfst-lookup: stdout={stdout}; stderr={stderr} code: {code}')
+    analyses: Analyses = [[] for _ in tokens]
+    origins = deque((i, 0.0) for i in range(len(tokens)))
+    failures: List[Exception] = []
+    _relay((line.encode() for line in stdout.splitlines(keepends=True)), None,
+           origins, None, analyses, [0, 0], failures)
+    if failures:
+        raise HfstException(f'hfst-lookup: unexpected output of {composed.name}: {failures[0]}')
+    return analyses
+
+def _cg_reading(output: str, weight: float) -> str:
+    """`\t"lemma" tag tag\tweight` like hfst-lookup prints, which `parse.parse_output` reads back"""
+    match = TAGS_RE.search(output)
+    lemma = output[:match.start()] if match else output
+    tags = ''.join(f' {tag}' for tag in match.group(1)[1:-1].split('><')) if match else ''
+    return f'\t"{lemma}"{tags}\t{weight:f}'
+
+def format_analyses(tokens: List[str], analyses: Analyses, oformat: str) -> str:
+    """Outputs of every token in one of `OUTPUT_FORMATS`, best weights first.
+    Both the staged and the composed pipeline are formatted here, and read the
+    same as the output of `call_hfst` for `parse.parse_output`.
+    """
+    lines = []
+    with timed('decode'):
+        for token, outputs in zip(tokens, analyses):
+            best: Dict[str, float] = {}
+            for output, weight in outputs:
+                best[output] = min(weight, best.get(output, weight))
+            ranked = sorted(best.items(), key=lambda x: (x[1], x[0]))
+            if oformat == 'xerox':
+                lines.extend(f'{token}\t{output}\t{weight:f}' for output, weight in ranked)
+                if not ranked:
+                    lines.append(f'{token}\t{token}+?\tinf')
+                lines.append('')
+            elif oformat == 'cg':
+                lines.append(f'"<{token}>"')
+                lines.extend(_cg_reading(output, weight) for output, weight in ranked)
+                if not ranked:
+                    lines.append(f'\t"*{token}"')
+            else:
+                lines.append('^' + '/'.join([token] + ([o for o, _ in ranked] or [f'*{token}'])) + '$')
+    return '\n'.join(lines) + '\n'
+
+# Composition of popular chains
+MAX_COUNTED_CHAINS = 1024
+
+def _chain_key(hfst_files: List[Path]) -> Tuple[str, str]:
+    """Key of the chain and key of the current state of its files"""
+    chain, state = hashlib.sha1(), hashlib.sha1()
+    for hfst_file in hfst_files:
+        st = hfst_file.stat()
+        chain.update(str(hfst_file.resolve()).encode() + b'\0')
+        state.update(f'{st.st_size}:{st.st_mtime_ns}\0'.encode())
+    return chain.hexdigest()[:16], state.hexdigest()[:16]
+
+def composed_path(hfst_files: List[Path]) -> Path:
+    chain, state = _chain_key(hfst_files)
+    return Path(settings.HFST_PIPELINE_COMPOSE_DIR) / f'{chain}-{state}.hfst'
+
+def compose_pipeline(hfst_files: List[Path]) -> Path:
+    """Compose the chain into a single transducer, replacing stale compositions of it"""
+    target = composed_path(hfst_files)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=target.parent) as tmp:
+        current = str(hfst_files[0])
+        for i, hfst_file in enumerate(hfst_files[1:]):
+            out = os.path.join(tmp, f'{i}.hfst')
+            stdout, stderr, code = call_command(['hfst-compose', '-o', out, '-1', current,
+                                                 '-2', injection_filter(str(hfst_file))])
+            if code != 0:
+                raise HfstException(f'hfst-compose: {stdout.strip()} {hfst_file} code: {code}')
+            current = out
+        os.replace(current, target)
+    chain = target.name.split('-')[0]
+    for stale in target.parent.glob(f'{chain}-*.hfst'):
+        if stale != target:
+            stale.unlink(missing_ok=True)
+    return target
+
+# uses of the chains seen last, clients choose them
+_uses: 'OrderedDict[Tuple[str, ...], int]' = OrderedDict()
+_pending: set = set()
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_pid = os.getpid()
+
+def _compose_in_background(hfst_files: List[Path]) -> None:
+    key = tuple(map(str, hfst_files))
+    try:
+        compose_pipeline(hfst_files)
+    except (HfstException, OSError) as e:
+        logger.warning(f'Failed to compose {key}: {e}')
+    finally:
+        with _lock:
+            _pending.discard(key)
+
+def note_pipeline_use(hfst_files: List[Path]) -> None:
+    """Count a use of the chain, compose it once it is popular"""
+    global _executor
+    if os.getpid() != _pid:
+        _reset_after_fork()
+    if not settings.HFST_PIPELINE_COMPOSE_AFTER or len(hfst_files) < 2 \
+            or any(f.suffix != '.hfst' for f in hfst_files):
+        # hfst-compose can't read optimized lookup transducers
+        return
+    key = tuple(map(str, hfst_files))
+    with _lock:
+        _uses[key] = _uses.get(key, 0) + 1
+        _uses.move_to_end(key)
+        while len(_uses) > MAX_COUNTED_CHAINS:
+            _uses.popitem(last=False)
+        if _uses[key] < settings.HFST_PIPELINE_COMPOSE_AFTER or key in _pending:
+            return
+        if composed_path(hfst_files).is_file():
+            return
+        _pending.add(key)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hfst-compose')
+    _executor.submit(_compose_in_background, hfst_files)
+
+def call_hfst_pipeline(hfst_files: List[Union[Path, str]],
+                       input_strings: List[str],
+                       oformat: str = 'cg') -> str:
+    """Run `input_strings` through all transducers in order, see the module docstring"""
+    if not oformat in OUTPUT_FORMATS:
+        raise ValueError(f'oformat must be one of {OUTPUT_FORMATS}, got {oformat}')
+    hfst_files = [Path(f) for f in hfst_files]
+    with timed('file_check'):
+        for hfst_file in hfst_files:
+            if not hfst_file.is_file():
+                raise FileNotFoundError(hfst_file)
+            if str(hfst_file).startswith('-'):
+                raise ValueError(
+                    f"For security reasons, files cannot start with '-', got: {hfst_file}"
+                )
+    tokens = [tok for tok in input_strings if tok]
+    composed = composed_path(hfst_files) if len(hfst_files) > 1 else None
+    if composed is not None and composed.is_file():
+        analyses = _lookup_composed(composed, tokens)
+    else:
+        note_pipeline_use(hfst_files)
+        analyses = _run_stages([injection_filter(str(f)) for f in hfst_files], tokens)
+    return format_analyses(tokens, analyses, oformat)
+
+def _reset_after_fork() -> None:
+    global _executor, _lock, _pending, _pid
+    _pid = os.getpid()
+    _executor = None
+    _pending = set()
+    _lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
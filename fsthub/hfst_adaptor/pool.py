@@ -0,0 +1,356 @@
+from typing import List, Optional, Tuple, Union
+from collections import OrderedDict
+from pathlib import Path
+import subprocess
+import tempfile
+import threading
+import logging
+import atexit
+import select
+import time
+import os
+
+from django.conf import settings
+
+from metrics import add_timing, timed
+from .exceptions import HFSTInvalidFormat, HfstException
+from .instruments import record_call, record_failure, record_spawn
+from .admission import admitted
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+INVALID_FORMAT_MSG = 'transducer must be in hfst optimized lookup format.'
+
+class HfstWorker:
+    """A single long-lived `hfst-proc --null-flush` process.
+
+    Every input is terminated with a null byte, hfst-proc answers with
+    its output followed by a null byte and flushes, so the transducer
+    stays loaded between calls.
+    """
+    def __init__(self, hfst_file: Path, oformat: str):
+        self.hfst_file = hfst_file
+        self.oformat = oformat
+        self.proc: Optional[subprocess.Popen] = None
+        self.stderr = None
+        self.last_used = time.monotonic()
+        # bytes, measured by the reaper of the pool
+        self.resident = 0
+
+    @property
+    def args(self) -> List[str]:
+        return ['hfst-proc', '--null-flush', f'--{self.oformat}', str(self.hfst_file)]
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self) -> None:
+        if self.proc is not None:
+            logger.warning(f'Restarting hfst worker {self.args} (code: {self.proc.returncode})')
+            self.close()
+        logger.info(f'Spawned {self.args}')
+        record_spawn('hfst-proc', self.hfst_file)
+        # until it's measured the transducer is about as large as its file
+        self.resident = self.hfst_file.stat().st_size
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(
+            self.args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+            shell=False
+        )
+
+    def close(self) -> None:
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+        if self.proc is not None:
+            self.proc.wait()
+            for stream in (self.proc.stdin, self.proc.stdout):
+                stream.close()
+        if self.stderr is not None:
+            self.stderr.close()
+        self.proc = None
+        self.stderr = None
+        self.resident = 0
+
+    def measure(self) -> None:
+        """Read resident memory of the worker from procfs"""
+        proc = self.proc
+        if proc is None or proc.poll() is not None:
+            self.resident = 0
+            return
+        try:
+            with open(f'/proc/{proc.pid}/statm') as f:
+                self.resident = int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            pass
+
+    def _failure(self, stdout: bytes) -> HfstException:
+        self.proc.wait()
+        self.stderr.seek(0)
+        output = (stdout + self.stderr.read()).decode(errors='replace')
+        code = self.proc.returncode
+        self.close()
+        if output.lower().strip() == INVALID_FORMAT_MSG:
+            return HFSTInvalidFormat(f'hfst-proc: {output.strip()} {self.hfst_file}')
+        return HfstException(f'hfst-proc: stdout={output}; code: {code}')
+
+    def run(self, input: str, timeout: float) -> str:
+        start = time.perf_counter()
+        try:
+            if not self.alive():
+                with timed('spawn'):
+                    self.start()
+            ready = time.perf_counter()
+            output = self._run(input, timeout)
+        except HfstException as e:
+            record_failure('hfst-proc', self.hfst_file, e)
+            raise
+        done = time.perf_counter()
+        record_call('hfst-proc', self.hfst_file, done - start,
+                    len(input.encode('utf8')) + 1, len(output))
+        add_timing('exec', done - ready)
+        with timed('decode'):
+            return output.decode()
+
+    def _run(self, input: str, timeout: float) -> bytes:
+        self.last_used = time.monotonic()
+        try:
+            self.proc.stdin.write(input.encode('utf8').replace(b'\0', b'') + b'\0')
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            raise self._failure(b'')
+        fd = self.proc.stdout.fileno()
+        chunks = []
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                self.close()
+                raise HfstException(f'hfst-proc: timed out after {timeout}s {self.hfst_file}')
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise self._failure(b''.join(chunks))
+            end = chunk.find(b'\0')
+            if end != -1:
+                chunks.append(chunk[:end])
+                break
+            chunks.append(chunk)
+        self.last_used = time.monotonic()
+        return b''.join(chunks)
+
+class TransducerWorkers:
+    """Workers of a single transducer in a single output format"""
+    def __init__(self, hfst_file: Path, oformat: str, size: int):
+        self.hfst_file = hfst_file
+        self.oformat = oformat
+        self.size = size
+        self.mtime = hfst_file.stat().st_mtime_ns
+        self.idle: List[HfstWorker] = []
+        # idle and busy ones
+        self.workers: List[HfstWorker] = []
+        self.busy = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def acquire(self) -> HfstWorker:
+        with self.cond:
+            while not self.idle and self.busy >= self.size:
+                self.cond.wait()
+            self.busy += 1
+            if self.idle:
+                return self.idle.pop()
+            worker = HfstWorker(self.hfst_file, self.oformat)
+            self.workers.append(worker)
+            return worker
+
+    def release(self, worker: HfstWorker) -> None:
+        with self.cond:
+            self.busy -= 1
+            if self.closed:
+                worker.close()
+                self.workers.remove(worker)
+            else:
+                self.idle.append(worker)
+            self.cond.notify()
+
+    def in_use(self) -> bool:
+        with self.cond:
+            return self.busy > 0
+
+    def last_used(self) -> float:
+        with self.cond:
+            return max((w.last_used for w in self.idle), default=time.monotonic())
+
+    def rss(self) -> int:
+        """Last measured resident memory of all workers, busy ones too"""
+        with self.cond:
+            return sum(w.resident for w in self.workers)
+
+    def measure(self) -> None:
+        with self.cond:
+            workers = list(self.workers)
+        for w in workers:
+            w.measure()
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            for w in self.idle:
+                w.close()
+                self.workers.remove(w)
+            self.idle.clear()
+
+class HfstWorkerPool:
+    """Pool of `hfst-proc` workers with LRU eviction of idle transducers.
+
+    Parameters
+    ----------
+    workers_per_file : int
+        max amount of processes per transducer and output format
+    max_transducers : int
+        max amount of transducers kept loaded at once
+    memory_budget : int
+        total resident memory (bytes) all workers are allowed to use
+    idle_timeout : float
+        seconds after which an unused transducer is unloaded
+    call_timeout : float
+        seconds a single call may take before the worker is killed
+    reap_interval : float
+        seconds between measurements of the workers' memory, which also
+        unload transducers unused for `idle_timeout`
+    """
+    def __init__(self, workers_per_file: int = 2,
+                 max_transducers: int = 32,
+                 memory_budget: int = 1024 ** 3,
+                 idle_timeout: float = 600,
+                 call_timeout: float = 30,
+                 reap_interval: float = 10):
+        self.workers_per_file = workers_per_file
+        self.max_transducers = max_transducers
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.call_timeout = call_timeout
+        self.reap_interval = reap_interval
+        self.groups: 'OrderedDict[Tuple[str, str], TransducerWorkers]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.reaper: Optional[threading.Thread] = None
+
+    def _reap(self) -> None:
+        while not self.closed.wait(self.reap_interval):
+            with self.lock:
+                groups = list(self.groups.values())
+            # procfs is read outside of the lock, calls only use the last values
+            for group in groups:
+                group.measure()
+            with self.lock:
+                self._evict(keep=None)
+
+    def _evict(self, keep: Optional[Tuple[str, str]]) -> None:
+        now = time.monotonic()
+        for key, group in list(self.groups.items()):
+            if key != keep and not group.in_use() \
+                    and now - group.last_used() > self.idle_timeout:
+                self._drop(key)
+        # least recently used go first
+        for key, group in list(self.groups.items()):
+            if len(self.groups) <= self.max_transducers:
+                break
+            if key != keep and not group.in_use():
+                self._drop(key)
+        total = sum(g.rss() for g in self.groups.values())
+        for key, group in list(self.groups.items()):
+            if total <= self.memory_budget:
+                break
+            if key != keep and not group.in_use():
+                total -= group.rss()
+                self._drop(key)
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        logger.info(f'Unloading hfst workers of {key}')
+        self.groups.pop(key).close()
+
+    def _group(self, hfst_file: Path, oformat: str) -> TransducerWorkers:
+        key = (str(hfst_file), oformat)
+        with self.lock:
+            group = self.groups.get(key)
+            if group is not None and group.mtime != hfst_file.stat().st_mtime_ns:
+                # transducer was replaced on disk, loaded copies are stale
+                self._drop(key)
+                group = None
+            if group is None:
+                group = TransducerWorkers(hfst_file, oformat, self.workers_per_file)
+                self.groups[key] = group
+            self.groups.move_to_end(key)
+            self._evict(keep=key)
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self._reap, daemon=True, name='hfst-pool-reaper')
+                self.reaper.start()
+            return group
+
+    def run_many(self, hfst_file: Union[Path, str], oformat: str,
+                 inputs: List[str]) -> List[str]:
+        """Run several inputs one after another on a single worker"""
+        group = self._group(Path(hfst_file), oformat)
+        with admitted(hfst_file):
+            worker = group.acquire()
+            try:
+                return [worker.run(inp, self.call_timeout) for inp in inputs]
+            finally:
+                group.release(worker)
+
+    def run(self, hfst_file: Union[Path, str], oformat: str, input: str) -> str:
+        return self.run_many(hfst_file, oformat, [input])[0]
+
+    def close(self) -> None:
+        self.closed.set()
+        with self.lock:
+            for key in list(self.groups):
+                self._drop(key)
+
+_pool: Optional[HfstWorkerPool] = None
+_pool_lock = threading.Lock()
+_pid = os.getpid()
+
+def get_pool() -> Optional[HfstWorkerPool]:
+    """Process-wide worker pool, `None` if disabled in settings"""
+    global _pool
+    if not settings.HFST_POOL_ENABLED:
+        return None
+    if os.getpid() != _pid:
+        _reset_after_fork()
+    with _pool_lock:
+        if _pool is None:
+            _pool = HfstWorkerPool(
+                workers_per_file=settings.HFST_POOL_WORKERS_PER_FILE,
+                max_transducers=settings.HFST_POOL_MAX_TRANSDUCERS,
+                memory_budget=settings.HFST_POOL_MEMORY_BUDGET,
+                idle_timeout=settings.HFST_POOL_IDLE_TIMEOUT,
+                call_timeout=settings.HFST_POOL_CALL_TIMEOUT,
+                reap_interval=settings.HFST_POOL_REAP_INTERVAL,
+            )
+        return _pool
+
+def _reset_after_fork() -> None:
+    # worker processes belong to the parent, children build their own pool
+    global _pool, _pool_lock, _pid
+    _pid = os.getpid()
+    if _pool is not None:
+        for group in _pool.groups.values():
+            for w in group.idle:
+                if w.proc is not None:
+                    w.proc.stdin.close()
+                    w.proc.stdout.close()
+    _pool = None
+    _pool_lock = threading.Lock()
+
+def _close_pool() -> None:
+    if _pool is not None:
+        _pool.close()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_close_pool)
@@ -0,0 +1,128 @@
+"""Splitting of large transducer inputs over several hfst processes.
+
+hfst-proc output of a token doesn't depend on its neighbours, so a list
+of tokens can be cut between any two of them and the outputs of the
+pieces joined back in order give the same text as one run over the whole
+list. That is what the token cache already relies on.
+
+A piece is sized to take about `HFST_SHARD_TARGET_SECONDS` according to
+the measured throughput of its transducer, an exponentially weighted
+moving average of seconds per token. Inputs that fit into a single piece
+run serially, as splitting them would cost more than it saves.
+"""
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+import math
+import os
+
+from django.conf import settings
+
+from metrics import add_parallel_timings, run_with_own_timings
+
+T = TypeVar('T')
+
+class Throughput:
+    """Seconds per token of every transducer"""
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.rates: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, hfst_file: str, tokens: int, seconds: float) -> None:
+        if tokens <= 0:
+            return
+        rate = seconds / tokens
+        with self.lock:
+            old = self.rates.get(hfst_file)
+            self.rates[hfst_file] = rate if old is None else old + self.alpha * (rate - old)
+
+    def rate(self, hfst_file: str) -> Optional[float]:
+        with self.lock:
+            return self.rates.get(hfst_file)
+
+    def chunk_size(self, hfst_file: str) -> int:
+        """Tokens a single piece should have"""
+        rate = self.rate(hfst_file)
+        if not rate:
+            return settings.HFST_SHARD_MIN_TOKENS
+        return max(settings.HFST_SHARD_MIN_TOKENS,
+                   math.ceil(settings.HFST_SHARD_TARGET_SECONDS / rate))
+
+def plan(sizes: List[int], chunk: int, shards: int) -> List[List[Tuple[int, int, int]]]:
+    """Split items with `sizes` tokens into at most `shards` contiguous groups.
+
+    Every group is a list of `(item, start, stop)` token ranges, an item
+    longer than a group is split between groups. A single group means the
+    input is not worth splitting.
+    """
+    total = sum(sizes)
+    count = min(shards, math.ceil(total / chunk)) if total else 1
+    if count <= 1:
+        return [[(i, 0, size) for i, size in enumerate(sizes)]]
+    per_group = math.ceil(total / count)
+    groups: List[List[Tuple[int, int, int]]] = [[]]
+    room = per_group
+    for i, size in enumerate(sizes):
+        start = 0
+        while True:
+            if room == 0 and len(groups) < count:
+                groups.append([])
+                room = per_group
+            stop = size if len(groups) == count else min(size, start + room)
+            groups[-1].append((i, start, stop))
+            room -= stop - start
+            start = stop
+            if start >= size:
+                break
+    return groups
+
+def run_parallel(funcs: List[Callable[[], T]]) -> List[T]:
+    """Results of `funcs` in order, all but the first run in shard threads"""
+    if len(funcs) == 1:
+        return [funcs[0]()]
+    executor = get_executor()
+    # request metrics follow the pieces into the threads, every piece is timed on its own
+    futures = [executor.submit(contextvars.copy_context().run, run_with_own_timings, func)
+               for func in funcs[1:]]
+    done = [run_with_own_timings(funcs[0])] + [f.result() for f in futures]
+    add_parallel_timings(timings for _, timings in done)
+    return [result for result, _ in done]
+
+_throughput: Optional[Throughput] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_pid = os.getpid()
+
+def _check_fork() -> None:
+    # without at-fork hooks (uwsgi without --py-call-osafterfork) it's noticed here
+    if os.getpid() != _pid:
+        _reset_after_fork()
+
+def get_throughput() -> Throughput:
+    global _throughput
+    _check_fork()
+    with _lock:
+        if _throughput is None:
+            _throughput = Throughput(settings.HFST_SHARD_EWMA_ALPHA)
+        return _throughput
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    _check_fork()
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, settings.HFST_SHARD_MAX - 1),
+                                           thread_name_prefix='hfst-shard')
+        return _executor
+
+def _reset_after_fork() -> None:
+    # threads of the parent don't exist in the child
+    global _executor, _lock, _pid
+    _pid = os.getpid()
+    _executor = None
+    _lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
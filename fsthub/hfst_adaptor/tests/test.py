@@ -1,19 +1,48 @@
 """
 Test apps' views through a `django.test.Client` object.
 """
-from unittest import TestCase
+from unittest import TestCase, mock
 from pathlib import Path
+from time import sleep
 import subprocess
+import threading
+import asyncio
 import os
 import shutil
 
+from django.test import override_settings
+
 from hfst_adaptor.call import (
     injection_filter,
     call_hfst_lookup,
     call_hfst_proc,
     call_hfst,
     call_example_generator,
-    call_metadata_extractor
+    call_example_pool,
+    call_metadata_extractor,
+    extract_metadata,
+    OUTPUT_FORMATS
+)
+from hfst_adaptor.acall import acall_hfst, acall_hfst_lookup, acall_metadata_extractor, aextract_metadata
+from hfst_adaptor.header import read_header
+from hfst_adaptor.pool import HfstWorkerPool
+from hfst_adaptor.cache import TokenCache, ENTRY_OVERHEAD
+from hfst_adaptor.instruments import SPAWNS, EXEC_SECONDS, FAILURES
+from hfst_adaptor.exceptions import HfstException, HfstOverloaded
+from hfst_adaptor.admission import Admission
+from hfst_adaptor.shard import Throughput, plan, run_parallel
+from metrics import add_timing, start_timings, stop_timings
+from hfst_adaptor.convert import (
+    FORMAT_OPTIMIZED, FORMAT_OTHER, detect_format, fast_path, get_format_registry, prune_converted
+)
+from hfst_adaptor import pipeline
+from hfst_adaptor.pipeline import (
+    call_hfst_pipeline, compose_pipeline, composed_path, format_analyses, note_pipeline_use,
+    MAX_COUNTED_CHAINS
+)
+from hfst_adaptor.parse import parse_output, parse_metadata, split_output, Analysis, TokenAnalyses
+from hfst_adaptor.optimized_lookup import (
+    OptimizedLookupTransducer, UnsupportedTransducer, native_lookup
 )
 
 class TestHfstCompilable(TestCase):
@@ -108,6 +137,70 @@ class TestHfstCalls(TestCase):
                 f'Hfst returned unexpected output ({fmt}):\n{real_out}\nexpected:\n{exp_out}'
             )
 
+    def test_adaptor_hfst_async_calls(self):
+        for fmt, exp_out in self.expected_proc_out.items():
+            real_out = asyncio.run(acall_hfst(self.test_hfst, ['ping'], oformat=fmt)).strip()
+            self.assertEqual(real_out, exp_out)
+        for fmt, exp_out in self.expected_lookup_out.items():
+            real_out = asyncio.run(acall_hfst_lookup(self.test_hfst, ['ping'], oformat=fmt)).strip()
+            self.assertEqual(real_out, exp_out)
+        self.assertIn('Author: Jane Doe', asyncio.run(acall_metadata_extractor(self.test_hfst)))
+
+    def test_adaptor_hfst_async_native_off_loop(self):
+        threads = []
+        def lookup(*args):
+            threads.append(threading.get_ident())
+            return native_lookup(*args)
+        async def run():
+            with mock.patch('hfst_adaptor.acall.native_lookup', lookup):
+                output = await acall_hfst(self.test_hfst, ['ping'], oformat='apertium')
+            return output, threading.get_ident()
+        with override_settings(HFST_NATIVE_LOOKUP=True):
+            output, loop_thread = asyncio.run(run())
+        self.assertEqual(output.strip(), self.expected_proc_out['apertium'])
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+    def test_adaptor_hfst_metrics(self):
+        key = ('hfst-lookup', 'ping.hfstol', '')
+        spawns = SPAWNS.samples.get(key, 0)
+        calls = sum(EXEC_SECONDS.samples.get(key, [0])[:-1])
+        call_hfst_lookup(self.test_hfst, ['ping'], oformat='xerox')
+        self.assertEqual(SPAWNS.samples[key], spawns + 1)
+        self.assertEqual(sum(EXEC_SECONDS.samples[key][:-1]), calls + 1)
+
+        broken = self.test_root / 'broken.hfst'
+        broken.write_bytes(b'not a transducer')
+        key = ('hfst-lookup', 'broken.hfst', '', 'HfstException')
+        with self.assertRaises(HfstException):
+            call_hfst_lookup(broken, ['ping'], oformat='xerox')
+        self.assertEqual(FAILURES.samples[key], 1)
+
+    def test_adaptor_hfst_sharded_call(self):
+        tokens = ['ping', 'pin', 'ping', 'x'] * 5
+        with override_settings(HFST_NATIVE_LOOKUP=False, HFST_TOKEN_CACHE_BYTES=0,
+                               HFST_SHARD_ENABLED=False):
+            serial = call_hfst_proc(self.test_hfst, tokens, oformat='apertium')
+        with override_settings(HFST_NATIVE_LOOKUP=False, HFST_TOKEN_CACHE_BYTES=0,
+                               HFST_SHARD_MAX=3, HFST_SHARD_MIN_TOKENS=3):
+            self.assertEqual(call_hfst_proc(self.test_hfst, tokens, oformat='apertium'), serial)
+        self.assertEqual(serial.count('^ping/pong$'), 10)
+
+    def test_adaptor_hfst_cache_misses_in_one_call(self):
+        key = ('hfst-proc', 'ping.hfstol', '')
+        tokens = ['ping', 'pin', 'ping', 'x'] * 5 + [f'miss{i}' for i in range(50)]
+        with override_settings(HFST_NATIVE_LOOKUP=False, HFST_POOL_ENABLED=False,
+                               HFST_SHARD_ENABLED=False):
+            for fmt in self.expected_proc_out:
+                with override_settings(HFST_TOKEN_CACHE_BYTES=0):
+                    uncached = call_hfst_proc(self.test_hfst, tokens, oformat=fmt)
+                spawns = SPAWNS.samples.get(key, 0)
+                self.assertEqual(call_hfst_proc(self.test_hfst, tokens, oformat=fmt), uncached)
+                self.assertEqual(SPAWNS.samples[key], spawns + 1, fmt)
+                # everything is known now
+                call_hfst_proc(self.test_hfst, tokens[::-1], oformat=fmt)
+                self.assertEqual(SPAWNS.samples[key], spawns + 1, fmt)
+
     def test_adaptor_hfst_gen_example(self):
         exp_out = 'ping:pong'
         for _ in range(20):
@@ -119,6 +212,9 @@ class TestHfstCalls(TestCase):
                 f'Hfst example generator returned unexpected output:\n{real_out}\nexpected:\n{exp_out}'
             )
 
+    def test_adaptor_hfst_example_pool(self):
+        self.assertEqual(call_example_pool(self.test_hfst, 50), ['ping:pong'])
+
     def test_adaptor_hfst_meta_extraction(self):
         exp_lines = [
             'foo: bar',
@@ -133,3 +229,469 @@ class TestHfstCalls(TestCase):
                 exp_l, real_out,
                 f'Hfst meta extractor didnt return {exp_l}\ngot:\n{real_out}'
             )
+
+    def test_adaptor_header_reader(self):
+        header = read_header(self.test_hfst)
+        self.assertEqual(header.implementation, 'HFST_OL')
+        self.assertTrue(header.optimized)
+        self.assertEqual(header.properties['Author'], 'Jane Doe')
+
+        key = ('hfst-edit-metadata', 'ping.hfstol', '')
+        spawns = SPAWNS.samples.get(key, 0)
+        metadata = extract_metadata(self.test_hfst)
+        self.assertEqual(asyncio.run(aextract_metadata(self.test_hfst)), metadata)
+        self.assertEqual(SPAWNS.samples.get(key, 0), spawns)
+        self.assertEqual(metadata, parse_metadata(call_metadata_extractor(self.test_hfst)))
+
+        # files without a header are left to hfst-edit-metadata
+        broken = self.test_root / 'broken.hfst'
+        broken.write_bytes(b'not a transducer')
+        with self.assertRaises(UnsupportedTransducer):
+            read_header(broken)
+        with self.assertRaises(HfstException):
+            extract_metadata(broken)
+
+class TestHfstPool(TestCase):
+    test_data = Path(__file__).parent / 'test_data'
+    test_root = Path(__file__).parent / 'tmp'
+    test_hfst = test_root / 'ping.hfstol'
+
+    def setUp(self):
+        self.test_root.mkdir(exist_ok=True)
+        shutil.copyfile(self.test_data / 'Makefile',
+                        self.test_root / 'Makefile')
+        shutil.copyfile(self.test_data / 'ping.fst',
+                        self.test_root / 'ping.fst')
+        result = subprocess.run(
+            ["make"],
+            cwd=self.test_root,
+            capture_output=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f'Failed to compile test hfst:\n{result.stdout}\n{result.stderr}')
+        self.pool = HfstWorkerPool(workers_per_file=1, max_transducers=1)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.test_root)
+
+    def worker_pids(self, oformat: str):
+        group = self.pool.groups[(str(self.test_hfst), oformat)]
+        return [w.proc.pid for w in group.idle]
+
+    def test_adaptor_pool_reuses_worker(self):
+        outputs = self.pool.run_many(self.test_hfst, 'apertium', ['ping ', 'ping ping '])
+        self.assertEqual([o.strip() for o in outputs],
+                         ['^ping/pong$', '^ping/pong$ ^ping/pong$'])
+        pids = self.worker_pids('apertium')
+        self.assertEqual(self.pool.run(self.test_hfst, 'apertium', 'ping ').strip(), '^ping/pong$')
+        self.assertEqual(pids, self.worker_pids('apertium'))
+
+    def test_adaptor_pool_restarts_crashed_worker(self):
+        self.pool.run(self.test_hfst, 'xerox', 'ping ')
+        group = self.pool.groups[(str(self.test_hfst), 'xerox')]
+        old_pid = group.idle[0].proc.pid
+        group.idle[0].proc.kill()
+        group.idle[0].proc.wait()
+        self.assertEqual(self.pool.run(self.test_hfst, 'xerox', 'ping ').strip(), 'ping\tpong')
+        self.assertNotEqual(old_pid, self.worker_pids('xerox')[0])
+
+    def test_adaptor_pool_evicts_lru(self):
+        self.pool.run(self.test_hfst, 'xerox', 'ping ')
+        self.pool.run(self.test_hfst, 'cg', 'ping ')
+        self.assertEqual(list(self.pool.groups), [(str(self.test_hfst), 'cg')])
+
+    def test_adaptor_pool_memory_budget(self):
+        pool = HfstWorkerPool(workers_per_file=1, max_transducers=4, reap_interval=3600)
+        try:
+            pool.run(self.test_hfst, 'xerox', 'ping ')
+            group = pool.groups[(str(self.test_hfst), 'xerox')]
+            # the reaper measures workers, calls only read the last value
+            worker = group.workers[0]
+            worker.resident = 0
+            group.measure()
+            self.assertGreater(group.rss(), 0)
+            # memory of busy workers counts too, the least recently used idle group goes
+            busy = group.acquire()
+            self.assertIs(busy, worker)
+            pool.memory_budget = group.rss()
+            pool.run(self.test_hfst, 'cg', 'ping ')
+            self.assertEqual(list(pool.groups), [(str(self.test_hfst), 'xerox'), (str(self.test_hfst), 'cg')])
+            group.release(busy)
+            pool.memory_budget = 0
+            pool.run(self.test_hfst, 'apertium', 'ping ')
+            self.assertEqual(list(pool.groups), [(str(self.test_hfst), 'apertium')])
+        finally:
+            pool.close()
+
+    def test_adaptor_pool_reaper_unloads_idle(self):
+        pool = HfstWorkerPool(workers_per_file=1, idle_timeout=0, reap_interval=0.01)
+        try:
+            pool.run(self.test_hfst, 'xerox', 'ping ')
+            for _ in range(100):
+                if not pool.groups:
+                    break
+                sleep(0.01)
+            self.assertEqual(list(pool.groups), [])
+        finally:
+            pool.close()
+
+class TestOptimizedLookup(TestCase):
+    test_data = Path(__file__).parent / 'test_data'
+    test_root = Path(__file__).parent / 'tmp'
+    test_hfst = test_root / 'ping.hfstol'
+
+    def setUp(self):
+        self.test_root.mkdir(exist_ok=True)
+        shutil.copyfile(self.test_data / 'Makefile',
+                        self.test_root / 'Makefile')
+        shutil.copyfile(self.test_data / 'ping.fst',
+                        self.test_root / 'ping.fst')
+        result = subprocess.run(
+            ["make"],
+            cwd=self.test_root,
+            capture_output=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f'Failed to compile test hfst:\n{result.stdout}\n{result.stderr}')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_root)
+
+    def test_adaptor_native_lookup(self):
+        fst = OptimizedLookupTransducer(self.test_hfst)
+        self.assertEqual(fst.lookup('ping'), [('pong', 0.0)])
+        self.assertEqual(fst.lookup('pin'), [])
+        # 'x' is not in the alphabet
+        self.assertIsNone(fst.lookup('pingx'))
+        self.assertEqual(fst.properties['Author'], 'Jane Doe')
+        fst.close()
+
+    def test_adaptor_native_matches_proc(self):
+        for fmt, exp_out in TestHfstCalls.expected_proc_out.items():
+            real_out = native_lookup(self.test_hfst, ['ping'], fmt)
+            self.assertEqual(real_out.strip(), exp_out)
+        self.assertIsNone(native_lookup(self.test_hfst, ['ping', 'pin'], 'cg'))
+
+    def test_adaptor_native_unsupported(self):
+        with self.assertRaises(UnsupportedTransducer):
+            OptimizedLookupTransducer(self.test_root / 'ping.fst')
+        self.assertIsNone(native_lookup(self.test_root / 'ping.fst', ['ping'], 'cg'))
+
+class TestTokenCache(TestCase):
+    test_root = Path(__file__).parent / 'tmp'
+    test_hfst = test_root / 'cached.hfstol'
+
+    def setUp(self):
+        self.test_root.mkdir(exist_ok=True)
+        self.test_hfst.write_bytes(b'v1')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_root)
+
+    def test_adaptor_cache_hits_and_misses(self):
+        cache = TokenCache(max_bytes=10_000)
+        cache.put_many(self.test_hfst, 'cg', {'ping': ('pong', 0.1)})
+        self.assertEqual(cache.get_many(self.test_hfst, 'cg', ['ping', 'pin']), {'ping': 'pong'})
+        self.assertEqual(cache.get_many(self.test_hfst, 'xerox', ['ping']), {})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 2, 1))
+
+    def test_adaptor_cache_invalidated_by_file_change(self):
+        cache = TokenCache(max_bytes=10_000)
+        cache.put_many(self.test_hfst, 'cg', {'ping': ('pong', 0.1)})
+        self.test_hfst.write_bytes(b'version 2')
+        self.assertEqual(cache.get_many(self.test_hfst, 'cg', ['ping']), {})
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_adaptor_cache_keeps_expensive_tokens(self):
+        cache = TokenCache(max_bytes=3 * (ENTRY_OVERHEAD + 120))
+        cache.put_many(self.test_hfst, 'cg', {'expensive': ('x', 10.0)})
+        cache.put_many(self.test_hfst, 'cg', {f'cheap{i}': ('x', 0.001) for i in range(10)})
+        self.assertIn('expensive', cache.get_many(self.test_hfst, 'cg', ['expensive']))
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+class TestAdmission(TestCase):
+    test_root = Path(__file__).parent / 'tmp'
+    test_hfst = test_root / 'busy.hfstol'
+
+    def setUp(self):
+        self.test_root.mkdir(exist_ok=True)
+        self.test_hfst.write_bytes(b'')
+        self.admission = Admission(self.test_root / 'admission', slots=2, slots_per_file=1,
+                                   queue=4, queue_per_file=1, timeout=0.2, retry_after=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_root)
+
+    def test_adaptor_admission_per_file_limit(self):
+        held = self.admission.acquire(self.test_hfst)
+        other = self.test_root / 'other.hfstol'
+        other.write_bytes(b'')
+        # other transducers still have global slots
+        self.admission.release(other, self.admission.acquire(other))
+        with self.assertRaises(HfstOverloaded) as cm:
+            self.admission.acquire(self.test_hfst)
+        self.assertEqual(cm.exception.retry_after, 3)
+        self.admission.release(self.test_hfst, held)
+        self.admission.release(self.test_hfst, self.admission.acquire(self.test_hfst))
+
+    def test_adaptor_admission_waits_and_sheds(self):
+        held = self.admission.acquire(self.test_hfst)
+        results = []
+        def waiter():
+            try:
+                results.append(self.admission.acquire(self.test_hfst))
+            except HfstOverloaded as e:
+                results.append(e)
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        sleep(0.05)
+        # the only queue place of the transducer is taken by the waiter
+        with self.assertRaises(HfstOverloaded):
+            self.admission.acquire(self.test_hfst)
+        self.admission.release(self.test_hfst, held)
+        thread.join()
+        self.assertIsInstance(results[0], list)
+        self.admission.release(self.test_hfst, results[0])
+
+    def test_adaptor_admission_all_or_nothing(self):
+        other = self.test_root / 'other.hfstol'
+        other.write_bytes(b'')
+        held = self.admission.acquire(other)
+        # the slot of the first stage is not kept while the second is busy
+        with self.assertRaises(HfstOverloaded):
+            self.admission.acquire_all([self.test_hfst, other])
+        self.admission.release(self.test_hfst, self.admission.acquire(self.test_hfst))
+        self.admission.release(other, held)
+        files = [self.test_hfst, other]
+        self.admission.release_all(files, self.admission.acquire_all(files))
+        # a repeated transducer takes a single slot of its own
+        files = [self.test_hfst] * 3 + [other]
+        self.admission.release_all(files, self.admission.acquire_all(files))
+
+    def test_adaptor_admission_pipeline_reserves(self):
+        other = self.test_root / 'other.hfstol'
+        other.write_bytes(b'')
+        held = self.admission.acquire(other)
+        patient = Admission(self.test_root / 'admission', slots=2, slots_per_file=1,
+                            queue=4, queue_per_file=2, timeout=2, retry_after=3)
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(patient.acquire_all([self.test_hfst, other]))
+        )
+        thread.start()
+        sleep(0.1)
+        # the free slot of the first stage is kept for the waiting pipeline
+        impatient = Admission(self.test_root / 'admission', slots=2, slots_per_file=1,
+                              queue=4, queue_per_file=4, timeout=0.2, retry_after=3)
+        with self.assertRaisesRegex(HfstOverloaded, 'Waited'):
+            impatient.acquire(self.test_hfst)
+        self.admission.release(other, held)
+        thread.join()
+        patient.release_all([self.test_hfst, other], results[0])
+
+class TestShard(TestCase):
+    def test_adaptor_shard_plan(self):
+        # large enough to split, items are cut at token boundaries
+        groups = plan([5, 1, 4], chunk=3, shards=2)
+        self.assertEqual(groups, [[(0, 0, 5)], [(1, 0, 1), (2, 0, 4)]])
+        groups = plan([10], chunk=2, shards=3)
+        self.assertEqual(groups, [[(0, 0, 4)], [(0, 4, 8)], [(0, 8, 10)]])
+        # too small to be worth it
+        self.assertEqual(plan([2, 1], chunk=4, shards=4), [[(0, 0, 2), (1, 0, 1)]])
+        self.assertEqual(plan([], chunk=4, shards=4), [[]])
+
+    def test_adaptor_shard_parallel_timings(self):
+        def piece(seconds: float):
+            def run():
+                add_timing('exec', seconds)
+                return seconds
+            return run
+        token = start_timings()
+        try:
+            add_timing('exec', 1)
+            self.assertEqual(run_parallel([piece(2), piece(3), piece(0.5)]), [2, 3, 0.5])
+        finally:
+            timings = stop_timings(token)
+        # pieces ran at once, the longest one counts
+        self.assertEqual(timings, {'exec': 4})
+
+    def test_adaptor_shard_adapts_to_throughput(self):
+        throughput = Throughput(alpha=0.5)
+        with override_settings(HFST_SHARD_MIN_TOKENS=10, HFST_SHARD_TARGET_SECONDS=1):
+            self.assertEqual(throughput.chunk_size('fast.hfstol'), 10)
+            throughput.observe('fast.hfstol', 1000, 1)
+            self.assertEqual(throughput.chunk_size('fast.hfstol'), 1000)
+            throughput.observe('fast.hfstol', 1000, 3)
+            self.assertEqual(throughput.chunk_size('fast.hfstol'), 500)
+            throughput.observe('slow.hfstol', 10, 10)
+            self.assertEqual(throughput.chunk_size('slow.hfstol'), 10)
+
+class TestConvert(TestCase):
+    test_data = Path(__file__).parent / 'test_data'
+    test_root = Path(__file__).parent / 'tmp'
+
+    def setUp(self):
+        self.test_root.mkdir(exist_ok=True)
+        self.test_hfst = self.test_root / 'ping.hfst'
+        result = subprocess.run(['hfst-txt2fst', '-o', str(self.test_hfst)],
+                                input=(self.test_data / 'ping.fst').read_bytes(), capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f'Failed to compile test hfst:\n{result.stdout}\n{result.stderr}')
+        get_format_registry().clear()
+
+    def tearDown(self):
+        get_format_registry().clear()
+        shutil.rmtree(self.test_root)
+
+    def test_adaptor_convert_on_first_use(self):
+        self.assertEqual(detect_format(self.test_hfst), FORMAT_OTHER)
+        with override_settings(HFST_CONVERT_DIR=self.test_root / 'optimized'):
+            key = ('hfst-fst2fst', 'ping.hfst', '')
+            spawns = SPAWNS.samples.get(key, 0)
+            for fmt, exp_out in TestHfstCalls.expected_proc_out.items():
+                self.assertEqual(call_hfst(self.test_hfst, ['ping'], oformat=fmt).strip(), exp_out)
+            # converted once, remembered afterwards
+            self.assertEqual(SPAWNS.samples[key], spawns + 1)
+            optimized = fast_path(self.test_hfst)
+            self.assertEqual(optimized.parent, self.test_root / 'optimized')
+            self.assertEqual(detect_format(optimized), FORMAT_OPTIMIZED)
+
+            # a changed file gets a new copy, the old one is stale
+            att = (self.test_data / 'ping.fst').read_text().replace('i\to', 'i\tu')
+            subprocess.run(['hfst-txt2fst', '-o', str(self.test_hfst)], input=att.encode(), check=True)
+            self.assertEqual(call_hfst(self.test_hfst, ['ping'], oformat='apertium').strip(),
+                             '^ping/pung$')
+            self.assertEqual(prune_converted([fast_path(self.test_hfst)]), 1)
+            self.assertFalse(optimized.is_file())
+
+    def test_adaptor_convert_concurrent(self):
+        with override_settings(HFST_CONVERT_DIR=self.test_root / 'optimized'):
+            key = ('hfst-fst2fst', 'ping.hfst', '')
+            spawns = SPAWNS.samples.get(key, 0)
+            targets = []
+            threads = [threading.Thread(target=lambda: targets.append(fast_path(self.test_hfst)))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(set(targets)), 1)
+            self.assertEqual(SPAWNS.samples[key], spawns + 1)
+            # locks of finished conversions are dropped
+            self.assertEqual(get_format_registry().converting, {})
+
+    def test_adaptor_convert_skipped(self):
+        with override_settings(HFST_CONVERT_DIR=self.test_root / 'optimized'):
+            self.assertIsNone(fast_path(self.test_hfst, convert=False))
+            self.assertFalse((self.test_root / 'optimized').exists())
+            # not remembered, the next call converts it
+            self.assertEqual(fast_path(self.test_hfst).parent, self.test_root / 'optimized')
+
+    def test_adaptor_convert_disabled(self):
+        with override_settings(HFST_CONVERT_ENABLED=False):
+            self.assertIsNone(fast_path(self.test_hfst))
+            self.assertEqual(call_hfst(self.test_hfst, ['ping'], oformat='apertium').strip(),
+                             '^ping/pong$')
+
+class TestPipeline(TestCase):
+    test_data = Path(__file__).parent / 'test_data'
+    test_root = Path(__file__).parent / 'tmp'
+    # pong -> pung with a weight, chained after ping -> pong
+    pong_att = '0\t1\tp\tp\t0.5\n1\t2\to\tu\t0.0\n2\t3\tn\tn\t0.0\n3\t4\tg\tg\t0.0\n4\t0.5\n'
+
+    def setUp(self):
+        self.test_root.mkdir(exist_ok=True)
+        self.files = []
+        for name, att in [('ping', (self.test_data / 'ping.fst').read_text()),
+                          ('pong', self.pong_att)]:
+            hfst_file = self.test_root / f'{name}.hfst'
+            result = subprocess.run(['hfst-txt2fst', '-o', str(hfst_file)],
+                                    input=att.encode(), capture_output=True)
+            if result.returncode != 0:
+                raise RuntimeError(f'Failed to compile test hfst:\n{result.stdout}\n{result.stderr}')
+            self.files.append(hfst_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_root)
+
+    def test_adaptor_pipeline_stages(self):
+        with override_settings(HFST_PIPELINE_COMPOSE_AFTER=0):
+            self.assertEqual(call_hfst_pipeline(self.files, ['ping', 'pang', 'ping'], oformat='xerox'),
+                             'ping\tpung\t1.000000\n\npang\tpang+?\tinf\n\nping\tpung\t1.000000\n\n')
+            self.assertEqual(call_hfst_pipeline(self.files, ['ping', 'pang'], oformat='apertium'),
+                             '^ping/pung$\n^pang/*pang$\n')
+            # pong is unknown to the second stage
+            self.assertEqual(call_hfst_pipeline(self.files[:1] * 2, ['ping'], oformat='cg'),
+                             '"<ping>"\n\t"*ping"\n')
+            self.assertEqual(call_hfst_pipeline(self.files, ['ping'], oformat='cg'),
+                             '"<ping>"\n\t"pung"\t1.000000\n')
+        # tags are split like hfst prints them, and read back the same
+        cg = format_analyses(['ping'], [[('pong<n><sg>', 0.5)]], 'cg')
+        self.assertEqual(cg, '"<ping>"\n\t"pong" n sg\t0.500000\n')
+        self.assertEqual(parse_output(cg, 'cg'), [TokenAnalyses('ping', [Analysis('pong<n><sg>', 0.5)])])
+
+    def test_adaptor_pipeline_chains_bounded(self):
+        with override_settings(HFST_PIPELINE_COMPOSE_AFTER=2):
+            for i in range(MAX_COUNTED_CHAINS + 10):
+                note_pipeline_use(self.files + [self.test_root / f'{i}.hfst'])
+            self.assertEqual(len(pipeline._uses), MAX_COUNTED_CHAINS)
+
+    def test_adaptor_pipeline_composed(self):
+        tokens = ['ping', 'pin', 'ping']
+        with override_settings(HFST_PIPELINE_COMPOSE_AFTER=0,
+                               HFST_PIPELINE_COMPOSE_DIR=self.test_root / 'composed'):
+            piped = {fmt: call_hfst_pipeline(self.files, tokens, oformat=fmt) for fmt in OUTPUT_FORMATS}
+            composed = compose_pipeline(self.files)
+            self.assertEqual(composed, composed_path(self.files))
+            for fmt in OUTPUT_FORMATS:
+                self.assertEqual(call_hfst_pipeline(self.files, tokens, oformat=fmt), piped[fmt])
+
+            # a changed stage makes the composition stale
+            self.files[1].write_bytes(self.files[1].read_bytes())
+            os.utime(self.files[1], ns=(0, 0))
+            self.assertFalse(composed_path(self.files).is_file())
+            self.assertEqual(compose_pipeline(self.files).parent, composed.parent)
+            self.assertFalse(composed.is_file())
+
+class TestParseOutput(TestCase):
+    def test_adaptor_parse_xerox(self):
+        self.assertEqual(
+            parse_output('ping\tpong\t0.000000\nping\tpang\t1.5\n\nfoo\tfoo+?\tinf\n\n', 'xerox'),
+            [TokenAnalyses('ping', [Analysis('pong', 0.0), Analysis('pang', 1.5)]),
+             TokenAnalyses('foo', [])]
+        )
+        self.assertEqual(parse_output('ping\tpong\n\nfoo\tfoo\t+?\n\n', 'xerox'),
+                         [TokenAnalyses('ping', [Analysis('pong')]), TokenAnalyses('foo', [])])
+
+    def test_adaptor_parse_cg(self):
+        self.assertEqual(
+            parse_output('"<ping>"\n\t"pong" n sg\n"<foo>"\n\t"*foo"\n', 'cg'),
+            [TokenAnalyses('ping', [Analysis('pong<n><sg>')]), TokenAnalyses('foo', [])]
+        )
+        # https://github.com/hfst/hfst/issues/589
+        self.assertEqual(parse_output('"<ping>"\n\t""pong\t0.000000', 'cg'),
+                         [TokenAnalyses('ping', [Analysis('pong', 0.0)])])
+
+    def test_adaptor_parse_apertium(self):
+        self.assertEqual(
+            parse_output('^ping/pong<n>/p\\/ng<W:1.5>$ ^foo/*foo$', 'apertium'),
+            [TokenAnalyses('ping', [Analysis('pong<n>'), Analysis('p/ng', 1.5)]),
+             TokenAnalyses('foo', [])]
+        )
+        with self.assertRaises(ValueError):
+            parse_output('', 'json')
+
+    def test_adaptor_split_output(self):
+        self.assertEqual(split_output('ping\tpong\n\nfoo\tfoo\t+?\n\n', ['ping', 'foo'], 'xerox'),
+                         ['ping\tpong\n\n', 'foo\tfoo\t+?\n\n'])
+        self.assertEqual(split_output('"<ping>"\n\t"pong"\n"<dog>"\n\t"dog"\n"<.>"\n\t"."\n',
+                                      ['ping', 'dog.'], 'cg'),
+                         ['"<ping>"\n\t"pong"\n', '"<dog>"\n\t"dog"\n"<.>"\n\t"."\n'])
+        self.assertEqual(split_output('^ping/pong$ ^a\\/b/*a\\/b$ ', ['ping', 'a/b'], 'apertium'),
+                         ['^ping/pong$ ', '^a\\/b/*a\\/b$ '])
+        # tokens the transducer didn't see as such
+        self.assertIsNone(split_output('^ping/pong$ ', ['ping', 'foo'], 'apertium'))
+        self.assertIsNone(split_output('^pi/pi$^ngx/*ngx$ ', ['ping'], 'apertium'))
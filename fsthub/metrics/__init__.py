@@ -0,0 +1,2 @@
+from .__registry import *
+from .__timing import *
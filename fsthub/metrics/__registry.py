@@ -0,0 +1,339 @@
+"""Counters, histograms and gauges shared by all processes of the app.
+
+uwsgi and uvicorn serve requests from several processes and each of
+them only sees its own calls. A process keeps its samples in memory and
+writes them to its own file in `HFST_METRICS_DIR` at most once per
+`HFST_METRICS_FLUSH_INTERVAL`, and at the end of the interval if it
+changed since, so samples of a worker gone idle aren't held back. A scrape of /api/metrics sums the files
+of all processes, so whichever worker answers it reports the same
+totals. Files of exited processes are folded into `archive.json`, so
+counters don't go back when a worker is recycled. Gauges describe a
+living process and are dropped with it.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from contextvars import ContextVar
+from pathlib import Path
+import threading
+import tempfile
+import atexit
+import fcntl
+import json
+import math
+import time
+import uuid
+import os
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ARCHIVE = 'archive.json'
+
+# API endpoint (url name) the current request is served by, set by
+# `api.middleware.RequestMetricsMiddleware`
+current_endpoint: ContextVar[str] = ContextVar('current_endpoint', default='')
+
+LabelValues = Tuple[str, ...]
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.samples: Dict[LabelValues, object] = {}
+        _registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        try:
+            if len(labels) == len(self.labelnames):
+                return tuple(str(labels[name]) for name in self.labelnames)
+        except KeyError:
+            pass
+        raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+
+    def dump(self) -> dict:
+        return {
+            'kind': self.kind,
+            'help': self.documentation,
+            'labels': list(self.labelnames),
+            'samples': [[list(key), value] for key, value in self.samples.items()],
+        }
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        _registry.check_process()
+        with _registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+        _registry.changed()
+
+class Gauge(Metric):
+    """Per-process value, the scrape reports the sum over live processes"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        _registry.check_process()
+        with _registry.lock:
+            self.samples[key] = value
+        _registry.changed()
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        _registry.check_process()
+        with _registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+        _registry.changed()
+
+    def dec(self, value: float = 1, **labels: str) -> None:
+        self.inc(-value, **labels)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Samples are `[count per bucket..., count above the last bucket, sum]`"""
+        key = self._key(labels)
+        i = len(self.buckets)
+        for j, bound in enumerate(self.buckets):
+            if value <= bound:
+                i = j
+                break
+        _registry.check_process()
+        with _registry.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                sample = self.samples[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[i] += 1
+            sample[-1] += value
+        _registry.changed()
+
+    def dump(self) -> dict:
+        dump = super().dump()
+        dump['samples'] = [[k, list(v)] for k, v in dump['samples']]
+        dump['buckets'] = list(self.buckets)
+        return dump
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._new_process()
+
+    def _new_process(self) -> None:
+        # pids are reused, a random suffix keeps files of different processes apart
+        self.pid = os.getpid()
+        self.file_name = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.flushed_at = time.monotonic()
+        # writes changes of the last interval of a process that went idle
+        self.timer: Optional[threading.Timer] = None
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """`collector` updates gauges right before samples are written"""
+        self.collectors.append(collector)
+
+    def check_process(self) -> None:
+        """Reset if this is a forked child nobody told about it: uwsgi only runs
+        at-fork hooks with `--py-call-osafterfork`, otherwise workers would
+        keep the master's samples and write them to its file
+        """
+        if os.getpid() != self.pid:
+            self.reset_after_fork()
+
+    def changed(self) -> None:
+        self.check_process()
+        wait = settings.HFST_METRICS_FLUSH_INTERVAL - (time.monotonic() - self.flushed_at)
+        if wait <= 0:
+            self.flush()
+            return
+        with self.lock:
+            if self.timer is not None:
+                return
+            self.timer = threading.Timer(wait, self._flush_pending)
+            self.timer.daemon = True
+        self.timer.start()
+
+    def _flush_pending(self) -> None:
+        with self.lock:
+            self.timer = None
+        self.flush()
+
+    def dump(self) -> dict:
+        self.check_process()
+        for collector in self.collectors:
+            collector()
+        with self.lock:
+            return {'pid': self.pid,
+                    'metrics': {name: m.dump() for name, m in self.metrics.items()}}
+
+    def flush(self) -> None:
+        """Write samples of this process to its file"""
+        self.check_process()
+        directory = settings.HFST_METRICS_DIR
+        if directory is None or not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.flushed_at = time.monotonic()
+            directory = Path(directory)
+            directory.mkdir(parents=True, exist_ok=True)
+            _write_json(directory / self.file_name, self.dump())
+        except OSError:
+            pass
+        finally:
+            self.flush_lock.release()
+
+    def reset_after_fork(self) -> None:
+        # samples so far belong to the parent and are written by it
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.samples = {}
+        self._new_process()
+
+_registry = Registry()
+
+def add_collector(collector: Callable[[], None]) -> None:
+    _registry.add_collector(collector)
+
+def flush() -> None:
+    _registry.flush()
+
+def _write_json(path: Path, data: dict) -> None:
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _merge(into: Dict[str, dict], dump: dict, gauges: bool = True) -> None:
+    for name, metric in dump.get('metrics', {}).items():
+        if metric['kind'] == 'gauge' and not gauges:
+            continue
+        merged = into.setdefault(name, dict(metric, samples={}))
+        samples = merged['samples']
+        for key, value in metric['samples']:
+            key = tuple(key)
+            old = samples.get(key)
+            if old is None:
+                samples[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                samples[key] = [a + b for a, b in zip(old, value)]
+            else:
+                samples[key] = old + value
+
+def _archive(directory: Path, dumps: Iterable[dict]) -> None:
+    archive = _read_json(directory / ARCHIVE) or {'metrics': {}}
+    merged: Dict[str, dict] = {}
+    _merge(merged, archive)
+    for dump in dumps:
+        _merge(merged, dump, gauges=False)
+    for metric in merged.values():
+        metric['samples'] = [[list(k), v] for k, v in metric['samples'].items()]
+    _write_json(directory / ARCHIVE, {'metrics': merged})
+
+def collect() -> Dict[str, dict]:
+    """Samples of all processes, `{name: {kind, help, labels, samples: {labels: value}}}`"""
+    directory = settings.HFST_METRICS_DIR
+    if directory is None:
+        merged: Dict[str, dict] = {}
+        _merge(merged, _registry.dump())
+        return merged
+    _registry.flush()
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dumps, dead = [], []
+        for path in directory.glob('*-*.json'):
+            dump = _read_json(path)
+            if dump is None:
+                continue
+            if dump['pid'] != _registry.pid and not _pid_alive(dump['pid']):
+                dead.append((path, dump))
+            else:
+                dumps.append(dump)
+        if dead:
+            _archive(directory, [dump for _, dump in dead])
+            for path, _ in dead:
+                path.unlink(missing_ok=True)
+        merged = {}
+        _merge(merged, _read_json(directory / ARCHIVE) or {})
+    for dump in dumps:
+        _merge(merged, dump)
+    return merged
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def render(collected: Optional[Dict[str, dict]] = None) -> str:
+    """Prometheus text exposition format of `collect()`"""
+    if collected is None:
+        collected = collect()
+    lines = []
+    for name in sorted(collected):
+        metric = collected[name]
+        names = metric['labels']
+        lines.append(f'# HELP {name} {metric["help"]}')
+        lines.append(f'# TYPE {name} {metric["kind"]}')
+        for key in sorted(metric['samples']):
+            value = metric['samples'][key]
+            if metric['kind'] != 'histogram':
+                lines.append(f'{name}{_labels(names, key)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + [math.inf], value[:-1]):
+                cumulative += count
+                le = 'le="' + _number(float(bound)) + '"'
+                lines.append(f'{name}_bucket{_labels(names, key, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(names, key)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(names, key)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_registry.reset_after_fork)
+atexit.register(_registry.flush)
@@ -0,0 +1,70 @@
+"""Per-request time breakdown for the `Server-Timing` header.
+
+`api.middleware.ServerTimingMiddleware` opens a timings dict for every
+request, phases timed while it is open add their seconds to it. Outside
+of a request timing a phase costs a context variable lookup.
+"""
+from typing import Callable, Dict, Iterable, Optional, Tuple, TypeVar
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+import time
+
+T = TypeVar('T')
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('server_timings', default=None)
+
+def start_timings() -> Token:
+    return _timings.set({})
+
+def stop_timings(token: Token) -> Dict[str, float]:
+    timings = _timings.get()
+    _timings.reset(token)
+    return timings or {}
+
+def current_timings() -> Optional[Dict[str, float]]:
+    return _timings.get()
+
+def add_timing(phase: str, seconds: float) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+def run_with_own_timings(func: Callable[[], T]) -> Tuple[T, Optional[Dict[str, float]]]:
+    """Run `func` with a timings dict of its own, for pieces that run at once.
+    Threads sharing the request's dict would update it without a lock.
+    """
+    if _timings.get() is None:
+        return func(), None
+    token = _timings.set({})
+    try:
+        result = func()
+    finally:
+        timings = stop_timings(token)
+    return result, timings
+
+def add_parallel_timings(pieces: Iterable[Optional[Dict[str, float]]]) -> None:
+    """Add timings of pieces that ran at once, the longest piece per phase,
+    so the breakdown doesn't add up to more than the wall time
+    """
+    longest: Dict[str, float] = {}
+    for timings in pieces:
+        for phase, seconds in (timings or {}).items():
+            longest[phase] = max(seconds, longest.get(phase, 0.0))
+    for phase, seconds in longest.items():
+        add_timing(phase, seconds)
+
+@contextmanager
+def timed(phase: str):
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """`phase;dur=<ms>, ...` in the order phases first ran"""
+    return ', '.join(f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in timings.items())
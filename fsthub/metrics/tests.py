@@ -0,0 +1,110 @@
+from unittest import TestCase
+from pathlib import Path
+import shutil
+import signal
+import time
+import os
+
+from django.conf import settings
+
+from . import Counter, Gauge, Histogram, collect, render, flush
+from .__registry import _registry
+
+TEST_COUNTER = Counter('fsthub_test_calls_total', 'Test counter', ['transducer'])
+TEST_GAUGE = Gauge('fsthub_test_gauge', 'Test gauge')
+TEST_HISTOGRAM = Histogram('fsthub_test_seconds', 'Test histogram', ['transducer'],
+                           buckets=[0.1, 1])
+
+class TestMetrics(TestCase):
+    test_root = Path(__file__).parent / 'tmp'
+
+    def setUp(self):
+        self.metrics_dir = settings.HFST_METRICS_DIR
+        settings.HFST_METRICS_DIR = self.test_root
+        for metric in (TEST_COUNTER, TEST_GAUGE, TEST_HISTOGRAM):
+            metric.samples.clear()
+
+    def tearDown(self):
+        settings.HFST_METRICS_DIR = self.metrics_dir
+        shutil.rmtree(self.test_root, ignore_errors=True)
+
+    def fork(self, func) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                func()
+                flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+    def test_metrics_summed_over_processes(self):
+        TEST_COUNTER.inc(transducer='a.hfstol')
+        TEST_GAUGE.set(2)
+        def child():
+            TEST_COUNTER.inc(2, transducer='a.hfstol')
+            TEST_COUNTER.inc(transducer='b.hfstol')
+            TEST_GAUGE.set(5)
+        self.fork(child)
+        collected = collect()
+        samples = collected['fsthub_test_calls_total']['samples']
+        self.assertEqual(samples[('a.hfstol',)], 3)
+        self.assertEqual(samples[('b.hfstol',)], 1)
+        # the child has exited, its counters are archived and its gauge is gone
+        self.assertEqual(collected['fsthub_test_gauge']['samples'][()], 2)
+        self.assertTrue((self.test_root / 'archive.json').is_file())
+        self.assertEqual(len(list(self.test_root.glob('*-*.json'))), 1)
+        samples = collect()['fsthub_test_calls_total']['samples']
+        self.assertEqual(samples[('a.hfstol',)], 3)
+
+    def test_metrics_fork_without_hooks(self):
+        TEST_COUNTER.inc(transducer='a.hfstol')
+        flush()
+        parent = (_registry.pid, _registry.file_name, dict(TEST_COUNTER.samples))
+        def child():
+            # as if forked by uwsgi without --py-call-osafterfork
+            _registry.pid, _registry.file_name, TEST_COUNTER.samples = parent
+            TEST_COUNTER.inc(transducer='a.hfstol')
+        self.fork(child)
+        samples = collect()['fsthub_test_calls_total']['samples']
+        self.assertEqual(samples[('a.hfstol',)], 2)
+
+    def test_metrics_idle_process_flushed(self):
+        settings.HFST_METRICS_FLUSH_INTERVAL, interval = 0.2, settings.HFST_METRICS_FLUSH_INTERVAL
+        try:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    # records within the interval and never again, nor exits
+                    TEST_COUNTER.inc(transducer='idle.hfstol')
+                    time.sleep(10)
+                finally:
+                    os._exit(0)
+            try:
+                samples = {}
+                deadline = time.monotonic() + 5
+                while ('idle.hfstol',) not in samples and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    samples = collect()['fsthub_test_calls_total']['samples']
+                self.assertEqual(samples.get(('idle.hfstol',)), 1)
+            finally:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        finally:
+            settings.HFST_METRICS_FLUSH_INTERVAL = interval
+
+    def test_metrics_render(self):
+        TEST_HISTOGRAM.observe(0.05, transducer='x"y.hfstol')
+        TEST_HISTOGRAM.observe(0.5, transducer='x"y.hfstol')
+        TEST_HISTOGRAM.observe(5, transducer='x"y.hfstol')
+        text = render()
+        self.assertIn('# TYPE fsthub_test_seconds histogram', text)
+        self.assertIn('fsthub_test_seconds_bucket{transducer="x\\"y.hfstol",le="0.1"} 1', text)
+        self.assertIn('fsthub_test_seconds_bucket{transducer="x\\"y.hfstol",le="1"} 2', text)
+        self.assertIn('fsthub_test_seconds_bucket{transducer="x\\"y.hfstol",le="+Inf"} 3', text)
+        self.assertIn('fsthub_test_seconds_count{transducer="x\\"y.hfstol"} 3', text)
+        self.assertIn('fsthub_test_seconds_sum{transducer="x\\"y.hfstol"} 5.55', text)
+
+    def test_metrics_label_names_checked(self):
+        with self.assertRaises(ValueError):
+            TEST_COUNTER.inc(fst='a.hfstol')
@@ -0,0 +1,191 @@
+"""In-memory index of `HFST_CONTENT_ROOT`.
+
+The tree is read once with `os.scandir`. After that a refresh only
+stats the directories it already knows and rescans those whose mtime
+changed, so adding a transducer costs one directory listing instead of
+a walk over the whole content root.
+
+Readers get an immutable `Inventory` snapshot, all threads of a worker
+share the same one until something on disk changes.
+"""
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+from pathlib import Path
+import threading
+import hashlib
+import bisect
+import time
+import os
+
+# directories modified this close to the moment they were listed may
+# change again within the same mtime tick, such are listed again
+RACY_NS = 2 * 10 ** 9
+
+class _Dir:
+    __slots__ = ('mtime', 'subdirs', 'files', 'scanned_at')
+
+    def __init__(self, mtime: int, subdirs: Tuple[str, ...],
+                 files: Tuple[str, ...], scanned_at: int):
+        self.mtime = mtime
+        self.subdirs = subdirs
+        self.files = files
+        self.scanned_at = scanned_at
+
+    @property
+    def racy(self) -> bool:
+        return self.mtime >= self.scanned_at - RACY_NS
+
+class Inventory:
+    """Snapshot of projects and transducers, paths are relative to the content root"""
+    __slots__ = ('root', 'generation', 'projects', 'fsts', 'files', 'dirs', '_digest')
+
+    def __init__(self, root: Path, generation: int, projects: List[str],
+                 fsts: List[str], files: FrozenSet[str], dirs: FrozenSet[str]):
+        self.root = root
+        self.generation = generation
+        self.projects = projects
+        self.fsts = fsts
+        self.files = files
+        self.dirs = dirs
+        self._digest: Optional[str] = None
+
+    @property
+    def digest(self) -> str:
+        """Hash of all paths, equal in every process that sees the same tree"""
+        if self._digest is None:
+            h = hashlib.sha1()
+            for path in sorted(self.dirs):
+                h.update(b'd' + path.encode(errors='surrogateescape') + b'\0')
+            for path in sorted(self.files):
+                h.update(b'f' + path.encode(errors='surrogateescape') + b'\0')
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def project_range(self, project: str) -> Tuple[int, int]:
+        """Bounds of transducers inside of a project (or any other directory) in `fsts`"""
+        prefix = project.rstrip('/') + '/'
+        start = bisect.bisect_left(self.fsts, prefix)
+        end = bisect.bisect_left(self.fsts, prefix[:-1] + chr(ord('/') + 1))
+        return start, end
+
+    def project_fsts(self, project: str) -> List[str]:
+        """Transducers inside of a project (or any other directory)"""
+        start, end = self.project_range(project)
+        return self.fsts[start:end]
+
+class InventoryIndex:
+    def __init__(self, root: Path, formats: Set[str]):
+        self.root = root
+        self.formats = frozenset(formats)
+        self.root_id: Optional[Tuple[int, int]] = None
+        self.dirs: Dict[str, _Dir] = {}
+        self.generation = 0
+        self.snapshot: Optional[Inventory] = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _path(self, rel: str) -> str:
+        return os.path.join(self.root, rel) if rel else str(self.root)
+
+    def _drop(self, rel: str) -> None:
+        entry = self.dirs.pop(rel, None)
+        if entry is None:
+            return
+        for name in entry.subdirs:
+            self._drop(os.path.join(rel, name) if rel else name)
+
+    def _scan(self, rel: str, now: int) -> bool:
+        """List a directory, recurse into new subdirectories. Returns True if anything changed"""
+        subdirs, files = [], []
+        try:
+            mtime = os.stat(self._path(rel)).st_mtime_ns
+            with os.scandir(self._path(rel)) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if not is_dir:
+                        files.append(entry.name)
+                    # projects may be symlinks, nested symlinks are not followed
+                    elif not rel or not entry.is_symlink():
+                        subdirs.append(entry.name)
+        except OSError:
+            existed = rel in self.dirs
+            self._drop(rel)
+            return existed
+        old = self.dirs.get(rel)
+        new = _Dir(mtime, tuple(sorted(subdirs)), tuple(sorted(files)), now)
+        self.dirs[rel] = new
+        changed = old is None or old.subdirs != new.subdirs or old.files != new.files
+        old_subdirs = set(old.subdirs) if old is not None else set()
+        for name in old_subdirs.difference(new.subdirs):
+            self._drop(os.path.join(rel, name) if rel else name)
+        for name in new.subdirs:
+            child = os.path.join(rel, name) if rel else name
+            if child not in self.dirs:
+                self._scan(child, now)
+        return changed
+
+    def refresh(self) -> bool:
+        """Bring the index up to date with the disk. Returns True if anything changed"""
+        now = time.time_ns()
+        st = os.stat(self.root)
+        if (st.st_dev, st.st_ino) != self.root_id:
+            self.root_id = (st.st_dev, st.st_ino)
+            self.dirs.clear()
+        if not self.dirs:
+            self._scan('', now)
+            return True
+        changed = False
+        for rel in list(self.dirs):
+            entry = self.dirs.get(rel)
+            if entry is None:
+                # dropped together with its parent
+                continue
+            try:
+                mtime = os.stat(self._path(rel)).st_mtime_ns
+            except OSError:
+                self._drop(rel)
+                changed = True
+                continue
+            if mtime != entry.mtime or entry.racy:
+                changed |= self._scan(rel, now)
+        return changed
+
+    def _build_snapshot(self) -> Inventory:
+        fsts, files = [], set()
+        for rel, entry in self.dirs.items():
+            for name in entry.files:
+                path = os.path.join(rel, name) if rel else name
+                files.add(path)
+                if rel and os.path.splitext(name)[1] in self.formats:
+                    fsts.append(path)
+        return Inventory(
+            root=self.root,
+            generation=self.generation,
+            projects=list(self.dirs[''].subdirs) if '' in self.dirs else [],
+            fsts=sorted(fsts),
+            files=frozenset(files),
+            dirs=frozenset(self.dirs),
+        )
+
+    def get(self, ttl: float = 0) -> Inventory:
+        """Current snapshot, the disk is checked at most once per `ttl` seconds"""
+        with self.lock:
+            if self.snapshot is None or time.monotonic() - self.checked_at >= ttl:
+                if self.refresh() or self.snapshot is None:
+                    self.generation += 1
+                    self.snapshot = self._build_snapshot()
+                self.checked_at = time.monotonic()
+            return self.snapshot
+
+_index: Optional[InventoryIndex] = None
+_index_lock = threading.Lock()
+
+def get_index(root: Path, formats: Set[str]) -> InventoryIndex:
+    """Process-wide index of the content root"""
+    global _index
+    with _index_lock:
+        if _index is None or _index.root != root or _index.formats != frozenset(formats):
+            _index = InventoryIndex(root, formats)
+        return _index
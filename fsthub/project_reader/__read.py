@@ -1,47 +1,37 @@
 from pathlib import Path
-from typing import List, Union
+from typing import List, Tuple, Union
+import os
 from django.conf import settings
 
+from .__index import Inventory, get_index
+
 assert(isinstance(settings.HFST_CONTENT_ROOT, Path))
 assert(settings.HFST_CONTENT_ROOT.is_dir())
 
-def _get_project_paths() -> List[Path]:
-    return [d
-            for d in settings.HFST_CONTENT_ROOT.iterdir()
-            if d.is_dir()]
+def get_inventory() -> Inventory:
+    return get_index(settings.HFST_CONTENT_ROOT, settings.HFST_FORMATS)\
+        .get(ttl=settings.HFST_INVENTORY_TTL)
+
+def _relative(path: Union[str, Path]) -> str:
+    path = os.path.normpath(str(path))
+    return '' if path == '.' else path
 
 def get_projects() -> List[str]:
-    return sorted([str(d.relative_to(settings.HFST_CONTENT_ROOT))
-                   for d in _get_project_paths()])
+    return list(get_inventory().projects)
 
 def get_fsts(project: Union[str, Path]) -> List[str]:
-    if isinstance(project, str):
-        project = Path(project)
-    project = settings.HFST_CONTENT_ROOT.joinpath(project)
-    fsts = []
-    for f in project.glob('**/*'):
-        if not f.suffix in settings.HFST_FORMATS:
-            continue
-        fsts.append(str(f.relative_to(settings.HFST_CONTENT_ROOT)))
-    return sorted(fsts)
+    return get_inventory().project_fsts(_relative(project))
+
+def get_fsts_bounds(project: Union[str, Path]) -> Tuple[List[str], int, int]:
+    """All transducers and bounds of the project's ones among them, nothing is copied"""
+    inventory = get_inventory()
+    return (inventory.fsts, *inventory.project_range(_relative(project)))
 
 def get_all_fsts() -> List[str]:
-    fsts = []
-    for p in _get_project_paths():
-        for f in p.glob('**/*'):
-            if not f.suffix in settings.HFST_FORMATS:
-                continue
-            fsts.append(str(f.relative_to(settings.HFST_CONTENT_ROOT)))
-    return sorted(fsts)
+    return list(get_inventory().fsts)
 
 def file_exists(path: Union[str, Path]) -> bool:
-    if isinstance(path, str):
-        path = Path(path)
-    path = settings.HFST_CONTENT_ROOT.joinpath(path)
-    return path.exists() and path.is_file()
+    return _relative(path) in get_inventory().files
 
 def dir_exists(path: Union[str, Path]) -> bool:
-    if isinstance(path, str):
-        path = Path(path)
-    path = settings.HFST_CONTENT_ROOT.joinpath(path)
-    return path.exists() and path.is_dir()
+    return _relative(path) in get_inventory().dirs
@@ -5,7 +5,9 @@ from time import sleep
 import shutil
 from django.conf import settings
 
-from . import get_all_fsts, get_projects, dir_exists, file_exists, get_fsts
+from . import (
+    get_all_fsts, get_projects, dir_exists, file_exists, get_fsts, get_fsts_bounds, get_inventory
+)
 
 class TestPRViews(TestCase):
     test_root = Path(__file__).parent / 'tmp'
@@ -13,6 +15,8 @@ class TestPRViews(TestCase):
     @classmethod
     def setUpClass(cls):
         settings.HFST_CONTENT_ROOT = cls.test_root
+        # files are created and checked right away
+        settings.HFST_INVENTORY_TTL = 0
         return super().setUpClass()
 
     def setUp(self):
@@ -125,4 +129,38 @@ class TestPRViews(TestCase):
 
         self.assertFalse(file_exists('some/thing.hfst'))
         self.assertFalse(dir_exists('some'))
-    
\ No newline at end of file
+    
+    def test_reader_index_incremental(self):
+        self.create_project('TEST', ['a.hfst', 'b.hfstol', 'readme.txt'])
+        inventory = get_inventory()
+        self.assertEqual(inventory.fsts, ['TEST/a.hfst', 'TEST/b.hfstol'])
+        self.assertTrue(file_exists('TEST/readme.txt'))
+        # nothing changed - same snapshot
+        self.assertIs(get_inventory(), get_inventory())
+
+        nested = self.test_root / 'TEST' / 'nested'
+        nested.mkdir()
+        (nested / 'c.hfst').touch()
+        self.assertEqual(get_fsts('TEST'), ['TEST/a.hfst', 'TEST/b.hfstol', 'TEST/nested/c.hfst'])
+        self.assertTrue(dir_exists('TEST/nested'))
+
+        (self.test_root / 'TEST' / 'a.hfst').unlink()
+        shutil.rmtree(nested)
+        self.assertEqual(get_all_fsts(), ['TEST/b.hfstol'])
+        self.assertFalse(dir_exists('TEST/nested'))
+        self.assertGreater(get_inventory().generation, inventory.generation)
+        self.assertNotEqual(get_inventory().digest, inventory.digest)
+
+        # digest depends on the tree only, not on how it was indexed
+        (self.test_root / 'TEST' / 'a.hfst').touch()
+        self.assertEqual(get_inventory().digest, inventory.digest)
+
+    def test_reader_fsts_bounds(self):
+        # '-' sorts before '/', '2' after it
+        for name in ('TEST', 'TEST-x', 'TEST2'):
+            self.create_project(name, ['a.hfst', 'b.hfst'])
+        fsts, start, end = get_fsts_bounds('TEST')
+        self.assertIs(fsts, get_inventory().fsts)
+        self.assertEqual(fsts[start:end], ['TEST/a.hfst', 'TEST/b.hfst'])
+        fsts, start, end = get_fsts_bounds('missing')
+        self.assertEqual(start, end)
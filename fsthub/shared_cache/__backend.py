@@ -0,0 +1,165 @@
+"""Django cache backend shared by all processes of a host.
+
+Entries live in a single SQLite file in WAL mode, so every uwsgi or
+uvicorn worker reads what any other one wrote: throttle histories are
+counted per client instead of per worker, and a response computed once
+is served by all of them. No server runs besides the app.
+
+Entries may carry tags (`project:<dir>`, `fst:<file>`, ...),
+`invalidate_tags` drops every entry with any of the given tags.
+"""
+from typing import Any, Iterable, Optional
+from contextlib import contextmanager
+import threading
+import sqlite3
+import pickle
+import time
+import os
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+__all__ = ['SQLiteCache']
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS cache ('
+    '  key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_tags ('
+    '  tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key)'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_tags_key ON cache_tags (key)',
+]
+
+class SQLiteCache(BaseCache):
+    """`LOCATION` is the path of the database file.
+    `MAX_ENTRIES` and `CULL_FREQUENCY` work as in Django's DB cache.
+    """
+    def __init__(self, location: str, params: dict):
+        super().__init__(params)
+        self.path = location
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.pid = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections must not cross a fork
+        if self.conn is None or self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self.conn, self.pid = conn, os.getpid()
+        return self.conn
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _fetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        with self.lock:
+            return self._connection().execute(sql, tuple(params)).fetchone()
+
+    def _expires(self, timeout) -> Optional[float]:
+        return self.get_backend_timeout(timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and (row[0] is None or row[0] > now):
+                return False
+            self._store(conn, key, value, timeout, ())
+            return True
+
+    def get(self, key, default=None, version=None) -> Any:
+        key = self.make_and_validate_key(key, version=version)
+        row = self._fetchone('SELECT value, expires FROM cache WHERE key = ?', (key,))
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None) -> None:
+        self.set_tagged(key, value, (), timeout, version)
+
+    def set_tagged(self, key, value, tags: Iterable[str],
+                   timeout=DEFAULT_TIMEOUT, version=None) -> None:
+        """`set` that attaches `tags` to the entry"""
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            self._store(conn, key, value, timeout, tags)
+            self._cull(conn)
+
+    def _store(self, conn: sqlite3.Connection, key: str, value,
+               timeout, tags: Iterable[str]) -> None:
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                     (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires(timeout)))
+        conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+        conn.executemany('INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)',
+                         [(tag, key) for tag in tags])
+
+    def _cull(self, conn: sqlite3.Connection) -> None:
+        count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count <= self._max_entries:
+            return
+        conn.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries and self._cull_frequency:
+            # entries closest to expiry go first
+            conn.execute('DELETE FROM cache WHERE key IN ('
+                         '  SELECT key FROM cache ORDER BY expires IS NULL, expires LIMIT ?'
+                         ')', (count // self._cull_frequency,))
+        conn.execute('DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache)')
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            return conn.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (self._expires(timeout), key, time.time())
+            ).rowcount > 0
+
+    def delete(self, key, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            return conn.execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+    def has_key(self, key, version=None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+        row = self._fetchone('SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                             (key, time.time()))
+        return row is not None
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Delete entries with any of `tags`, returns how many"""
+        tags = list(tags)
+        if not tags:
+            return 0
+        marks = ', '.join('?' * len(tags))
+        with self._transaction() as conn:
+            tagged = f'SELECT key FROM cache_tags WHERE tag IN ({marks})'
+            deleted = conn.execute(f'DELETE FROM cache WHERE key IN ({tagged})', tags).rowcount
+            conn.execute(f'DELETE FROM cache_tags WHERE key IN ({tagged})', tags)
+        return deleted
+
+    def clear(self) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM cache')
+            conn.execute('DELETE FROM cache_tags')
+
+    def close(self, **kwargs) -> None:
+        # kept open between requests, SQLite connections are cheap to hold
+        pass
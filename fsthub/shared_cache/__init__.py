@@ -0,0 +1,2 @@
+from .__backend import *
+from .__watcher import *
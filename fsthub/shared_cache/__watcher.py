@@ -0,0 +1,137 @@
+"""Invalidation of cached responses when transducers change on disk.
+
+One process of the host, whichever holds the `<cache file>.watcher.lock`
+flock, polls `HFST_CONTENT_ROOT` every `HFST_CACHE_WATCH_INTERVAL`
+seconds and compares sizes and mtimes of all transducers with the last
+snapshot, kept in the cache itself. Only tags of what changed are
+invalidated:
+- `fst:<file>` and `project:<dir>` of an added, replaced or deleted transducer
+- `inventory` when transducers were added or deleted
+Other processes retry the lock, so one of them takes over when the
+watching one exits.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+import threading
+import logging
+import fcntl
+import time
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+
+from project_reader import get_inventory
+from .__backend import SQLiteCache
+
+__all__ = ['fst_tags', 'content_snapshot', 'changed_tags',
+           'ContentWatcher', 'get_response_cache', 'start_watcher']
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'shared_cache:content-snapshot'
+
+Snapshot = Dict[str, Tuple[int, int]]
+
+def fst_tags(fst_file: str) -> List[str]:
+    """Tags of responses that depend on a transducer"""
+    return [f'fst:{fst_file}', f'project:{fst_file.split("/", 1)[0]}']
+
+def content_snapshot() -> Snapshot:
+    """`(size, mtime_ns)` of every transducer in the content root"""
+    snapshot = {}
+    for fst_file in get_inventory().fsts:
+        try:
+            st = os.stat(settings.HFST_CONTENT_ROOT / fst_file)
+        except OSError:
+            continue
+        snapshot[fst_file] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+def changed_tags(old: Snapshot, new: Snapshot) -> Set[str]:
+    tags = set()
+    for fst_file in old.keys() | new.keys():
+        if old.get(fst_file) != new.get(fst_file):
+            tags.update(fst_tags(fst_file))
+    if old.keys() != new.keys():
+        tags.add('inventory')
+    return tags
+
+def get_response_cache() -> Optional[SQLiteCache]:
+    """Cache of `HFST_RESPONSE_CACHE`, `None` if disabled or not taggable"""
+    if not settings.HFST_RESPONSE_CACHE:
+        return None
+    cache = caches[settings.HFST_RESPONSE_CACHE]
+    return cache if isinstance(cache, SQLiteCache) else None
+
+class ContentWatcher:
+    def __init__(self, cache: SQLiteCache, interval: float):
+        self.cache = cache
+        self.interval = interval
+        self.lock_path = f'{cache.path}.watcher.lock'
+        self.lock_fd: Optional[int] = None
+
+    def poll(self) -> Set[str]:
+        """Invalidate tags of transducers changed since the last poll, returns them"""
+        new = content_snapshot()
+        old = self.cache.get(SNAPSHOT_KEY)
+        if old is None:
+            # nothing is known about what's cached, everything is suspect
+            tags = changed_tags({}, new) | {'inventory'}
+        else:
+            tags = changed_tags(old, new)
+        if tags:
+            deleted = self.cache.invalidate_tags(tags)
+            logger.info(f'Invalidated {deleted} cached responses of {len(tags)} tags')
+        self.cache.set(SNAPSHOT_KEY, new, timeout=None)
+        return tags
+
+    def _try_lock(self) -> bool:
+        if self.lock_fd is not None:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        return True
+
+    def run(self) -> None:
+        while True:
+            try:
+                if self._try_lock():
+                    self.poll()
+            except Exception as e:
+                logger.warning(f'Content watcher failed: {e}')
+            time.sleep(self.interval)
+
+_watcher: Optional[ContentWatcher] = None
+_watcher_lock = threading.Lock()
+_pid = os.getpid()
+
+def start_watcher() -> None:
+    """Start the watcher thread of this process, once"""
+    global _watcher
+    cache = get_response_cache()
+    if cache is None or not settings.HFST_CACHE_WATCH_INTERVAL:
+        return
+    if os.getpid() != _pid:
+        _reset_after_fork()
+    with _watcher_lock:
+        if _watcher is not None:
+            return
+        _watcher = ContentWatcher(cache, settings.HFST_CACHE_WATCH_INTERVAL)
+        threading.Thread(target=_watcher.run, name='content-watcher', daemon=True).start()
+
+def _reset_after_fork() -> None:
+    # the thread and the lock stay with the parent
+    global _watcher, _watcher_lock, _pid
+    _pid = os.getpid()
+    if _watcher is not None and _watcher.lock_fd is not None:
+        os.close(_watcher.lock_fd)
+    _watcher = None
+    _watcher_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,89 @@
+from unittest import TestCase
+from pathlib import Path
+import shutil
+import time
+import os
+
+from django.test import override_settings
+
+from . import SQLiteCache, ContentWatcher, changed_tags
+
+class TestSharedCache(TestCase):
+    test_root = Path(__file__).parent / 'tmp'
+
+    def setUp(self):
+        self.test_root.mkdir(exist_ok=True)
+        self.location = str(self.test_root / 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 2}})
+
+    def tearDown(self):
+        shutil.rmtree(self.test_root, ignore_errors=True)
+
+    def test_shared_cache_between_processes(self):
+        self.cache.set('answer', {'value': 42})
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.cache.set('from_child', [1, 2])
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        other = SQLiteCache(self.location, {})
+        self.assertEqual(other.get('answer'), {'value': 42})
+        self.assertEqual(other.get('from_child'), [1, 2])
+
+    def test_shared_cache_expiry_and_add(self):
+        self.assertTrue(self.cache.add('key', 1, timeout=0.05))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.cache.add('key', 3))
+        self.assertEqual(self.cache.incr('key'), 4)
+        self.assertTrue(self.cache.delete('key'))
+        self.assertFalse(self.cache.delete('key'))
+
+    def test_shared_cache_culls(self):
+        for i in range(20):
+            self.cache.set(f'key{i}', i)
+        self.assertLessEqual(sum(self.cache.has_key(f'key{i}') for i in range(20)), 10)
+        self.assertTrue(self.cache.has_key('key19'))
+
+    def test_shared_cache_invalidate_tags(self):
+        self.cache.set_tagged('a', 1, ['fst:p/a.hfst', 'project:p'])
+        self.cache.set_tagged('b', 2, ['fst:p/b.hfst', 'project:p'])
+        self.cache.set_tagged('c', 3, ['fst:q/c.hfst', 'project:q'])
+        self.assertEqual(self.cache.invalidate_tags(['fst:p/a.hfst']), 1)
+        self.assertEqual([self.cache.get(k) for k in 'abc'], [None, 2, 3])
+        self.assertEqual(self.cache.invalidate_tags(['project:p', 'project:q']), 2)
+        self.assertEqual(self.cache.invalidate_tags(['project:p']), 0)
+
+    def test_shared_cache_watcher(self):
+        content_root = self.test_root / 'content'
+        (content_root / 'p').mkdir(parents=True)
+        (content_root / 'q').mkdir()
+        (content_root / 'p' / 'a.hfst').write_bytes(b'v1')
+        (content_root / 'q' / 'c.hfst').write_bytes(b'v1')
+        with override_settings(HFST_CONTENT_ROOT=content_root):
+            watcher = ContentWatcher(self.cache, interval=1)
+            watcher.poll()
+            self.cache.set_tagged('a', 1, ['fst:p/a.hfst', 'project:p'])
+            self.cache.set_tagged('c', 3, ['fst:q/c.hfst', 'project:q'])
+            self.cache.set_tagged('list', [], ['inventory'])
+            self.assertEqual(watcher.poll(), set())
+
+            # replaced file, only its entries go
+            (content_root / 'p' / 'a.hfst').write_bytes(b'version 2')
+            self.assertEqual(watcher.poll(), {'fst:p/a.hfst', 'project:p'})
+            self.assertEqual([self.cache.get(k) for k in ('a', 'c', 'list')], [None, 3, []])
+
+            (content_root / 'q' / 'd.hfst').write_bytes(b'')
+            self.assertIn('inventory', watcher.poll())
+            self.assertEqual([self.cache.get(k) for k in ('c', 'list')], [None, None])
+
+    def test_shared_cache_changed_tags(self):
+        old = {'p/a.hfst': (1, 1), 'q/c.hfst': (1, 1)}
+        self.assertEqual(changed_tags(old, dict(old)), set())
+        self.assertEqual(changed_tags(old, {'p/a.hfst': (1, 1)}),
+                         {'fst:q/c.hfst', 'project:q', 'inventory'})
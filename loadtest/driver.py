@@ -0,0 +1,184 @@
+"""Load generation and latency statistics."""
+from typing import Dict, Iterable, Iterator, List, Optional
+from collections import Counter
+import threading
+import random
+import json
+import math
+import time
+
+import requests
+
+class Request:
+    __slots__ = ('name', 'method', 'path', 'body', 't')
+
+    def __init__(self, name: str, method: str, path: str,
+                 body: Optional[dict] = None, t: Optional[float] = None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.t = t
+
+    def asdict(self) -> dict:
+        record = {'name': self.name, 'method': self.method, 'path': self.path}
+        if self.body is not None:
+            record['body'] = self.body
+        if self.t is not None:
+            record['t'] = round(self.t, 6)
+        return record
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+class Stats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses = Counter()
+        self.errors = 0
+
+    def add(self, latency: float, status: Optional[int]) -> None:
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        if status is None or status >= 400:
+            self.errors += 1
+
+    def merge(self, other: 'Stats') -> None:
+        self.latencies.extend(other.latencies)
+        self.statuses.update(other.statuses)
+        self.errors += other.errors
+
+    def summary(self, seconds: float) -> dict:
+        values = sorted(self.latencies)
+        return {
+            'requests': len(values),
+            'errors': self.errors,
+            'rps': len(values) / seconds if seconds else 0.0,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items(), key=str)},
+        }
+
+# Scenarios
+WORDS = ['ping', 'talo', 'kirja', 'sana', 'koira', 'kissa', 'vesi', 'puu', 'maa', 'kala', '42']
+
+def mixed_requests(fsts: List[str], projects: List[str], types: List[str],
+                   languages: List[str], seed: int = 0) -> Iterator[Request]:
+    """Endless mix of API requests, weighted roughly like real traffic"""
+    rng = random.Random(seed)
+    makers = [
+        (50, lambda: Request('call', 'POST', '/api/fst/call/', {
+            'hfst_file': rng.choice(fsts),
+            'fst_input': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))),
+            'output_format': rng.choice(['xerox', 'cg', 'apertium']),
+        })),
+        (10, lambda: Request('metadata', 'GET', f'/api/fst/metadata/?hfst_file={rng.choice(fsts)}')),
+        (10, lambda: Request('example', 'GET', f'/api/fst/example/?hfst_file={rng.choice(fsts)}')),
+        (10, lambda: Request('filter', 'GET', '/api/fst/filter/?' + rng.choice(
+            [f'type={t}' for t in types] + [f'lang={l}' for l in languages] or [''])
+        )),
+        (5, lambda: Request('projects', 'GET', '/api/project/')),
+        (10, lambda: Request('project_fsts', 'GET',
+                             f'/api/project/transducers/?project={rng.choice(projects)}')),
+        (5, lambda: Request('fsts', 'GET', '/api/fst/')),
+    ]
+    weights = [w for w, _ in makers]
+    while True:
+        _, make = rng.choices(makers, weights)[0]
+        yield make()
+
+def read_log(path: str) -> List[Request]:
+    """Recorded requests, one JSON object per line"""
+    log = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                log.append(Request(r.get('name') or r['path'].split('?')[0],
+                                   r.get('method', 'GET'), r['path'], r.get('body'), r.get('t')))
+    return log
+
+# Driver
+def run_level(base_url: str, source: Iterable[Request], concurrency: int,
+              duration: Optional[float] = None, count: Optional[int] = None,
+              pace: bool = False, timeout: float = 60,
+              record: Optional[List[Request]] = None) -> Dict[str, dict]:
+    """Send requests from `concurrency` threads until `duration` seconds pass,
+    `count` requests are sent or `source` runs out. With `pace` requests
+    are not sent before their recorded offset `t`.
+    """
+    source = iter(source)
+    lock = threading.Lock()
+    started = time.monotonic()
+    sent = 0
+    per_thread: List[Dict[str, Stats]] = []
+
+    def next_request() -> Optional[Request]:
+        nonlocal sent
+        with lock:
+            if count is not None and sent >= count:
+                return None
+            if duration is not None and time.monotonic() - started >= duration:
+                return None
+            request = next(source, None)
+            if request is None:
+                return None
+            sent += 1
+            if record is not None:
+                record.append(Request(request.name, request.method, request.path,
+                                      request.body, time.monotonic() - started))
+            return request
+
+    def worker() -> None:
+        stats: Dict[str, Stats] = {}
+        per_thread.append(stats)
+        session = requests.Session()
+        while True:
+            request = next_request()
+            if request is None:
+                break
+            if pace and request.t is not None:
+                delay = started + request.t - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            t0 = time.perf_counter()
+            try:
+                response = session.request(request.method, base_url + request.path,
+                                           json=request.body, timeout=timeout)
+                code = response.status_code
+            except requests.RequestException:
+                code = None
+            stats.setdefault(request.name, Stats()).add(time.perf_counter() - t0, code)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.monotonic() - started
+
+    merged: Dict[str, Stats] = {}
+    total = Stats()
+    for stats in per_thread:
+        for name, s in stats.items():
+            merged.setdefault(name, Stats()).merge(s)
+            total.merge(s)
+    report = {name: s.summary(seconds) for name, s in sorted(merged.items())}
+    report['total'] = total.summary(seconds)
+    return report
+
+def format_report(results: Dict[int, Dict[str, dict]]) -> str:
+    lines = [f'{"conc":>5} {"endpoint":<14} {"requests":>8} {"errors":>6} '
+             f'{"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}']
+    for concurrency, report in results.items():
+        for name, s in report.items():
+            lines.append(
+                f'{concurrency:>5} {name:<14} {s["requests"]:>8} {s["errors"]:>6} '
+                f'{s["rps"]:>8.1f} {s["p50_ms"]:>8.1f} {s["p95_ms"]:>8.1f} {s["p99_ms"]:>8.1f}'
+            )
+    return '\n'.join(lines)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Load test of the FSThub API.
+
+Generates a content root of stub transducers, starts the app on it with
+the stub hfst tools from `stub_hfst.py` on PATH, drives the API at each
+concurrency level and reports throughput and p50/p95/p99 latency.
+
+    python loadtest/run.py --server uwsgi --concurrency 1,8,32 --duration 20
+    python loadtest/run.py --server uvicorn --workers 4 --stub-token-delay 0.001
+    python loadtest/run.py --record log.jsonl
+    python loadtest/run.py --replay log.jsonl --pace
+    python loadtest/run.py --url http://localhost:8000   # already running app
+
+Use --url against a deployment with real transducers, the content root
+and stubs are only set up for servers started here.
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+import subprocess
+import argparse
+import tempfile
+import shutil
+import socket
+import json
+import time
+import sys
+import os
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent))
+from driver import Request, format_report, mixed_requests, read_log, run_level
+
+REPO = Path(__file__).resolve().parent.parent
+APP = REPO / 'fsthub'
+STUB = Path(__file__).resolve().parent / 'stub_hfst.py'
+TOOLS = ['hfst-proc', 'hfst-lookup', 'hfst-edit-metadata', 'hfst-fst2strings']
+LANGUAGES = ['fin', 'sme', 'kaz', 'tat', 'rus', 'ady', 'kir', 'tyv']
+
+def make_content_root(root: Path, projects: int, fsts_per_project: int) -> None:
+    """`project_N/<lang>_<type>_N.hfstol`, names match projectsautoinit type markers"""
+    kinds = ['ana', 'gen', '2lat']
+    for p in range(projects):
+        project = root / f'project_{p}'
+        project.mkdir(parents=True)
+        for i in range(fsts_per_project):
+            lang = LANGUAGES[(p + i) % len(LANGUAGES)]
+            kind = kinds[i % len(kinds)]
+            name = f'{lang}{kind}_{i}.hfstol' if kind.startswith('2') else f'{lang}_{kind}_{i}.hfstol'
+            # not an HFST header, so native lookup falls back to the stub hfst-proc
+            (project / name).write_bytes(b'STUB\n')
+
+def make_stub_bin(bin_dir: Path) -> None:
+    bin_dir.mkdir(parents=True)
+    STUB.chmod(0o755)
+    for tool in TOOLS:
+        (bin_dir / tool).symlink_to(STUB)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def server_command(server: str, port: int, workers: int) -> List[str]:
+    if server == 'uwsgi':
+        return ['uwsgi', '--http', f'127.0.0.1:{port}', '--wsgi-file', 'fsthub/wsgi.py',
+                '--master', '--processes', str(workers), '--threads', '4',
+                '--die-on-term', '--disable-logging']
+    if server == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'fsthub.asgi:application',
+                '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    if server == 'runserver':
+        return [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+    raise ValueError(f'Unknown server {server}')
+
+def wait_ready(base_url: str, proc: subprocess.Popen, log: Path, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f'Server exited with code {proc.returncode}:\n{log.read_text()[-2000:]}')
+        try:
+            if requests.get(base_url + '/api/fst/', timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    sys.exit(f'Server did not answer in {timeout}s')
+
+def discover(base_url: str) -> Dict[str, List[str]]:
+    """Transducers, projects, types and languages to build requests from"""
+    get = lambda path: requests.get(base_url + path, timeout=30).json()
+    return {
+        'fsts': [x['name'] for x in get('/api/fst/')['results']],
+        'projects': [x['name'] for x in get('/api/project/')['results']],
+        'types': [x['name'] for x in get('/api/fst_type/')],
+        'languages': [x['name'] for x in get('/api/fst_language/')],
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--server', choices=['uwsgi', 'uvicorn', 'runserver'], default='uwsgi',
+                        help='How to start the app (WSGI: uwsgi, runserver; ASGI: uvicorn)')
+    parser.add_argument('--url', help='Test an already running app instead of starting one')
+    parser.add_argument('--workers', type=int, default=2, help='Server processes')
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--fsts-per-project', type=int, default=20)
+    parser.add_argument('--stub-delay', type=float, default=0.05,
+                        help='Seconds a stub hfst process takes to start')
+    parser.add_argument('--stub-token-delay', type=float, default=0.0,
+                        help='Seconds a stub hfst process takes per token')
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='Comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds per concurrency level')
+    parser.add_argument('--requests', type=int, help='Requests per concurrency level')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', help='Replay a request log (JSON lines) instead of the mix')
+    parser.add_argument('--pace', action='store_true',
+                        help='Keep the recorded timing of a replayed log')
+    parser.add_argument('--record', help='Write the sent requests to a log')
+    parser.add_argument('--json', help='Write results as JSON')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the generated data directory and server log')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    levels = [int(x) for x in args.concurrency.split(',') if x]
+    workdir = Path(tempfile.mkdtemp(prefix='fsthub-loadtest-'))
+    proc = None
+    try:
+        base_url = args.url.rstrip('/') if args.url else None
+        if base_url is None:
+            data_dir = workdir / 'data'
+            make_content_root(data_dir / 'hfst_projects', args.projects, args.fsts_per_project)
+            make_stub_bin(workdir / 'bin')
+            env = dict(os.environ,
+                       PATH=f'{workdir / "bin"}{os.pathsep}{os.environ.get("PATH", "")}',
+                       FSTHUB_DATA_DIR=str(data_dir),
+                       FSTHUB_THROTTLE_BURST='1000000/s',
+                       FSTHUB_THROTTLE_SUSTAINED='1000000/s',
+                       FSTHUB_STUB_DELAY=str(args.stub_delay),
+                       FSTHUB_STUB_TOKEN_DELAY=str(args.stub_token_delay),
+                       DJANGO_SETTINGS_MODULE='fsthub.settings')
+            for command in (['migrate', '-v', '0'], ['projectsautoinit']):
+                subprocess.run([sys.executable, 'manage.py', *command], cwd=APP, env=env,
+                               check=True, stdout=subprocess.DEVNULL)
+            port = free_port()
+            base_url = f'http://127.0.0.1:{port}'
+            server_log = open(workdir / 'server.log', 'wb')
+            proc = subprocess.Popen(server_command(args.server, port, args.workers),
+                                    cwd=APP, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+            wait_ready(base_url, proc, workdir / 'server.log')
+
+        log = read_log(args.replay) if args.replay else None
+        if log is None:
+            inventory = discover(base_url)
+            if not inventory['fsts']:
+                sys.exit('No transducers to test')
+        record: Optional[List[Request]] = [] if args.record else None
+        results = {}
+        for concurrency in levels:
+            source = log if log is not None else mixed_requests(seed=args.seed, **inventory)
+            results[concurrency] = run_level(
+                base_url, source, concurrency,
+                duration=None if log is not None or args.requests else args.duration,
+                count=args.requests, pace=args.pace, record=record,
+            )
+            print(f'concurrency {concurrency}: {results[concurrency]["total"]["rps"]:.1f} rps',
+                  file=sys.stderr)
+        print(format_report(results))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'server': args.url or args.server, 'results': results}, f, indent=2)
+        if args.record:
+            with open(args.record, 'w') as f:
+                for request in record:
+                    f.write(json.dumps(request.asdict(), ensure_ascii=False) + '\n')
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if args.keep:
+            print(f'Data kept in {workdir}', file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
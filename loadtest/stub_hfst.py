@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Stand-in for the hfst command line tools used by the app.
+
+The harness symlinks it as `hfst-proc`, `hfst-lookup`, `hfst-edit-metadata`
+and `hfst-fst2strings`, the tool is picked by the name it was called with.
+Transducer files are not read, outputs are made up from the input.
+
+Delays, in seconds:
+    FSTHUB_STUB_DELAY        once per process start (loading a transducer)
+    FSTHUB_STUB_TOKEN_DELAY  per looked up token
+"""
+import random
+import time
+import sys
+import os
+
+START_DELAY = float(os.getenv('FSTHUB_STUB_DELAY', '0') or 0)
+TOKEN_DELAY = float(os.getenv('FSTHUB_STUB_TOKEN_DELAY', '0') or 0)
+FORMATS = ('xerox', 'cg', 'apertium')
+
+def analyses(token: str):
+    if token.isdigit():
+        return []
+    return [f'{token}<n><sg>', f'{token[::-1]}<v><pres>']
+
+def proc_format(token: str, oformat: str) -> str:
+    if TOKEN_DELAY:
+        time.sleep(TOKEN_DELAY)
+    outs = analyses(token)
+    if oformat == 'apertium':
+        return '^' + '/'.join([token] + (outs or ['*' + token])) + '$ '
+    if oformat == 'cg':
+        lines = [f'"<{token}>"\n']
+        for out in outs or ['*' + token]:
+            lemma, _, tags = out.partition('<')
+            tags = ('<' + tags).replace('><', ' ').strip('<>') if tags else ''
+            lines.append(f'\t"{lemma}"' + (f' {tags}' if tags else '') + '\n')
+        return ''.join(lines)
+    if not outs:
+        return f'{token}\t{token}\t+?\n\n'
+    return ''.join(f'{token}\t{out}\n' for out in outs) + '\n'
+
+def lookup_format(token: str, oformat: str) -> str:
+    if TOKEN_DELAY:
+        time.sleep(TOKEN_DELAY)
+    outs = analyses(token)
+    if not outs:
+        return f'{token}\t{token}+?\tinf\n\n'
+    return ''.join(f'{token}\t{out}\t0.000000\n' for out in outs) + '\n'
+
+def transducer(args) -> str:
+    files = [a for a in args if not a.startswith('-') and not a.isdigit() and a not in FORMATS]
+    if not files or not os.path.isfile(files[-1]):
+        sys.stdout.write(f'{files[-1] if files else "transducer"}: No such file\n')
+        sys.exit(1)
+    return files[-1]
+
+def option(args, name: str, default: str) -> str:
+    return args[args.index(name) + 1] if name in args else default
+
+def hfst_proc(args) -> None:
+    transducer(args)
+    oformat = next((f for f in FORMATS if f'--{f}' in args), 'apertium')
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    if '--null-flush' not in args:
+        text = stdin.read().decode()
+        stdout.write(''.join(proc_format(t, oformat) for t in text.split()).encode())
+        return
+    # one frame per `\0`, answered right away like `hfst-proc --null-flush`
+    frame = b''
+    while True:
+        chunk = os.read(stdin.fileno(), 65536)
+        if not chunk:
+            break
+        frame += chunk
+        while b'\0' in frame:
+            text, _, frame = frame.partition(b'\0')
+            output = ''.join(proc_format(t, oformat) for t in text.decode().split())
+            stdout.write(output.encode() + b'\0')
+            stdout.flush()
+
+def hfst_lookup(args) -> None:
+    transducer(args)
+    oformat = option(args, '--output-format', 'xerox')
+    for line in sys.stdin:
+        if line.strip():
+            sys.stdout.write(lookup_format(line.strip(), oformat))
+
+def hfst_edit_metadata(args) -> None:
+    path = transducer(args)
+    name = os.path.basename(path)
+    sys.stdout.write(f'name: {name}\nlanguage: {name.split("_")[0]}\nauthor: loadtest\n')
+
+def hfst_fst2strings(args) -> None:
+    path = transducer(args)
+    count = int(option(args, '--random', option(args, '--max-strings', '10')))
+    rng = random.Random(path if '--random' not in args else None)
+    for _ in range(count):
+        token = ''.join(rng.choice('abcdefghijklmnop') for _ in range(rng.randint(3, 9)))
+        sys.stdout.write(f'{token}:{analyses(token)[0]}\n')
+
+TOOLS = {
+    'hfst-proc': hfst_proc,
+    'hfst-lookup': hfst_lookup,
+    'hfst-edit-metadata': hfst_edit_metadata,
+    'hfst-fst2strings': hfst_fst2strings,
+}
+
+if __name__ == '__main__':
+    tool = os.path.basename(sys.argv[0])
+    if tool not in TOOLS:
+        sys.exit(f'{tool}: not one of {", ".join(TOOLS)}')
+    if START_DELAY:
+        time.sleep(START_DELAY)
+    TOOLS[tool](sys.argv[1:])